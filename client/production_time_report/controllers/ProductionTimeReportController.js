@@ -130,6 +130,8 @@ export function ProductionTimeReportController(
                     min: false,
                     max: false,
                     sum: false,
+                    median: false,
+                    p90: false,
                 },
             }),
         };
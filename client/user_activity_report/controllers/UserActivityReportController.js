@@ -250,6 +250,9 @@ export function UserActivityReportController(
 
         const params = _.cloneDeep($scope.currentParams.params);
 
+        // The full timeline is only returned for the selected item (when using the lock sessions)
+        params.timeline_item = _.get($scope.selectedItem || $scope.previousSelectedItem, '_id') || null;
+
         return $scope.runQuery(params)
             .then((data) => {
                 this.createChart(
@@ -293,6 +296,14 @@ export function UserActivityReportController(
                 $scope.selectedItem = $scope.previousSelectedItem;
             }
 
+            // Use the selected item from the new report, which includes its full timeline
+            if ($scope.selectedItem !== null) {
+                $scope.selectedItem = _.find(
+                    items,
+                    (item) => _.get(item, '_id') === _.get($scope, 'selectedItem._id')
+                ) || $scope.selectedItem;
+            }
+
             configs.push(this.genChartConfig(report));
 
             if ($scope.selectedItem !== null) {
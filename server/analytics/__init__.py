@@ -33,6 +33,7 @@ from analytics.featuremedia_updates_report import (
     init_app as init_featuremedia_updates_report,
 )
 from analytics.update_time_report import init_app as init_update_time_report
+from analytics.metadata_cache import init_app as init_metadata_cache
 
 from analytics.commands import SendScheduledReports  # noqa
 from analytics.common import get_highcharts_cli_path, register_report
@@ -76,6 +77,8 @@ def init_schedule_task(app):
 
 
 def init_app(app):
+    init_metadata_cache(app)
+
     endpoint_name = "scheduled_reports"
     service = ScheduledReportsService(endpoint_name, backend=superdesk.get_backend())
     ScheduledReportsResource(endpoint_name, app=app, service=service)
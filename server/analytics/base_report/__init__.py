@@ -11,12 +11,13 @@
 from flask import json, current_app as app
 from eve_elastic.elastic import set_filters, ElasticCursor
 
-from superdesk import get_resource_service, es_utils
+from superdesk import es_utils
 from superdesk.resource import Resource
 from superdesk.utils import ListCursor
 from superdesk.utc import utcnow, get_timezone_offset
 from superdesk.errors import SuperdeskApiError
 from superdesk.es_utils import REPOS
+from superdesk.logging import logger
 
 from apps.search import SearchService
 
@@ -27,6 +28,11 @@ from analytics.common import (
     DATE_FILTERS,
     relative_to_absolute_datetime,
 )
+from analytics.metadata_cache import get_metadata
+from analytics.base_report.report_cache import report_cache, get_index_watermark
+from analytics.base_report.single_flight import single_flight
+
+from copy import deepcopy
 
 
 class BaseReportResource(Resource):
@@ -59,13 +65,15 @@ class BaseReportService(SearchService):
     defaultConfig = {}
     repos = REPOS
 
+    # Only fetch the aggregations of the query if the items are not requested (see ``is_aggregations_only``)
+    aggregations_only = True
+
     def get_stages_to_exclude(self):
         """
         Overriding from the base SearchService so we can control which stages to include.
         """
         if self.exclude_stages_with_global_read_off:
-            stages = get_resource_service("stages").get_stages_by_visibility(is_visible=False)
-            return [str(stage["_id"]) for stage in stages]
+            return list(get_metadata("invisible_stages"))
 
         return []
 
@@ -245,6 +253,35 @@ class BaseReportService(SearchService):
     def get_elastic_index(self, types):
         return es_utils.get_index(types)
 
+    def get_query_repos(self, params):
+        types = params.get("repo")
+        if not types:
+            return self.repos.copy()
+
+        types = types.split(",")
+        # If the repos array is still empty after filtering, then return the default repos
+        return [repo for repo in types if repo in self.repos] or self.repos.copy()
+
+    def get_cache_watermark(self, params, args):
+        """Get the watermark of the data of the report, which changes when the report needs to be generated again
+
+        Defaults to the refresh count of the elastic index. Reports using the archive statistics use the
+        generation of the statistics instead (see ``get_stats_watermark``).
+        """
+
+        return get_index_watermark(self.get_elastic_index(self.get_query_repos(params)))
+
+    def get_cache_key(self, params, args):
+        """Get the key of the report in the ``report_cache`` (None if the report should not be cached)"""
+
+        try:
+            watermark = self.get_cache_watermark(params, args)
+        except Exception:
+            logger.exception("Failed to get the watermark of report {}".format(self.datasource))
+            return None
+
+        return report_cache.get_key(self.datasource, args, watermark)
+
     def run_query(self, params, args):
         query = params.get("source") or {}
         if "query" not in query:
@@ -254,13 +291,11 @@ class BaseReportService(SearchService):
         if aggs:
             query["aggs"] = aggs
 
-        types = params.get("repo")
-        if not types:
-            types = self.repos.copy()
-        else:
-            types = types.split(",")
-            # If the repos array is still empty after filtering, then return the default repos
-            types = [repo for repo in types if repo in self.repos] or self.repos.copy()
+        aggregations_only = self.is_aggregations_only(query, args)
+        if aggregations_only:
+            query["size"] = 0
+
+        types = self.get_query_repos(params)
 
         excluded_stages = self.get_stages_to_exclude()
         filters = self._get_filters(types, excluded_stages)
@@ -274,15 +309,52 @@ class BaseReportService(SearchService):
 
         index = self.get_elastic_index(types)
 
-        docs = self.elastic.search(query, types, params={})
+        # Identical queries running at the same time share the one elastic request.
+        # Each caller gets its own copy of the response, and runs the fetched hooks on it
+        timeout = float(app.config.get("ANALYTICS_REPORT_COALESCE_TIMEOUT", 5))
+        if timeout <= 0:
+            docs = self.search_elastic(query, types, aggregations_only)
+        else:
+            docs = single_flight.do(
+                single_flight.get_key(index, types, query, aggregations_only),
+                lambda: self.search_elastic(query, types, aggregations_only),
+                timeout,
+                copy=deepcopy,
+            )
+
+        if not aggregations_only:
+            self.on_fetched(docs, types)
+
+        return docs
+
+    def is_aggregations_only(self, query, args):
+        """Returns True if the report only uses the aggregations of the query (and not its hits)"""
+
+        if not self.aggregations_only or not query.get("aggs") or args.get("aggs", 1) == 0:
+            return False
+
+        return not ("include_items" in args and int(args["include_items"]))
+
+    def search_elastic(self, query, types, aggregations_only=False):
+        if aggregations_only:
+            # Only return the aggregations (and total), and use the shard request cache of elastic.
+            # There are no hits, so the on_fetched_resource hooks are not called
+            return self.elastic.search(
+                query,
+                types,
+                params={"request_cache": "true", "filter_path": "aggregations,hits.total"},
+            )
+
+        return self.elastic.search(query, types, params={})
+
+    def on_fetched(self, docs, types):
+        """Run the ``on_fetched_resource`` hooks on the hits of the query"""
 
         for resource in types:
             response = {app.config["ITEMS"]: [doc for doc in docs if doc["_type"] == resource]}
             getattr(app, "on_fetched_resource")(resource, response)
             getattr(app, "on_fetched_resource_%s" % resource)(response)
 
-        return docs
-
     def get(self, req, **lookup):
         args = self._get_request_or_lookup(req, **lookup)
 
@@ -299,6 +371,27 @@ class BaseReportService(SearchService):
         else:
             raise SuperdeskApiError.badRequestError("source/query not provided")
 
+        cache_key = self.get_cache_key(params, args) if report_cache.is_enabled() else None
+        report = report_cache.get(cache_key) if cache_key else None
+
+        if report is None:
+            report = self.generate(params, args)
+
+            # Reports returning a cursor (i.e. the search results) are not cached
+            if cache_key and isinstance(report, (dict, list)):
+                report_cache.set(cache_key, report, report_cache.get_ttl(args))
+
+        if isinstance(report, list):
+            return ListCursor(report)
+        elif isinstance(report, ListCursor):
+            return report
+        elif isinstance(report, ElasticCursor):
+            return report
+        return ListCursor([report])
+
+    def generate(self, params, args):
+        """Run the query and generate the report for the requested ``return_type``"""
+
         docs = self.run_query(params, args)
 
         if args["return_type"] == "highcharts_config":
@@ -313,13 +406,7 @@ class BaseReportService(SearchService):
         if "include_items" in args and int(args["include_items"]):
             report["_items"] = list(docs)
 
-        if isinstance(report, list):
-            return ListCursor(report)
-        elif isinstance(report, ListCursor):
-            return report
-        elif isinstance(report, ElasticCursor):
-            return report
-        return ListCursor([report])
+        return report
 
     def get_utc_offset(self):
         return get_timezone_offset(app.config["DEFAULT_TIMEZONE"], utcnow())
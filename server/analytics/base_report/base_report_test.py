@@ -845,3 +845,29 @@ class BaseReportServiceTestCase(TestCase):
             aggs=lookup["aggs"],
         )
         self.assertEqual(args, expected_args)
+
+    def test_is_aggregations_only(self):
+        with self.app.app_context():
+            query = {"query": {"filtered": {}}, "aggs": {"source": {"terms": {"field": "source"}}}}
+
+            self.assertTrue(self.service.is_aggregations_only(query, {}))
+            self.assertTrue(self.service.is_aggregations_only(query, {"include_items": "0"}))
+            self.assertFalse(self.service.is_aggregations_only(query, {"include_items": "1"}))
+            self.assertFalse(self.service.is_aggregations_only(query, {"aggs": 0}))
+            self.assertFalse(self.service.is_aggregations_only({"query": {"filtered": {}}}, {}))
+
+    def test_coalesced_results_are_copied_before_fetched_hooks(self):
+        shared = [{"_id": "item1", "_type": "published"}]
+
+        def coalesce(key, func, timeout, copy=None):
+            return copy(shared)
+
+        with self.app.app_context():
+            with mock.patch("analytics.base_report.single_flight.do", side_effect=coalesce):
+                with mock.patch.object(self.service, "on_fetched") as on_fetched:
+                    params = {"source": {"query": {"filtered": {}}}, "repo": "published"}
+                    results = [self.service.run_query(dict(params), {"include_items": "1"}) for _ in range(2)]
+
+        # The fetched hooks run on the copy of each caller, not the shared response
+        self.assertEqual([call[0][0] for call in on_fetched.call_args_list], results)
+        self.assertEqual(len({id(docs) for docs in results + [shared]}), 3)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import get_resource_service
+from superdesk.logging import logger
+
+from collections import OrderedDict
+from flask import json, current_app as app
+import hashlib
+import pickle
+import threading
+import time
+
+
+class MemoryCacheBackend:
+    """Least recently used cache of the generated reports, in the memory of this process
+
+    :param int max_size: Maximum number of reports to store
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._reports[key]
+            except KeyError:
+                return None
+
+            if expires <= time.monotonic():
+                del self._reports[key]
+                return None
+
+            self._reports.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._reports[key] = (time.monotonic() + ttl, value)
+            self._reports.move_to_end(key)
+
+            while len(self._reports) > self.max_size:
+                self._reports.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+
+
+class RedisCacheBackend:
+    """Cache of the generated reports in Redis, shared between all the processes
+
+    :param str url: The Redis url
+    """
+
+    #: Prefix of the keys stored in Redis
+    prefix = "analytics:report_cache:"
+
+    def __init__(self, url):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.redis.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.redis.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def clear(self):
+        for key in self.redis.scan_iter(match=self.prefix + "*"):
+            self.redis.delete(key)
+
+
+class ReportCache:
+    """Cache of the generated reports, keyed by the report, its args and a data watermark
+
+    The watermark changes when the data of the report changes (see ``BaseReportService.get_cache_watermark``),
+    so reports are generated again once there is new data. Reports with relative dates (``now``) expire after
+    ANALYTICS_REPORT_CACHE_RELATIVE_TTL config (60 seconds), other reports after ANALYTICS_REPORT_CACHE_TTL (3600).
+
+    The backend is selected using ANALYTICS_REPORT_CACHE config: ``memory`` for a per process LRU cache
+    (of ANALYTICS_REPORT_CACHE_SIZE reports), ``redis`` to use ANALYTICS_REPORT_CACHE_REDIS_URL (or REDIS_URL).
+    The cache is disabled if not set.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._backend = None
+        self._backend_name = None
+
+    def get_backend(self):
+        name = app.config.get("ANALYTICS_REPORT_CACHE") or None
+
+        if name != self._backend_name:
+            self._backend_name = name
+
+            if name == "memory":
+                self._backend = MemoryCacheBackend(int(app.config.get("ANALYTICS_REPORT_CACHE_SIZE", 1000)))
+            elif name == "redis":
+                self._backend = RedisCacheBackend(
+                    app.config.get("ANALYTICS_REPORT_CACHE_REDIS_URL") or app.config.get("REDIS_URL")
+                )
+            else:
+                if name is not None:
+                    logger.warning("Unknown report cache backend {}".format(name))
+
+                self._backend = None
+
+        return self._backend
+
+    def is_enabled(self):
+        return self.get_backend() is not None
+
+    @staticmethod
+    def get_key(report_type, args, watermark):
+        """Get the cache key of a report, from the args normalised to a canonical json string"""
+
+        key = json.dumps([report_type, args, watermark], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+    @staticmethod
+    def get_ttl(args):
+        """Get the seconds to cache a report for, shorter if its dates are relative to ``now``"""
+
+        if '"now' in json.dumps(args, default=str):
+            return int(app.config.get("ANALYTICS_REPORT_CACHE_RELATIVE_TTL", 60))
+
+        return int(app.config.get("ANALYTICS_REPORT_CACHE_TTL", 3600))
+
+    def get(self, key):
+        backend = self.get_backend()
+        if backend is None:
+            return None
+
+        try:
+            value = backend.get(key)
+        except Exception:
+            logger.exception("Failed to get report from the cache")
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        # Reports are stored serialised, so the cached report is not modified by the caller
+        return pickle.loads(value)
+
+    def set(self, key, report, ttl):
+        backend = self.get_backend()
+        if backend is None or ttl <= 0:
+            return
+
+        try:
+            backend.set(key, pickle.dumps(report, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+        except Exception:
+            logger.exception("Failed to store report in the cache")
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+
+        if self._backend is not None:
+            self._backend.clear()
+
+    def info(self):
+        return {"backend": self._backend_name, "hits": self.hits, "misses": self.misses}
+
+
+class WatermarkCache:
+    """Keeps the data watermarks in the memory of this process for a few seconds
+
+    So the watermark is requested from Mongo/Elastic at most once per ANALYTICS_REPORT_WATERMARK_TTL config
+    (5 seconds) per process, instead of for every report. New data is used by the reports after at most this delay.
+    """
+
+    def __init__(self):
+        self._watermarks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, get_watermark):
+        """Get the watermark ``name``, using ``get_watermark`` if it is not cached (or has expired)"""
+
+        ttl = float(app.config.get("ANALYTICS_REPORT_WATERMARK_TTL", 5))
+        now = time.monotonic()
+
+        with self._lock:
+            expires, watermark = self._watermarks.get(name) or (0, None)
+
+        if expires > now:
+            return watermark
+
+        watermark = get_watermark()
+
+        if ttl > 0:
+            with self._lock:
+                self._watermarks[name] = (now + ttl, watermark)
+
+        return watermark
+
+    def clear(self):
+        with self._lock:
+            self._watermarks.clear()
+
+
+def get_stats_watermark():
+    """Get the watermark of the archive statistics, which changes each time a chunk of statistics is written"""
+
+    def get_generation():
+        return ["stats", get_resource_service("archive_statistics").get_generation()]
+
+    return watermark_cache.get(("stats",), get_generation)
+
+
+def get_index_watermark(index):
+    """Get the watermark of an Elasticsearch index, which changes each time the index is refreshed"""
+
+    def get_refresh_count():
+        stats = app.data.elastic.es.indices.stats(index=index, metric="refresh")
+        refresh = ((stats.get("_all") or {}).get("total") or {}).get("refresh") or {}
+        return [index, refresh.get("total")]
+
+    return watermark_cache.get(("index", index), get_refresh_count)
+
+
+report_cache = ReportCache()
+watermark_cache = WatermarkCache()
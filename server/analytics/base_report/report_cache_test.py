@@ -0,0 +1,107 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics import init_app
+from analytics.base_report.report_cache import ReportCache, MemoryCacheBackend, get_stats_watermark, watermark_cache
+from analytics.stats.offline import offline_statistics
+
+from unittest import mock
+
+
+class ReportCacheTestCase(TestCase):
+    def setUp(self):
+        self.app.config["ANALYTICS_REPORT_CACHE"] = "memory"
+        self.cache = ReportCache()
+
+    def test_key_is_canonical(self):
+        args = {"params": {"dates": {"filter": "day", "date": "2018-06-01"}, "must": {"desks": ["d1"]}}}
+        reordered = {"params": {"must": {"desks": ["d1"]}, "dates": {"date": "2018-06-01", "filter": "day"}}}
+
+        key = self.cache.get_key("content_publishing_report", args, ["guid1", None])
+        self.assertEqual(key, self.cache.get_key("content_publishing_report", reordered, ["guid1", None]))
+        self.assertNotEqual(key, self.cache.get_key("content_publishing_report", args, ["guid2", None]))
+        self.assertNotEqual(key, self.cache.get_key("desk_activity_report", args, ["guid1", None]))
+
+    def test_ttl_of_relative_dates(self):
+        self.app.config["ANALYTICS_REPORT_CACHE_TTL"] = 600
+        self.app.config["ANALYTICS_REPORT_CACHE_RELATIVE_TTL"] = 30
+
+        self.assertEqual(self.cache.get_ttl({"params": {"dates": {"filter": "day", "date": "2018-06-01"}}}), 600)
+        self.assertEqual(self.cache.get_ttl({"source": {"range": {"versioncreated": {"gte": "now-1d/d"}}}}), 30)
+
+    def test_cached_reports_are_copies(self):
+        self.cache.set("key1", {"items": [1, 2]}, 60)
+
+        report = self.cache.get("key1")
+        report["items"].append(3)
+
+        self.assertEqual(self.cache.get("key1"), {"items": [1, 2]})
+        self.assertIsNone(self.cache.get("key2"))
+        self.assertEqual(self.cache.info(), {"backend": "memory", "hits": 2, "misses": 1})
+
+    def test_disabled(self):
+        self.app.config["ANALYTICS_REPORT_CACHE"] = None
+        self.cache.set("key1", {"items": []}, 60)
+
+        self.assertFalse(self.cache.is_enabled())
+        self.assertIsNone(self.cache.get("key1"))
+
+    def test_memory_backend_expiry_and_size(self):
+        backend = MemoryCacheBackend(max_size=2)
+
+        with mock.patch("analytics.base_report.report_cache.time.monotonic", return_value=100):
+            backend.set("key1", b"1", 10)
+            backend.set("key2", b"2", 10)
+            backend.get("key1")
+            backend.set("key3", b"3", 10)
+
+            # The least recently used report is removed
+            self.assertIsNone(backend.get("key2"))
+            self.assertEqual(backend.get("key1"), b"1")
+
+        with mock.patch("analytics.base_report.report_cache.time.monotonic", return_value=110):
+            self.assertIsNone(backend.get("key1"))
+            self.assertIsNone(backend.get("key3"))
+
+    def test_stats_watermark_changes_with_generation(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        self.app.config["ANALYTICS_REPORT_WATERMARK_TTL"] = 0
+
+        with offline_statistics([]) as service:
+            watermark = get_stats_watermark()
+            self.assertEqual(get_stats_watermark(), watermark)
+
+            # i.e. a chunk of a lease or a recompute was written, which doesn't update the last run
+            service.bump_generation()
+            self.assertNotEqual(get_stats_watermark(), watermark)
+
+    def test_watermarks_are_cached_briefly(self):
+        self.app.config["ANALYTICS_REPORT_WATERMARK_TTL"] = 5
+        watermark_cache.clear()
+        self.addCleanup(watermark_cache.clear)
+
+        with self.app.app_context():
+            init_app(self.app)
+
+        with offline_statistics([]) as service:
+            with mock.patch.object(service, "get_generation", wraps=service.get_generation) as get_generation:
+                with mock.patch("analytics.base_report.report_cache.time.monotonic", return_value=100):
+                    watermark = get_stats_watermark()
+                    service.bump_generation()
+                    self.assertEqual(get_stats_watermark(), watermark)
+
+                with mock.patch("analytics.base_report.report_cache.time.monotonic", return_value=106):
+                    self.assertNotEqual(get_stats_watermark(), watermark)
+
+        self.assertEqual(get_generation.call_count, 2)
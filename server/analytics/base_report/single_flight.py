@@ -0,0 +1,96 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from flask import json
+import hashlib
+import threading
+
+
+class _Call:
+    """A call in flight, and its result once finished"""
+
+    __slots__ = ["finished", "result", "error", "waiting"]
+
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiting = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single call, sharing its result
+
+    The first caller of a key runs the function, while the other callers wait for its result.
+    If the result is not available within ``timeout`` seconds, the waiting caller runs the function itself.
+    Calls are only coalesced within a process (between the threads/greenlets of a worker).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @staticmethod
+    def get_key(*values):
+        """Get the key of a call, from its values normalised to a canonical json string"""
+
+        key = json.dumps(values, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+
+    def do(self, key, func, timeout, copy=None):
+        """Run ``func``, or wait for the result of the call with the same ``key`` that is already in flight
+
+        :param str key: The key of the call (see ``get_key``)
+        :param func: The function to call
+        :param float timeout: Maximum seconds to wait for the call in flight
+        :param copy: Function to copy the result for each caller, when the result is shared
+        """
+
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+
+            if call is None:
+                call = self._in_flight[key] = _Call()
+                leader = True
+            else:
+                self.coalesced += 1
+                call.waiting += 1
+                leader = False
+
+        if not leader:
+            if not call.finished.wait(timeout):
+                return func()
+            elif call.error is not None:
+                raise call.error
+
+            return copy(call.result) if copy else call.result
+
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+            call.finished.set()
+
+        # The shared result is only copied from, so it is not modified while other callers copy it
+        return copy(call.result) if copy and call.waiting else call.result
+
+    def info(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+
+single_flight = SingleFlight()
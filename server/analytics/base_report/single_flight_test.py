@@ -0,0 +1,88 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.base_report.single_flight import SingleFlight
+
+from copy import deepcopy
+import threading
+
+
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.num_calls = 0
+
+    def _search(self):
+        self.num_calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return {"hits": [self.num_calls]}
+
+    def _run(self, results, timeout=5):
+        results.append(self.single_flight.do("key1", self._search, timeout, copy=deepcopy))
+
+    def test_concurrent_calls_are_coalesced(self):
+        results = []
+        threads = [threading.Thread(target=self._run, args=(results,)) for _ in range(3)]
+
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+
+        while self.single_flight.info()["coalesced"] < 2:
+            threading.Event().wait(0.01)
+
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.num_calls, 1)
+        self.assertEqual(results, [{"hits": [1]}] * 3)
+
+        # Each caller gets its own copy of the shared result
+        self.assertEqual(len({id(result) for result in results}), 3)
+        self.assertEqual(self.single_flight.info(), {"calls": 3, "coalesced": 2, "in_flight": 0})
+
+    def test_waiting_caller_runs_after_timeout(self):
+        results = []
+        leader = threading.Thread(target=self._run, args=(results,))
+        leader.start()
+        self.started.wait(5)
+
+        self.assertEqual(self.single_flight.do("key1", lambda: "own", 0.01), "own")
+
+        self.release.set()
+        leader.join(5)
+        self.assertEqual(results, [{"hits": [1]}])
+
+    def test_errors_are_shared(self):
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            self.single_flight.do("key1", fail, 5)
+
+        # The failed call is no longer in flight
+        self.assertEqual(self.single_flight.do("key1", lambda: 1, 5), 1)
+
+    def test_key_is_canonical(self):
+        self.assertEqual(
+            self.single_flight.get_key("index", ["archived"], {"query": {}, "size": 0}),
+            self.single_flight.get_key("index", ["archived"], {"size": 0, "query": {}}),
+        )
+        self.assertNotEqual(
+            self.single_flight.get_key("index", ["archived"], {"size": 0}),
+            self.single_flight.get_key("index", ["published"], {"size": 0}),
+        )
@@ -8,10 +8,8 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
-
-from superdesk import get_resource_service
-
 from analytics.common import get_cv_by_qcode, DATE_FILTERS
+from analytics.metadata_cache import get_metadata
 from analytics.chart_config import SDChart
 from analytics.stats.common import OPERATION_NAMES
 
@@ -277,7 +275,7 @@ class ChartConfig:
                 "Desk",
                 {
                     str(desk.get("_id")): desk.get("name")
-                    for desk in list(get_resource_service("desks").get(req=None, lookup={}))
+                    for desk in get_metadata("desks")
                 },
             )
         elif field == "task.user":
@@ -286,7 +284,7 @@ class ChartConfig:
                 "User",
                 {
                     str(user.get("_id")): user.get("display_name")
-                    for user in list(get_resource_service("users").get(req=None, lookup={}))
+                    for user in get_metadata("users")
                 },
             )
         elif field == "anpa_category.qcode":
@@ -318,7 +316,7 @@ class ChartConfig:
                 "Author",
                 {
                     str(user.get("_id")): user.get("display_name")
-                    for user in list(get_resource_service("users").get(req=None, lookup={}))
+                    for user in get_metadata("users")
                 },
             )
 
@@ -22,6 +22,8 @@ from math import floor
 import re
 import logging
 
+from analytics.metadata_cache import get_metadata
+
 ANALYTICS_PATH = path.abspath(path.dirname(path.realpath(__file__)))
 
 logger = logging.getLogger(__name__)
@@ -168,7 +170,7 @@ def get_cv_by_qcode(name, field=None):
 
 
 def get_elastic_version():
-    return app.data.elastic.es.info()["version"]["number"]
+    return get_metadata("elastic_version")
 
 
 def get_weekstart_offset_hr():
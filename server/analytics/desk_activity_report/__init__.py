@@ -9,7 +9,11 @@
 # at https://www.sourcefabric.org/superdesk/license
 
 import superdesk
-from .desk_activity_report import DeskActivityReportResource, DeskActivityReportService
+from .desk_activity_report import (
+    DeskActivityReportResource,
+    DeskActivityReportService,
+    DeskActivityRollupReportService,
+)
 from analytics.common import register_report
 
 
@@ -19,7 +23,11 @@ def init_app(app):
         return
 
     endpoint_name = "desk_activity_report"
-    service = DeskActivityReportService(endpoint_name, backend=superdesk.get_backend())
+    # Use the hourly activity counts (maintained while generating statistics) if they are enabled
+    if app.config.get("ANALYTICS_STATS_ACTIVITY_ROLLUP", False):
+        service = DeskActivityRollupReportService(endpoint_name, backend=superdesk.get_backend())
+    else:
+        service = DeskActivityReportService(endpoint_name, backend=superdesk.get_backend())
     DeskActivityReportResource(endpoint_name, app=app, service=service)
 
     register_report("desk_activity_report", "desk_activity_report")
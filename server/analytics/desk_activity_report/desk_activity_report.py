@@ -12,6 +12,8 @@ from superdesk.resource import Resource
 from superdesk.errors import SuperdeskApiError
 
 from analytics.base_report import BaseReportService
+from analytics.base_report.report_cache import get_stats_watermark
+from analytics.stats.stats_report_service import ActivityRollupReportService
 from analytics.stats.common import ENTER_DESK_OPERATIONS, EXIT_DESK_OPERATIONS
 from analytics.chart_config import SDChart, ChartConfig
 from analytics.common import (
@@ -75,15 +77,20 @@ class DeskActivityReportService(BaseReportService):
         }
     }
 
+    def get_desk_id(self, args):
+        desk_id = (args.get("params") or {}).get("desk")
+
+        if not desk_id:
+            raise SuperdeskApiError.badRequestError("Desk must be provided")
+
+        return desk_id
+
     def get_request_aggregations(self, params, args):
         aggs = super().get_request_aggregations(params, args)
         params = args.get("params") or {}
         lt, gte, time_zone = self._es_get_date_filters(params)
 
-        desk_id = (args.get("params") or {}).get("desk")
-
-        if not desk_id:
-            raise SuperdeskApiError.badRequestError("Desk must be provided")
+        desk_id = self.get_desk_id(args)
 
         new_aggs = {
             "timeline": {
@@ -120,11 +127,20 @@ class DeskActivityReportService(BaseReportService):
     def get_elastic_index(self, types):
         return "statistics"
 
-    def generate_report(self, docs, args):
+    def get_cache_watermark(self, params, args):
+        return get_stats_watermark()
+
+    def get_date_buckets(self, docs):
         aggregations = getattr(docs, "hits", {}).get("aggregations") or {}
         desk_filter = (aggregations.get("timeline") or {}).get("desk_filter") or {}
         agg_dates = (desk_filter.get("timeline_filter") or {}).get("dates") or {}
-        date_buckets = agg_dates.get("buckets") or []
+        return agg_dates.get("buckets") or []
+
+    def get_operation_count(self, bucket):
+        return bucket.get("doc_count")
+
+    def generate_report(self, docs, args):
+        date_buckets = self.get_date_buckets(docs)
 
         if len(date_buckets) < 1:
             return {}
@@ -153,7 +169,7 @@ class DeskActivityReportService(BaseReportService):
 
             for operation in op_buckets:
                 key = operation.get("key")
-                doc_count = operation.get("doc_count")
+                doc_count = self.get_operation_count(operation)
 
                 if key in ENTER_DESK_OPERATIONS:
                     incoming += doc_count
@@ -279,3 +295,77 @@ class DeskActivityReportService(BaseReportService):
         report["highcharts"] = [gen_chart_config(), gen_table_config()]
 
         return report
+
+
+class DeskActivityRollupReportService(ActivityRollupReportService, DeskActivityReportService):
+    """Desk Activity Report using the hourly activity counts, instead of the nested ``stats.timeline``
+
+    Used when ANALYTICS_STATS_ACTIVITY_ROLLUP config is enabled.
+    As the counts are stored per hour, the dates are rounded to the hour in the UTC timezone.
+    The date range selects the activity by its hour only, whereas the nested aggregation also requires
+    the ``versioncreated`` of the item to be in the date range (so activity on items that have since been
+    updated is counted as well).
+
+    Falls back to the nested aggregation of ``stats.timeline`` for the filters the counts can't answer,
+    as the filters select the items (i.e. categories, urgency, rewrites or the desk, stage and user of the item).
+    """
+
+    #: The filters of the report that select the same activity from the counts as from the items
+    #: (the desks, users and stages filters select items by their current ``task``, not their activity)
+    rollup_filters = []
+
+    aggregations = {
+        "operations": {
+            "terms": {
+                "field": "operation",
+                "size": MAX_TERMS_SIZE,
+            },
+            "aggs": {"count": {"sum": {"field": "count"}}},
+        }
+    }
+
+    def _es_base_query(self, query, params):
+        super()._es_base_query(query, params)
+
+        if params.get("desk"):
+            query["must"].append({"term": {"desk": params["desk"]}})
+
+    def get_request_aggregations(self, params, args):
+        self.get_desk_id(args)
+        return self.get_histogram_aggregation(self.get_aggregations(params, args), params, args)
+
+    def get_date_buckets(self, docs):
+        aggregations = getattr(docs, "hits", {}).get("aggregations") or {}
+        return (aggregations.get("dates") or {}).get("buckets") or []
+
+    def get_operation_count(self, bucket):
+        return int((bucket.get("count") or {}).get("value") or 0)
+
+    def use_rollup(self, args):
+        params = args.get("params")
+
+        if not params or args.get("aggs") or (params.get("rewrites") or "include") != "include":
+            return False
+
+        query_funcs = self._get_es_query_funcs()
+
+        for must in ["must", "must_not"]:
+            for field, filters in (params.get(must) or {}).items():
+                funcs = query_funcs.get(field) or {}
+                values = filters if not funcs.get("values") else funcs["values"](filters)
+
+                if values and field not in self.rollup_filters:
+                    return False
+
+        return True
+
+    def get_timeline_service(self):
+        """Get the Desk Activity Report service using the nested ``stats.timeline`` (see ``use_rollup``)"""
+
+        return DeskActivityReportService(self.datasource, backend=self.backend)
+
+    def get(self, req, **lookup):
+        if not self.use_rollup(self._get_request_or_lookup(req, **lookup)):
+            return self.get_timeline_service().get(req, **lookup)
+
+        return super().get(req, **lookup)
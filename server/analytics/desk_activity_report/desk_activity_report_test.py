@@ -0,0 +1,54 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.desk_activity_report.desk_activity_report import (
+    DeskActivityReportService,
+    DeskActivityRollupReportService,
+)
+
+from unittest import mock
+
+
+class DeskActivityRollupReportServiceTestCase(TestCase):
+    def setUp(self):
+        self.service = DeskActivityRollupReportService("desk_activity_report")
+
+    def _args(self, must=None, must_not=None, **params):
+        params.update({"desk": "desk1", "must": must or {}, "must_not": must_not or {}})
+        return {"params": params}
+
+    def test_use_rollup(self):
+        self.assertTrue(self.service.use_rollup(self._args()))
+        self.assertTrue(self.service.use_rollup(self._args(must={"users": [], "categories": []})))
+        self.assertTrue(self.service.use_rollup(self._args(must={"urgency": {"1": False}}, rewrites="include")))
+
+        # The filters select items, not their activity
+        self.assertFalse(self.service.use_rollup(self._args(must={"users": ["user1"]})))
+        self.assertFalse(self.service.use_rollup(self._args(must_not={"stages": {"stage1": True}})))
+        self.assertFalse(self.service.use_rollup(self._args(must={"desks": ["desk2"]})))
+        self.assertFalse(self.service.use_rollup(self._args(must={"categories": {"Finance": True}})))
+        self.assertFalse(self.service.use_rollup(self._args(must_not={"urgency": [1]})))
+        self.assertFalse(self.service.use_rollup(self._args(must={"content_types": ["text"]})))
+        self.assertFalse(self.service.use_rollup(self._args(must={"rewrites": True})))
+        self.assertFalse(self.service.use_rollup(self._args(rewrites="exclude")))
+        self.assertFalse(self.service.use_rollup({"source": {"query": {"match_all": {}}}}))
+
+    def test_item_filters_fall_back_to_timeline(self):
+        args = self._args(must={"genre": {"Article": True}})
+        timeline_service = mock.Mock()
+        timeline_service.get.return_value = "timeline"
+
+        with mock.patch.object(self.service, "get_timeline_service", return_value=timeline_service):
+            self.assertEqual(self.service.get(None, **args), "timeline")
+
+        timeline_service.get.assert_called_once_with(None, **args)
+        self.assertIs(type(self.service.get_timeline_service()), DeskActivityReportService)
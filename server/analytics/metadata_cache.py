@@ -0,0 +1,169 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import get_resource_service
+from superdesk.logging import logger
+
+from flask import current_app as app
+import threading
+import time
+
+
+# The cached metadata to clear when a document of the resource is created, updated or deleted
+RESOURCE_METADATA = {
+    "desks": ["desks", "invisible_stages"],
+    "stages": ["invisible_stages"],
+    "users": ["users"],
+}
+
+
+def load_elastic_version():
+    return app.data.elastic.es.info()["version"]["number"]
+
+
+def load_invisible_stages():
+    stages = get_resource_service("stages").get_stages_by_visibility(is_visible=False)
+    return [str(stage["_id"]) for stage in stages]
+
+
+def load_desks():
+    return list(get_resource_service("desks").get(req=None, lookup={}))
+
+
+def load_users():
+    return list(get_resource_service("users").get(req=None, lookup={}))
+
+
+class MetadataVersions:
+    """Versions of the cached metadata, shared between the processes using Redis
+
+    The version of a value is incremented when a document of its resource is created, updated or deleted,
+    so the value cached by other processes is loaded again.
+
+    :param str url: The Redis url
+    """
+
+    #: Prefix of the keys stored in Redis
+    prefix = "analytics:metadata_version:"
+
+    def __init__(self, url):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+
+    def get(self, name):
+        return self.redis.get(self.prefix + name)
+
+    def incr(self, name):
+        self.redis.incr(self.prefix + name)
+
+
+class MetadataCache:
+    """Cache of the metadata used by the reports (i.e. elastic version, desks), to save requests per report
+
+    Values expire after ANALYTICS_METADATA_CACHE_TTL config (300 seconds), and are cleared when a document
+    of their resource is created, updated or deleted (see ``RESOURCE_METADATA``). Changes made by other processes
+    are detected using the shared ``versions`` (if provided), which are read each time a value is used.
+    The cache is disabled if ANALYTICS_METADATA_CACHE_TTL is 0. Cached values are shared, so must not be modified.
+
+    :param MetadataVersions versions: The versions of the values, shared between processes
+    """
+
+    loaders = {
+        "elastic_version": load_elastic_version,
+        "invisible_stages": load_invisible_stages,
+        "desks": load_desks,
+        "users": load_users,
+    }
+
+    def __init__(self, versions=None):
+        self.versions = versions
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get_version(self, name):
+        """Get the shared version of the value ``name`` (None if the versions are not shared)"""
+
+        if self.versions is None:
+            return None
+
+        try:
+            return self.versions.get(name)
+        except Exception:
+            logger.exception("Failed to get the version of the {} metadata".format(name))
+            return None
+
+    def get(self, name):
+        ttl = int(app.config.get("ANALYTICS_METADATA_CACHE_TTL", 300))
+        if ttl <= 0:
+            return self.loaders[name]()
+
+        version = self.get_version(name)
+
+        with self._lock:
+            expires, cached_version, value = self._values.get(name, (0, None, None))
+
+        if expires > time.monotonic() and cached_version == version:
+            return value
+
+        value = self.loaders[name]()
+
+        with self._lock:
+            self._values[name] = (time.monotonic() + ttl, version, value)
+
+        return value
+
+    def invalidate(self, *names):
+        """Clear the cached ``names`` (or all values if no names are provided)
+
+        The shared versions of ``names`` are incremented, so they're also cleared by the other processes
+        """
+
+        with self._lock:
+            if not names:
+                self._values.clear()
+
+            for name in names:
+                self._values.pop(name, None)
+
+        if self.versions is None:
+            return
+
+        for name in names:
+            try:
+                self.versions.incr(name)
+            except Exception:
+                logger.exception("Failed to update the version of the {} metadata".format(name))
+
+
+def get_metadata_cache():
+    """Get the ``MetadataCache`` of the current app"""
+
+    return app.extensions.setdefault("analytics_metadata_cache", MetadataCache())
+
+
+def get_metadata(name):
+    return get_metadata_cache().get(name)
+
+
+def init_app(app):
+    redis_url = app.config.get("ANALYTICS_METADATA_CACHE_REDIS_URL") or app.config.get("REDIS_URL")
+    app.extensions["analytics_metadata_cache"] = MetadataCache(MetadataVersions(redis_url) if redis_url else None)
+
+    def invalidate_metadata(resource):
+        def invalidate(*args, **kwargs):
+            app.extensions["analytics_metadata_cache"].invalidate(*RESOURCE_METADATA[resource])
+
+        return invalidate
+
+    for resource in RESOURCE_METADATA.keys():
+        for event_name in ["on_inserted", "on_updated", "on_replaced", "on_deleted_item"]:
+            event = getattr(app, "{}_{}".format(event_name, resource))
+            event += invalidate_metadata(resource)
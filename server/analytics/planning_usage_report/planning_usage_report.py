@@ -14,6 +14,7 @@ from superdesk.resource import Resource
 from analytics.chart_config import ChartConfig
 from analytics.base_report import BaseReportService
 from analytics.common import MAX_TERMS_SIZE
+from analytics.metadata_cache import get_metadata
 
 
 class PlanningUsageReportResource(Resource):
@@ -158,7 +159,7 @@ class PlanningUsageReportService(BaseReportService):
             for role in get_resource_service("roles").get(req=None, lookup={"privileges.planning": 1})
         ]
 
-        active_users = get_resource_service("users").get(req=None, lookup={"is_enabled": True})
+        active_users = [user for user in get_metadata("users") if user.get("is_enabled")]
 
         users_with_planning = []
         for user in active_users:
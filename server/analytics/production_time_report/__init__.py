@@ -12,6 +12,7 @@ import superdesk
 from .production_time_report import (
     ProductionTimeReportResource,
     ProductionTimeReportService,
+    ProductionTimeRollupReportService,
 )
 from analytics.common import register_report
 
@@ -22,7 +23,11 @@ def init_app(app):
         return
 
     endpoint_name = "production_time_report"
-    service = ProductionTimeReportService(endpoint_name, backend=superdesk.get_backend())
+    # Use the daily desk transition durations (maintained while generating statistics) if they are enabled
+    if app.config.get("ANALYTICS_STATS_DURATION_ROLLUP", False):
+        service = ProductionTimeRollupReportService(endpoint_name, backend=superdesk.get_backend())
+    else:
+        service = ProductionTimeReportService(endpoint_name, backend=superdesk.get_backend())
     ProductionTimeReportResource(endpoint_name, app=app, service=service)
 
     register_report("production_time_report", "production_time_report")
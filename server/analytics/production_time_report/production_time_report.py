@@ -11,8 +11,14 @@
 from superdesk.resource import Resource
 
 from analytics.stats.stats_report_service import StatsReportService
+from analytics.stats.duration_rollup import DURATION_ROLLUP, NUM_BUCKETS, estimate_percentile
 from analytics.chart_config import SDChart, ChartConfig
-from analytics.common import seconds_to_human_readable, MAX_TERMS_SIZE
+from analytics.common import seconds_to_human_readable, relative_to_absolute_datetime, MAX_TERMS_SIZE
+
+from datetime import datetime, time, timedelta
+
+# The estimated percentiles of the durations, keyed by their stat type
+PERCENTILES = {"median": 50, "p90": 90}
 
 
 class ProductionTimeReportResource(Resource):
@@ -45,6 +51,17 @@ class ProductionTimeReportService(StatsReportService):
     def get_request_aggregations(self, params, args):
         params = args.get("params") or {}
         lt, gte, time_zone = self._es_get_date_filters(params)
+        desk_aggs = {"stats": {"stats": {"field": "stats.desk_transitions.duration"}}}
+
+        # The percentiles are only calculated if they're included in the report
+        stats = params.get("stats") or {}
+        if any(stats.get(stat) for stat in PERCENTILES.keys()):
+            desk_aggs["percentiles"] = {
+                "percentiles": {
+                    "field": "stats.desk_transitions.duration",
+                    "percents": list(PERCENTILES.values()),
+                }
+            }
 
         return {
             "inner": {
@@ -66,7 +83,7 @@ class ProductionTimeReportService(StatsReportService):
                                     "field": "stats.desk_transitions.desk",
                                     "size": MAX_TERMS_SIZE,
                                 },
-                                "aggs": {"stats": {"stats": {"field": "stats.desk_transitions.duration"}}},
+                                "aggs": desk_aggs,
                             }
                         },
                     }
@@ -74,11 +91,31 @@ class ProductionTimeReportService(StatsReportService):
             }
         }
 
-    def generate_report(self, docs, args):
-        aggregations = getattr(docs, "hits", {}).get("aggregations") or {}
+    def get_desk_stats(self, bucket):
+        stats = bucket.get("stats") or {}
+        percentiles = (bucket.get("percentiles") or {}).get("values") or {}
 
+        desk_stats = {
+            "count": stats.get("count") or 0,
+            "min": stats.get("min") or 0,
+            "max": stats.get("max") or 0,
+            "avg": stats.get("avg") or 0,
+            "sum": stats.get("sum") or 0,
+        }
+
+        if "percentiles" in bucket:
+            for stat, percentile in PERCENTILES.items():
+                desk_stats[stat] = percentiles.get("{:.1f}".format(percentile)) or 0
+
+        return desk_stats
+
+    def get_desk_buckets(self, aggregations):
         date_filter = (aggregations.get("inner") or {}).get("date_filter") or {}
-        desk_buckets = (date_filter.get("desks") or {}).get("buckets") or []
+        return (date_filter.get("desks") or {}).get("buckets") or []
+
+    def generate_report(self, docs, args):
+        aggregations = getattr(docs, "hits", {}).get("aggregations") or {}
+        desk_buckets = self.get_desk_buckets(aggregations)
 
         if len(desk_buckets) < 1:
             return {}
@@ -91,15 +128,10 @@ class ProductionTimeReportService(StatsReportService):
             if not desk_id:
                 continue
 
-            stats = bucket.get("stats") or {}
+            desk_stats = self.get_desk_stats(bucket)
 
-            report["desk_stats"][desk_id] = {
-                "count": stats.get("count") or 0,
-                "min": stats.get("min") or 0,
-                "max": stats.get("max") or 0,
-                "avg": stats.get("avg") or 0,
-                "sum": stats.get("sum") or 0,
-            }
+            if desk_stats["count"] > 0:
+                report["desk_stats"][desk_id] = desk_stats
 
         return report
 
@@ -111,7 +143,7 @@ class ProductionTimeReportService(StatsReportService):
         stats = params.get("stats") or {}
         desk_stats = report.get("desk_stats") or {}
         desk_ids = list(desk_stats.keys())
-        stat_types = [stat for stat in ["sum", "max", "avg", "min"] if stats.get(stat)]
+        stat_types = [stat for stat in ["sum", "max", "avg", "min", "median", "p90"] if stats.get(stat)]
         sort_order = chart_params.get("sort_order") or "desc"
 
         def get_sum_stats(desk_id):
@@ -146,7 +178,14 @@ class ProductionTimeReportService(StatsReportService):
         chart.set_translation(
             "production_stats",
             "Production Stats",
-            {"min": "Minimum", "sum": "Sum", "avg": "Average", "max": "Maximum"},
+            {
+                "min": "Minimum",
+                "sum": "Sum",
+                "avg": "Average",
+                "max": "Maximum",
+                "median": "Median",
+                "p90": "90th Percentile",
+            },
         )
 
         axis = chart.add_axis().set_options(
@@ -181,3 +220,121 @@ class ProductionTimeReportService(StatsReportService):
         report["highcharts"] = [chart.gen_config()]
 
         return report
+
+
+class ProductionTimeRollupReportService(ProductionTimeReportService):
+    """Production Time report using the daily desk transition durations (``archive_statistics_durations``)
+
+    The median and 90th percentile are estimated from the histogram of the durations.
+    Falls back to the nested aggregation of ``stats.desk_transitions`` for the filters the rollup can't answer
+    (i.e. item filters, or dates that don't start at midnight).
+    Requires ANALYTICS_STATS_DURATION_ROLLUP config to be enabled.
+    """
+
+    def get_rollup_day_range(self, params):
+        """Get the range of days (in the DEFAULT_TIMEZONE) for the date filters (None if not day aligned)"""
+
+        lt, gte, _ = self._es_get_date_filters(params)
+
+        if lt is None or gte is None:
+            return {}
+
+        def to_local_datetime(value):
+            if value.startswith("now"):
+                value = relative_to_absolute_datetime(value, "%Y-%m-%dT%H:%M:%S")
+
+            return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+        start = to_local_datetime(gte)
+        end = to_local_datetime(lt)
+
+        if start.time() != time(0):
+            return None
+
+        # The end is exclusive, so include the day of ``lt`` unless it is at midnight
+        if end.time() != time(0):
+            end += timedelta(days=1)
+
+        return {"gte": start.strftime("%Y-%m-%d"), "lt": end.strftime("%Y-%m-%d")}
+
+    def use_rollup(self, args):
+        params = args.get("params")
+
+        if not params or args.get("aggs") or (params.get("rewrites") or "include") != "include":
+            return False
+
+        query_funcs = self._get_es_query_funcs()
+
+        for must in ["must", "must_not"]:
+            for field, filters in (params.get(must) or {}).items():
+                funcs = query_funcs.get(field) or {}
+                values = filters if not funcs.get("values") else funcs["values"](filters)
+
+                if not values:
+                    continue
+                elif must == "must" and field == "desk_transitions" and isinstance(values, dict):
+                    # Every desk transition in the rollup belongs to an item with at least 1 desk transition
+                    if (values.get("min") or 0) <= 1 and not any(values.get(attr) for attr in ["max", "enter", "exit"]):
+                        continue
+
+                return False
+
+        return self.get_rollup_day_range(params) is not None
+
+    def get_rollup_aggregations(self):
+        aggs = {
+            "count": {"sum": {"field": "count"}},
+            "sum": {"sum": {"field": "sum"}},
+            "min": {"min": {"field": "min"}},
+            "max": {"max": {"field": "max"}},
+        }
+
+        for index in range(NUM_BUCKETS):
+            aggs["bucket_{}".format(index)] = {"sum": {"field": "histogram.{}".format(index)}}
+
+        return {"rollup": {"terms": {"field": "desk", "size": MAX_TERMS_SIZE}, "aggs": aggs}}
+
+    def run_query(self, params, args):
+        if not self.use_rollup(args):
+            return super().run_query(params, args)
+
+        day_range = self.get_rollup_day_range(args["params"])
+        query = {"query": {"match_all": {}}, "aggs": self.get_rollup_aggregations(), "size": 0}
+
+        if day_range:
+            query["query"] = {"filtered": {"filter": {"range": {"day": day_range}}}}
+
+        return self.elastic.search(query, [DURATION_ROLLUP], params={})
+
+    def get_desk_buckets(self, aggregations):
+        if aggregations.get("rollup") is None:
+            return super().get_desk_buckets(aggregations)
+
+        return aggregations["rollup"].get("buckets") or []
+
+    def get_desk_stats(self, bucket):
+        if "stats" in bucket:
+            # From the nested aggregation (see ``use_rollup``)
+            return super().get_desk_stats(bucket)
+
+        def get_value(name):
+            return (bucket.get(name) or {}).get("value")
+
+        count = int(get_value("count") or 0)
+        total = get_value("sum") or 0
+        min_duration = get_value("min")
+        max_duration = get_value("max")
+        histogram = {index: int(get_value("bucket_{}".format(index)) or 0) for index in range(NUM_BUCKETS)}
+
+        desk_stats = {
+            "count": count,
+            "min": min_duration or 0,
+            "max": max_duration or 0,
+            "avg": total / count if count > 0 else 0,
+            "sum": total,
+        }
+
+        for stat, percentile in PERCENTILES.items():
+            desk_stats[stat] = estimate_percentile(histogram, percentile, min_duration, max_duration) or 0
+
+        return desk_stats
@@ -0,0 +1,36 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.production_time_report.production_time_report import ProductionTimeReportService
+
+
+class ProductionTimeReportServiceTestCase(TestCase):
+    def setUp(self):
+        self.service = ProductionTimeReportService("production_time_report")
+
+    def _desk_aggs(self, stats):
+        args = {"params": {"stats": stats}}
+        aggs = self.service.get_request_aggregations(args["params"], args)
+        return aggs["inner"]["aggs"]["date_filter"]["aggs"]["desks"]["aggs"]
+
+    def test_percentiles_only_when_requested(self):
+        self.assertEqual(list(self._desk_aggs({"avg": True, "median": False}).keys()), ["stats"])
+        self.assertEqual(sorted(self._desk_aggs({"avg": True, "p90": True}).keys()), ["percentiles", "stats"])
+
+    def test_get_desk_stats(self):
+        stats = {"count": 2, "min": 10, "max": 30, "avg": 20, "sum": 40}
+
+        self.assertNotIn("median", self.service.get_desk_stats({"stats": stats}))
+        self.assertEqual(
+            self.service.get_desk_stats({"stats": stats, "percentiles": {"values": {"50.0": 15, "90.0": 28}}}),
+            dict(stats, median=15, p90=28),
+        )
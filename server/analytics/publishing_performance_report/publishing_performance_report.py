@@ -8,10 +8,10 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
-from superdesk import get_resource_service
 from analytics.base_report import BaseReportService, BaseReportResource
 from analytics.chart_config import ChartConfig
 from analytics.common import MAX_TERMS_SIZE
+from analytics.metadata_cache import get_metadata
 
 
 class PublishingPerformanceReportResource(BaseReportResource):
@@ -134,9 +134,7 @@ class PublishingPerformanceReportService(BaseReportService):
                 "recalled": 0,
             }
             report_groups = list(report["groups"])
-            desks = get_resource_service("desks").get(req=None, lookup={})
-
-            for desk in list(desks):
+            for desk in get_metadata("desks"):
                 if str(desk["_id"]) not in report_groups:
                     report["groups"][str(desk["_id"])] = desk_with_no_articles
 
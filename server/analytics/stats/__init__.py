@@ -14,7 +14,10 @@ from superdesk.default_settings import env
 from superdesk.default_settings import crontab
 
 from .archive_statistics import ArchiveStatisticsResource, ArchiveStatisticsService
+from .activity_rollup import ActivityRollupResource, ActivityRollupService
+from .duration_rollup import DurationRollupResource, DurationRollupService
 from .gen_archive_statistics import GenArchiveStatistics
+from .stream_archive_statistics import StreamArchiveStatistics  # noqa
 from .featuremedia_updates import *  # noqa
 
 
@@ -44,6 +47,14 @@ def init_app(app):
     service = ArchiveStatisticsService(endpoint_name, backend=superdesk.get_backend())
     ArchiveStatisticsResource(endpoint_name, app=app, service=service)
 
+    endpoint_name = ActivityRollupResource.endpoint_name
+    service = ActivityRollupService(endpoint_name, backend=superdesk.get_backend())
+    ActivityRollupResource(endpoint_name, app=app, service=service)
+
+    endpoint_name = DurationRollupResource.endpoint_name
+    service = DurationRollupService(endpoint_name, backend=superdesk.get_backend())
+    DurationRollupResource(endpoint_name, app=app, service=service)
+
 
 def init_gen_stats_task(app):
     # Check the application config to see if archive stats is enabled
@@ -65,3 +76,11 @@ def init_gen_stats_task(app):
 @celery.task(soft_time_limit=600)
 def gen_archive_stats():
     GenArchiveStatistics().run()
+
+
+@celery.task(soft_time_limit=600)
+def gen_archive_stats_lease(chunk_size=1000, adaptive=False, workers=1):
+    # The soft_time_limit is provided when the task is queued (see ``GenArchiveStatistics.start_lease_worker``)
+    # Celery worker processes are daemonic and can't start the timeline process pool, so leases are
+    # processed using 1 worker (``workers`` is only accepted for tasks that were already queued)
+    GenArchiveStatistics().run_lease_worker(chunk_size, 1, adaptive)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import command, get_resource_service
+from superdesk.resource import Resource, not_analyzed
+
+from analytics.stats.common import STAT_TYPE
+from analytics.stats.plugins import stats_plugins
+from analytics.stats.rollup import RollupService, RollupPlugin, RebuildRollup
+
+ACTIVITY_ROLLUP = "archive_statistics_activity"
+
+# The attributes of an activity count, in the order of the keys returned by ``get_activity_key``
+ACTIVITY_FIELDS = ["hour", "desk", "stage", "user", "operation"]
+
+
+def get_activity_key(entry):
+    """Get the (hour, desk, stage, user, operation) key of a timeline entry (None if it has no date)"""
+
+    created = entry.get("operation_created")
+
+    if not created:
+        return None
+
+    task = entry.get("task") or {}
+
+    return (
+        created.replace(minute=0, second=0, microsecond=0),
+        str(task["desk"]) if task.get("desk") else None,
+        str(task["stage"]) if task.get("stage") else None,
+        str(task["user"]) if task.get("user") else None,
+        entry.get("operation"),
+    )
+
+
+def get_activity_id(key):
+    return "{:%Y%m%d%H}:{}".format(key[0], ":".join(value or "" for value in key[1:]))
+
+
+def get_activity_counts(timeline):
+    """Count the entries of a timeline, keyed by ``get_activity_key``"""
+
+    counts = {}
+
+    for entry in timeline or []:
+        key = get_activity_key(entry)
+
+        if key is not None:
+            counts[key] = counts.get(key, 0) + 1
+
+    return counts
+
+
+def add_activity_counts(counts, other, sign=1):
+    """Add (or subtract, with ``sign=-1``) the ``other`` activity counts to ``counts``"""
+
+    for key, count in other.items():
+        counts[key] = counts.get(key, 0) + sign * count
+
+    return counts
+
+
+class ActivityRollupResource(Resource):
+    """Number of timeline entries per hour, desk, stage, user and operation
+
+    Used by reports instead of aggregating the nested ``stats.timeline`` of every statistics document
+    """
+
+    endpoint_name = resource_title = url = ACTIVITY_ROLLUP
+    item_methods = ["GET"]
+    resource_methods = ["GET"]
+    internal_resource = True
+    datasource = {
+        "source": ACTIVITY_ROLLUP,
+        "search_backend": "elastic",
+    }
+
+    mongo_prefix = "STATISTICS_MONGO"
+    elastic_prefix = "STATISTICS_ELASTIC"
+
+    schema = {
+        "hour": {"type": "datetime"},
+        "desk": Resource.rel("desks", nullable=True),
+        "stage": Resource.rel("stages", nullable=True),
+        "user": Resource.rel("users", nullable=True),
+        "operation": {"type": "string", "mapping": not_analyzed},
+        "count": {"type": "integer"},
+        # Incremented on every write, so an older revision never replaces a newer one in Elasticsearch
+        "revision": {"type": "integer"},
+    }
+
+
+class ActivityRollupService(RollupService):
+    key_fields = ACTIVITY_FIELDS
+    projection = {
+        "stats.timeline.operation": 1,
+        "stats.timeline.operation_created": 1,
+        "stats.timeline.task": 1,
+    }
+    reset_update = {"$set": {"count": 0}}
+
+    def get_rollup_id(self, key):
+        return get_activity_id(key)
+
+    def add_item_stats(self, totals, stats):
+        add_activity_counts(totals, get_activity_counts(stats.get(STAT_TYPE.TIMELINE)))
+
+    def get_rebuild_updates(self, value):
+        return {"count": value}
+
+    def update_counts(self, counts):
+        """Add to the activity counts, creating any that don't exist yet
+
+        :param dict counts: The number of timeline entries to add (or remove if negative), keyed by
+            ``get_activity_key``
+        """
+
+        self.write({key: {"$inc": {"count": count}} for key, count in counts.items() if count})
+
+
+class ActivityRollup(RollupPlugin):
+    """Maintains the hourly activity counts (``archive_statistics_activity``) while generating statistics
+
+    Only enabled if ANALYTICS_STATS_ACTIVITY_ROLLUP config is True. The counts of each item are the difference
+    between its new timeline and the timeline it had before.
+    """
+
+    name = "activity_rollup"
+    config_name = "ANALYTICS_STATS_ACTIVITY_ROLLUP"
+
+    def get_item_totals(self, event):
+        counts = get_activity_counts(event.updates.get("_new_timeline"))
+        previous_stats = event.orig.get("previous_stats") or {}
+
+        return add_activity_counts(counts, get_activity_counts(previous_stats.get(STAT_TYPE.TIMELINE)), -1)
+
+    def add_totals(self, totals, other):
+        add_activity_counts(totals, other)
+
+    def update(self, totals):
+        get_resource_service("archive_statistics").update_activity_counts(totals)
+
+
+class RebuildActivityRollup(RebuildRollup):
+    """Generate the hourly activity counts from the timelines of all archive statistics
+
+    Used to populate the ``archive_statistics_activity`` collection after enabling ANALYTICS_STATS_ACTIVITY_ROLLUP
+    (from then on the counts are updated while generating statistics).
+    Runs with the ``gen_archive_statistics`` lock, so the statistics are not generated at the same time.
+
+    Options
+    ::
+
+        -c, --chunk-size (defaults to 1000):
+        Number of statistics documents loaded per request, and activity counts written per request
+
+    Example:
+    ::
+
+        $ python manage.py analytics:rebuild_activity_rollup
+        $ python manage.py analytics:rebuild_activity_rollup -chunk-size 5000
+    """
+
+    resource = ACTIVITY_ROLLUP
+
+
+activity_rollup = ActivityRollup()
+stats_plugins.register(activity_rollup)
+
+command("analytics:rebuild_activity_rollup", RebuildActivityRollup())
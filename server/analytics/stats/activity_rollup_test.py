@@ -0,0 +1,86 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+from superdesk.utc import utcnow
+
+from analytics.stats.activity_rollup import ActivityRollup, get_activity_counts, get_activity_id
+from analytics.stats.plugins import CompletedItem
+from analytics.stats.timeline import Task, TimelineEntry
+
+from datetime import timedelta
+
+
+class ActivityRollupTestCase(TestCase):
+    def setUp(self):
+        self.hour = utcnow().replace(minute=0, second=0, microsecond=0)
+
+    def _entry(self, operation, minutes, desk="desk1", user="user1"):
+        return TimelineEntry(
+            operation=operation,
+            operation_created=self.hour + timedelta(minutes=minutes),
+            task=Task(desk=desk, stage="stage1", user=user),
+        )
+
+    def test_get_activity_counts(self):
+        counts = get_activity_counts(
+            [
+                self._entry("create", 5),
+                self._entry("update", 10),
+                self._entry("update", 50),
+                self._entry("update", 70),
+                {"operation": "update", "operation_created": self.hour, "task": {"desk": "desk1", "user": "user1"}},
+            ]
+        )
+        next_hour = self.hour + timedelta(hours=1)
+
+        self.assertEqual(
+            counts,
+            {
+                (self.hour, "desk1", "stage1", "user1", "create"): 1,
+                (self.hour, "desk1", "stage1", "user1", "update"): 2,
+                (next_hour, "desk1", "stage1", "user1", "update"): 1,
+                (self.hour, "desk1", None, "user1", "update"): 1,
+            },
+        )
+        self.assertEqual(
+            get_activity_id((self.hour, "desk1", None, "user1", "update")),
+            "{:%Y%m%d%H}:desk1::user1:update".format(self.hour),
+        )
+
+    def test_counts_difference_of_timelines(self):
+        self.app.config["ANALYTICS_STATS_ACTIVITY_ROLLUP"] = True
+        plugin = ActivityRollup()
+
+        previous = [self._entry("create", 5), self._entry("update", 10, desk="desk2")]
+        new = [self._entry("create", 5), self._entry("update", 10), self._entry("publish", 20)]
+
+        plugin.start()
+        plugin.complete(
+            CompletedItem(
+                None,
+                stats={},
+                orig={"_id": "item1", "previous_stats": {"timeline": previous}},
+                updates={"_new_timeline": new},
+            )
+        )
+        plugin.complete(
+            CompletedItem(None, stats={}, orig={"_id": "item2"}, updates={"_new_timeline": [self._entry("create", 1)]})
+        )
+
+        self.assertEqual(
+            plugin.pop_totals(["item2"]),
+            {
+                (self.hour, "desk2", "stage1", "user1", "update"): -1,
+                (self.hour, "desk1", "stage1", "user1", "update"): 1,
+                (self.hour, "desk1", "stage1", "user1", "publish"): 1,
+            },
+        )
+        self.assertEqual(plugin.pop_totals(), {})
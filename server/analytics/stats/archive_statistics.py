@@ -9,7 +9,8 @@
 # at https://www.sourcefabric.org/superdesk/license
 
 
-from superdesk import get_resource_service, json
+from superdesk import get_resource_service
+from superdesk.logging import logger
 from superdesk.services import BaseService
 from superdesk.resource import Resource, not_indexed, not_analyzed, not_enabled
 from superdesk.metadata.item import (
@@ -21,11 +22,25 @@ from superdesk.metadata.item import (
     BYLINE,
 )
 from superdesk.metadata.utils import item_url
+from superdesk.utc import utcnow
 from apps.archive.common import ARCHIVE_SCHEMA_FIELDS
 
-from analytics.stats.common import STAT_TYPE
+from analytics.stats.common import STAT_TYPE, LEASE_STATUS, METADATA_FIELDS, HISTORY_UPDATE_FIELDS
+from analytics.stats.bulk_writer import StatisticsBulkWriter
+from analytics.stats.activity_rollup import ACTIVITY_ROLLUP
+from analytics.stats.duration_rollup import DURATION_ROLLUP
+from analytics.stats.chunk_size import get_chunk_size
 
-from eve.utils import config, ParsedRequest, date_to_str
+from bson import ObjectId
+from datetime import timedelta
+from elasticsearch.helpers import scan
+from eve.utils import config
+from flask import current_app as app
+from pymongo import ReturnDocument
+from pymongo.errors import CursorNotFound
+
+# The id of the system record storing the generation of the statistics (see ``bump_generation``)
+GENERATION_ID = "stats_generation"
 
 
 class ArchiveStatisticsResource(Resource):
@@ -43,6 +58,11 @@ class ArchiveStatisticsResource(Resource):
 
     query_objectid_as_string = True
 
+    mongo_indexes = {
+        # Used to load the rewrite families of the items in a chunk (see ``get_items_by_family_root_ids``)
+        "family_root_id_1": ([("family_root_id", 1)], {"background": True, "sparse": True}),
+    }
+
     schema = {
         config.ID_FIELD: metadata_schema[config.ID_FIELD],
         "guid": metadata_schema["guid"],
@@ -179,6 +199,33 @@ class ArchiveStatisticsResource(Resource):
                         },
                     },
                 },
+                STAT_TYPE.LOCK_SESSIONS: {
+                    "type": "list",
+                    "schema": {
+                        "type": "dict",
+                        "schema": {
+                            "user": Resource.rel("users"),
+                            "desk": Resource.rel("desks", nullable=True),
+                            "stage": Resource.rel("stages", nullable=True),
+                            "started": {"type": "datetime"},
+                            "ended": {"type": "datetime"},
+                            "duration": {"type": "integer"},
+                            "operations": {"type": "list", "mapping": not_enabled},
+                        },
+                    },
+                    "mapping": {
+                        "type": "nested",
+                        "properties": {
+                            "user": not_analyzed,
+                            "desk": not_analyzed,
+                            "stage": not_analyzed,
+                            "started": {"type": "date"},
+                            "ended": {"type": "date"},
+                            "duration": {"type": "integer"},
+                            "operations": not_enabled,
+                        },
+                    },
+                },
             },
         },
         # Metadata
@@ -244,8 +291,16 @@ class ArchiveStatisticsResource(Resource):
         "time_to_next_update_publish": {"type": "integer", "default": 0},
         "num_desk_transitions": {"type": "integer", "default": 0},
         "num_featuremedia_updates": {"type": "integer", "default": 0},
+        "num_lock_sessions": {"type": "integer", "default": 0},
+        # The first item in the chain of rewrites, and the position of this item in the chain (0 for the first item)
+        "family_root_id": {"type": "string", "mapping": not_analyzed},
+        "family_depth": {"type": "integer"},
         # Dictionary for statistics generated via plugins (i.e. from gen_stats_signals)
         "extra": {"type": "dict", "mapping": not_enabled},
+        # Temporary attributes from the last run, used to append new history entries to the timeline
+        "timeline_state": {"type": "dict", "mapping": not_enabled},
+        # Progress of the statistics generation (stored on the ``last_run`` system record)
+        "progress": {"type": "dict", "mapping": not_enabled},
     }
 
 
@@ -253,44 +308,432 @@ class ArchiveStatisticsService(BaseService):
     def get_last_run(self):
         return self.find_one(req=None, stats_type="last_run") or {}
 
-    def set_last_run_id(self, entry_id, last_run=None):
+    def set_last_run_id(self, entry_id, last_run=None, progress=None):
+        """Store the id of the last processed archive_history entry
+
+        :param str entry_id: The id of the last processed archive_history entry
+        :param dict last_run: The last_run document (updated in place with the new values)
+        :param dict progress: Progress details of the current run
+        :return dict: The last_run document
+        """
         if last_run is None:
             last_run = self.get_last_run()
 
+        updates = {"guid": entry_id}
+        if progress is not None:
+            updates["progress"] = progress
+
         if last_run and last_run.get(config.ID_FIELD):
-            self.patch(last_run[config.ID_FIELD], {"guid": entry_id})
+            self.patch(last_run[config.ID_FIELD], updates)
         else:
-            self.post([{"guid": entry_id, "stats_type": "last_run"}])
+            doc = {"stats_type": "last_run"}
+            doc.update(updates)
+            last_run[config.ID_FIELD] = self.post([doc])[0]
+
+        last_run.update(updates)
+        return last_run
+
+    def get_generation(self):
+        """Get the generation of the statistics, which is incremented each time statistics are written"""
+
+        doc = app.data.get_mongo_collection(self.datasource).find_one({config.ID_FIELD: GENERATION_ID})
+        return (doc or {}).get("generation") or 0
+
+    def bump_generation(self):
+        """Increment the generation of the statistics, after a chunk of statistics has been written
+
+        Used by the reports as the watermark of the statistics (see ``get_stats_watermark``), as the last run
+        is not updated when statistics are written (i.e. when processing leases, or recomputing statistics)
+        """
+
+        app.data.get_mongo_collection(self.datasource).update_one(
+            {config.ID_FIELD: GENERATION_ID},
+            {
+                "$inc": {"generation": 1},
+                "$set": {config.LAST_UPDATED: utcnow()},
+                "$setOnInsert": {"stats_type": "generation"},
+            },
+            upsert=True,
+        )
+
+    def get_writer(self, failed_ids, conflict_ids=None):
+        """Get the writer used to store statistics documents in bulk"""
+
+        return StatisticsBulkWriter(failed_ids=failed_ids, conflict_ids=conflict_ids)
+
+    def update_activity_counts(self, counts):
+        """Add to the hourly activity counts (see ``analytics.stats.activity_rollup``)"""
+
+        get_resource_service(ACTIVITY_ROLLUP).update_counts(counts)
+
+    def update_duration_totals(self, totals):
+        """Add to the daily desk transition durations (see ``analytics.stats.duration_rollup``)"""
+
+        get_resource_service(DURATION_ROLLUP).update_totals(totals)
+
+    def get_progress(self):
+        """Get the progress of the statistics generation
+
+        Includes the details of the last (or current) run, the archive_history entries that are yet to be processed
+        and any outstanding leases.
+        """
+        last_run = self.get_last_run()
+        last_id = last_run.get("guid") or None
+
+        lookup = {}
+        if last_id:
+            lookup[config.ID_FIELD] = {"$gt": self._get_history_id(last_id)}
+
+        history_collection = app.data.get_mongo_collection("archive_history")
+
+        return {
+            "last_id": last_id,
+            "progress": last_run.get("progress") or {},
+            "num_pending": history_collection.count_documents(lookup),
+            "oldest_pending": self.get_oldest_pending(last_run),
+            "leases": [
+                {
+                    "id": lease[config.ID_FIELD],
+                    "last_id": lease.get("guid"),
+                    "end_id": lease.get("end_id"),
+                    "status": lease.get("status"),
+                    "owner": lease.get("owner"),
+                    "expires": lease.get("expires"),
+                    "attempts": lease.get("attempts"),
+                }
+                for lease in self.get_leases()
+            ],
+        }
+
+    def _get_history_id(self, value):
+        value = str(value)
+        return ObjectId(value) if ObjectId.is_valid(value) else value
+
+    def get_oldest_pending(self, last_run=None):
+        """Get the ``_created`` date of the oldest archive_history entry that is yet to be processed
+
+        Includes the entries of outstanding leases (that are before the id stored in the last run)
+
+        :param dict last_run: The last run system record, defaults to ``get_last_run``
+        :return datetime: The date of the oldest pending entry, or None if there are no pending entries
+        """
+        if last_run is None:
+            last_run = self.get_last_run()
+
+        lookups = [{}]
+        if last_run.get("guid"):
+            lookups[0][config.ID_FIELD] = {"$gt": self._get_history_id(last_run["guid"])}
+
+        for lease in self.get_leases():
+            lookup = {config.ID_FIELD: {"$lte": self._get_history_id(lease["end_id"])}}
+            if lease.get("guid"):
+                lookup[config.ID_FIELD]["$gt"] = self._get_history_id(lease["guid"])
+            lookups.append(lookup)
+
+        history_collection = app.data.get_mongo_collection("archive_history")
+        oldest_pending = None
 
-    def get_history_items(self, last_id, gte, item_id, chunk_size=0):
-        history_service = get_resource_service("archive_history")
+        for lookup in lookups:
+            history = history_collection.find_one(lookup, projection={"_created": 1}, sort=[(config.ID_FIELD, 1)])
 
+            if history and history.get("_created") and (oldest_pending is None or history["_created"] < oldest_pending):
+                oldest_pending = history["_created"]
+
+        return oldest_pending
+
+    def get_backlog_lag(self):
+        """Get the age (in seconds) of the oldest archive_history entry that is yet to be processed
+
+        :return float: The backlog lag, 0 if there are no pending entries
+        """
+        oldest_pending = self.get_oldest_pending()
+        return max((utcnow() - oldest_pending).total_seconds(), 0) if oldest_pending else 0
+
+    def get_items_by_ids(self, item_ids, chunk_size=500):
+        """Get the statistics documents for the provided item ids
+
+        The documents are retrieved using ``$in`` queries of at most ``chunk_size`` ids each,
+        instead of a query per item.
+
+        :param item_ids: List of item ids to retrieve
+        :param int chunk_size: Maximum number of ids per query
+        :return dict: Dictionary of statistics documents, keyed by their item id
+        """
+        item_ids = list({str(item_id) for item_id in item_ids if item_id})
+        items = {}
+
+        for start in range(0, len(item_ids), chunk_size):
+            end = start + chunk_size
+            lookup = {config.ID_FIELD: {"$in": item_ids[start:end]}}
+
+            for item in self.get_from_mongo(req=None, lookup=lookup):
+                items[str(item[config.ID_FIELD])] = item
+
+        return items
+
+    def get_items_by_family_root_ids(self, root_ids, chunk_size=500):
+        """Get the statistics documents of the archive items in the rewrite families of ``root_ids``
+
+        :param root_ids: List of ``family_root_id`` values
+        :param int chunk_size: Maximum number of root ids per query
+        :return dict: Dictionary of statistics documents, keyed by their item id
+        """
+        root_ids = list({str(root_id) for root_id in root_ids if root_id})
+        items = {}
+
+        for start in range(0, len(root_ids), chunk_size):
+            end = start + chunk_size
+            lookup = {"family_root_id": {"$in": root_ids[start:end]}, "stats_type": "archive"}
+
+            for item in self.get_from_mongo(req=None, lookup=lookup):
+                items[str(item[config.ID_FIELD])] = item
+
+        return items
+
+    def get_leases_collection(self):
+        # Leases are system records that are only ever used from Mongo
+        # So they are read/written directly, allowing atomic claiming of leases
+        return app.data.get_mongo_collection(self.datasource)
+
+    def create_lease(self, start_id, end_id, gte=None):
+        """Create a lease for the archive_history entries after ``start_id`` up to and including ``end_id``
+
+        The ``guid`` attribute of the lease stores the id of the last processed archive_history entry
+
+        :param str start_id: The id of the last processed entry before this lease (exclusive)
+        :param str end_id: The id of the last entry in this lease (inclusive)
+        :param datetime gte: Only process entries created on or after this date
+        :return dict: The new lease
+        """
+        now = utcnow()
+        lease = {
+            config.ID_FIELD: str(ObjectId()),
+            "stats_type": "lease",
+            "guid": start_id,
+            "end_id": end_id,
+            "gte": gte,
+            "status": LEASE_STATUS.PENDING,
+            "owner": None,
+            "expires": None,
+            "attempts": 0,
+            config.DATE_CREATED: now,
+            config.LAST_UPDATED: now,
+        }
+        self.get_leases_collection().insert_one(lease)
+        return lease
+
+    def get_leases(self):
+        return list(self.get_leases_collection().find({"stats_type": "lease"}).sort("end_id", 1))
+
+    def claim_lease(self, owner, expiry):
+        """Atomically claim the next pending (or expired) lease
+
+        :param str owner: The name of the worker claiming the lease
+        :param int expiry: Number of seconds before the lease expires
+        :return dict: The claimed lease, or None if there are no leases available
+        """
+        now = utcnow()
+        return self.get_leases_collection().find_one_and_update(
+            {
+                "stats_type": "lease",
+                "$or": [
+                    {"status": LEASE_STATUS.PENDING},
+                    {"status": LEASE_STATUS.PROCESSING, "expires": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": LEASE_STATUS.PROCESSING,
+                    "owner": owner,
+                    "expires": now + timedelta(seconds=expiry),
+                    config.LAST_UPDATED: now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("end_id", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _get_lease_lookup(self, lease):
+        # Only the current owner of the lease is allowed to modify it
+        return {
+            config.ID_FIELD: lease[config.ID_FIELD],
+            "owner": lease["owner"],
+            "attempts": lease["attempts"],
+        }
+
+    def update_lease(self, lease, last_id, expiry):
+        """Store the id of the last processed archive_history entry, and extend the lease expiry
+
+        :return bool: False if the lease has been claimed by another worker
+        """
+        now = utcnow()
+        result = self.get_leases_collection().update_one(
+            self._get_lease_lookup(lease),
+            {
+                "$set": {
+                    "guid": last_id,
+                    "expires": now + timedelta(seconds=expiry),
+                    config.LAST_UPDATED: now,
+                }
+            },
+        )
+
+        if result.matched_count < 1:
+            return False
+
+        lease["guid"] = last_id
+        return True
+
+    def complete_lease(self, lease):
+        """Remove the lease once all of its archive_history entries have been processed"""
+        return self.get_leases_collection().delete_one(self._get_lease_lookup(lease)).deleted_count > 0
+
+    def requeue_expired_leases(self):
+        """Set leases that have expired back to pending
+
+        :return int: The number of leases re-queued
+        """
+        return (
+            self.get_leases_collection()
+            .update_many(
+                {
+                    "stats_type": "lease",
+                    "status": LEASE_STATUS.PROCESSING,
+                    "expires": {"$lt": utcnow()},
+                },
+                {"$set": {"status": LEASE_STATUS.PENDING, "owner": None, "expires": None}},
+            )
+            .modified_count
+        )
+
+    def get_history_projection(self):
+        """Get the archive_history attributes used when generating statistics
+
+        The large ``update`` dictionary is limited to the attributes that are actually used
+        """
+        projection = {
+            config.ID_FIELD: 1,
+            "item_id": 1,
+            "user_id": 1,
+            "operation": 1,
+            "version": 1,
+            "original_item_id": 1,
+            config.DATE_CREATED: 1,
+        }
+
+        update_fields = (
+            METADATA_FIELDS + HISTORY_UPDATE_FIELDS + (app.config.get("ANALYTICS_STATS_HISTORY_UPDATE_FIELDS") or [])
+        )
+        projection.update({"update.{}".format(field): 1 for field in update_fields})
+
+        return projection
+
+    def get_history_items(self, last_id, gte, item_id, chunk_size=0, end_id=None):
+        """Get the archive_history items to generate statistics for, in chunks of ``chunk_size`` items
+
+        A single Mongo cursor is used to stream the items, instead of a query for each chunk.
+        If the cursor is closed by the server, a new cursor continues from the last item returned.
+
+        :param str last_id: Only return items after this id
+        :param datetime gte: Only return items created on or after this date
+        :param str item_id: Only return items for this archive item
+        :param int chunk_size: Number of items per chunk (all items in one chunk if 0 or None).
+            If an ``AdaptiveChunkSize``, the current size is used for each chunk
+        :param str end_id: Only return items up to and including this id
+        """
+        history_collection = app.data.get_mongo_collection("archive_history")
+        batch_size = get_chunk_size(chunk_size)
+        projection = self.get_history_projection()
         last_processed_id = last_id
+        chunk = []
 
         while True:
-            req = ParsedRequest()
-            req.sort = '[("_id", 1), ("version", 1)]'
-
-            query = {"$and": []}
+            query = {}
 
             if gte:
-                query["$and"].append({"_created": {"$gte": date_to_str(gte)}})
+                query[config.DATE_CREATED] = {"$gte": gte}
 
             if item_id:
-                query["$and"].append({"item_id": str(item_id)})
+                query["item_id"] = str(item_id)
+
+            if last_processed_id or end_id:
+                query[config.ID_FIELD] = {}
+
+                if last_processed_id:
+                    query[config.ID_FIELD]["$gt"] = self._get_history_id(last_processed_id)
+
+                if end_id:
+                    query[config.ID_FIELD]["$lte"] = self._get_history_id(end_id)
+
+            cursor = history_collection.find(
+                query,
+                projection=projection,
+                sort=[(config.ID_FIELD, 1), ("version", 1)],
+                batch_size=batch_size or 1000,
+                no_cursor_timeout=True,
+            )
+
+            try:
+                for history_item in cursor:
+                    chunk.append(history_item)
+
+                    if batch_size and len(chunk) >= batch_size:
+                        last_processed_id = chunk[-1][config.ID_FIELD]
+                        yield chunk
+                        chunk = []
+                        batch_size = get_chunk_size(chunk_size)
+            except CursorNotFound:
+                # The cursor was closed by the server (i.e. idle session timeout while processing a chunk)
+                # Continue from the last item received
+                if chunk:
+                    last_processed_id = chunk[-1][config.ID_FIELD]
+                    yield chunk
+                    chunk = []
+
+                logger.warning("archive_history cursor closed, continuing from {}".format(last_processed_id))
+                continue
+            finally:
+                cursor.close()
+
+            break
+
+        if chunk:
+            yield chunk
+
+    def get_history_items_by_item_ids(self, item_ids):
+        """Get the full history of the provided items, using a single request
 
-            if last_processed_id:
-                query["$and"].append({"_id": {"$gt": str(last_processed_id)}})
+        :param list item_ids: The ids of the archive items
+        :return list: The archive_history items, sorted by their id
+        """
+        history_collection = app.data.get_mongo_collection("archive_history")
+        history_items = list(
+            history_collection.find(
+                {"item_id": {"$in": [str(item_id) for item_id in item_ids]}},
+                projection=self.get_history_projection(),
+            )
+        )
 
-            req.where = json.dumps(query)
+        # Sorted here, so the ``item_id`` index is used for the query
+        return sorted(history_items, key=lambda history: (history[config.ID_FIELD], history.get("version") or 0))
 
-            if chunk_size > 0:
-                req.max_results = int(chunk_size)
+    def get_item_ids_by_query(self, query, page_size=1000):
+        """Get the ids of the archive items whose statistics match an Elasticsearch query
 
-            items = list(history_service.get(req=req, lookup=None))
+        The ids are retrieved using a scroll, so any number of items can be returned
 
-            if len(items) < 1:
-                break
+        :param dict query: The Elasticsearch query (i.e. ``{"terms": {"stats.timeline.task.desk": [...]}}``)
+        :param int page_size: Number of ids to retrieve per request
+        """
+        elastic = app.data.elastic
 
-            last_processed_id = items[-1][config.ID_FIELD]
-            yield items
+        for hit in scan(
+            elastic.elastic(self.datasource),
+            query={"query": query, "_source": ["stats_type"]},
+            index=elastic.get_index(self.datasource),
+            size=page_size,
+        ):
+            # Only the statistics of archive items (i.e. not the archive_family or system records)
+            if (hit.get("_source") or {}).get("stats_type") == "archive":
+                yield hit["_id"]
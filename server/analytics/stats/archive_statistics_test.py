@@ -0,0 +1,271 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import get_resource_service
+from superdesk.utc import utcnow
+
+from analytics.tests import TestCase
+from analytics.stats.common import LEASE_STATUS
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+
+from pymongo.errors import CursorNotFound
+from unittest import mock
+
+
+class ArchiveStatisticsServiceTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.service = get_resource_service("archive_statistics")
+        self.collection = self.app.data.get_mongo_collection("archive_statistics")
+
+        # The statistics are stored in a separate database
+        self.collection.delete_many({})
+
+    def tearDown(self):
+        self.ctx.pop()
+        super().tearDown()
+
+    def _insert_history(self, num_items):
+        self.app.data.get_mongo_collection("archive_history").insert_many(
+            [
+                {
+                    "_id": "h{:02d}".format(index),
+                    "item_id": "item{}".format(index),
+                    "user_id": "user1",
+                    "operation": "create",
+                    "version": 1,
+                    "_created": utcnow(),
+                    "update": {"state": "in_progress", "body_html": "<p>Test</p>", "fields_meta": {}},
+                }
+                for index in range(1, num_items + 1)
+            ]
+        )
+
+    def _get_history_ids(self, *args, **kwargs):
+        return [
+            [history["_id"] for history in history_items]
+            for history_items in self.service.get_history_items(*args, **kwargs)
+        ]
+
+    def _insert_stats(self, *item_ids, **fields):
+        self.collection.insert_many(
+            [dict({"_id": item_id, "stats_type": "archive", "stats": {}}, **fields) for item_id in item_ids]
+        )
+
+    def test_get_items_by_ids_in_bulk(self):
+        self._insert_stats("item1", "item2", "item3", "item5")
+
+        with mock.patch.object(self.service, "get_from_mongo", wraps=self.service.get_from_mongo) as get_from_mongo:
+            items = self.service.get_items_by_ids(["item1", "item2", "item3", "item5", "item6", None, "item1"], 2)
+
+        self.assertEqual(sorted(items.keys()), ["item1", "item2", "item3", "item5"])
+        self.assertEqual(items["item3"]["stats_type"], "archive")
+
+        # 5 unique ids, with at most 2 ids per query
+        self.assertEqual(get_from_mongo.call_count, 3)
+
+    def test_history_timelines_prefetch_existing_stats(self):
+        self._insert_stats("item1", stats={"timeline": []}, version=3)
+        history_items = [
+            {"_id": "h1", "item_id": "item1", "operation": "update", "version": 4, "update": {}},
+            {"_id": "h2", "item_id": "item2", "operation": "create", "version": 1, "update": {}},
+            {"_id": "h3", "item_id": "item1", "operation": "update", "version": 5, "update": {}},
+        ]
+
+        with mock.patch.object(self.service, "find_one") as find_one:
+            with mock.patch.object(
+                self.service, "get_items_by_ids", wraps=self.service.get_items_by_ids
+            ) as get_items_by_ids:
+                items = GenArchiveStatistics().gen_history_timelines(history_items)
+
+        get_items_by_ids.assert_called_once_with(["item1", "item2", "item1"])
+        find_one.assert_not_called()
+        self.assertEqual(sorted(items.keys()), ["item1", "item2"])
+        self.assertEqual(items["item1"]["item"]["version"], 3)
+
+    def test_claim_leases_in_order(self):
+        self.service.create_lease("h05", "h10")
+        self.service.create_lease(None, "h05")
+
+        lease1 = self.service.claim_lease("worker1", 60)
+        lease2 = self.service.claim_lease("worker2", 60)
+
+        self.assertEqual((lease1["guid"], lease1["end_id"]), (None, "h05"))
+        self.assertEqual((lease2["guid"], lease2["end_id"]), ("h05", "h10"))
+        self.assertEqual(lease1["status"], LEASE_STATUS.PROCESSING)
+        self.assertEqual(lease1["owner"], "worker1")
+        self.assertEqual(lease1["attempts"], 1)
+
+        # Both leases are being processed, and have not expired
+        self.assertIsNone(self.service.claim_lease("worker3", 60))
+
+    def test_expired_lease_is_claimed_by_another_worker(self):
+        self.service.create_lease(None, "h10")
+        expired = self.service.claim_lease("worker1", -1)
+
+        lease = self.service.claim_lease("worker2", 60)
+        self.assertEqual(lease["_id"], expired["_id"])
+        self.assertEqual(lease["owner"], "worker2")
+        self.assertEqual(lease["attempts"], 2)
+
+        # The original owner can no longer progress or complete the lease
+        self.assertFalse(self.service.update_lease(expired, "h03", 60))
+        self.assertFalse(self.service.complete_lease(expired))
+
+        self.assertTrue(self.service.update_lease(lease, "h03", 60))
+        self.assertEqual(self.service.get_leases()[0]["guid"], "h03")
+        self.assertTrue(self.service.complete_lease(lease))
+        self.assertEqual(self.service.get_leases(), [])
+
+    def test_requeue_expired_leases(self):
+        self.service.create_lease(None, "h05")
+        self.service.create_lease("h05", "h10")
+        self.service.claim_lease("worker1", -1)
+        self.service.claim_lease("worker2", 60)
+
+        self.assertEqual(self.service.requeue_expired_leases(), 1)
+
+        leases = self.service.get_leases()
+        self.assertEqual(leases[0]["status"], LEASE_STATUS.PENDING)
+        self.assertIsNone(leases[0]["owner"])
+        self.assertEqual(leases[1]["status"], LEASE_STATUS.PROCESSING)
+        self.assertEqual(leases[1]["owner"], "worker2")
+
+    def test_checkpoint_after_failed_chunk(self):
+        self._insert_history(6)
+        processed = []
+        interrupt = {"h03"}
+
+        def process_history_items(history_items, failed_ids, pool=None):
+            if history_items[0]["_id"] in interrupt:
+                interrupt.clear()
+                raise RuntimeError("Interrupted")
+
+            processed.extend(history["_id"] for history in history_items)
+            return len(history_items)
+
+        with mock.patch.object(GenArchiveStatistics, "process_history_items", side_effect=process_history_items):
+            with self.assertRaises(RuntimeError):
+                GenArchiveStatistics().generate_stats(None, None, 2)
+
+            # The first chunk was stored, so the next run continues from the failed chunk
+            last_run = self.service.get_last_run()
+            self.assertEqual(last_run["guid"], "h02")
+            self.assertEqual(last_run["progress"]["num_chunks"], 1)
+            self.assertEqual(last_run["progress"]["num_history_items"], 2)
+            self.assertIsNone(last_run["progress"]["completed"])
+
+            GenArchiveStatistics().generate_stats(None, None, 2)
+
+        self.assertEqual(processed, ["h01", "h02", "h03", "h04", "h05", "h06"])
+
+        last_run = self.service.get_last_run()
+        self.assertEqual(last_run["guid"], "h06")
+        self.assertEqual(last_run["progress"]["start_id"], "h02")
+        self.assertEqual(last_run["progress"]["num_chunks"], 2)
+        self.assertIsNotNone(last_run["progress"]["completed"])
+
+    def test_stream_history_items_using_a_single_cursor(self):
+        self._insert_history(5)
+        collection = self.app.data.get_mongo_collection("archive_history")
+
+        with mock.patch.object(collection, "find", wraps=collection.find) as find:
+            with mock.patch.object(self.app.data, "get_mongo_collection", return_value=collection):
+                chunks = list(self.service.get_history_items(None, None, None, 2))
+
+        find.assert_called_once()
+        self.assertEqual(
+            [[history["_id"] for history in history_items] for history_items in chunks],
+            [["h01", "h02"], ["h03", "h04"], ["h05"]],
+        )
+
+        # Only the attributes used to generate statistics are loaded
+        self.assertEqual(chunks[0][0]["update"], {"state": "in_progress", "body_html": "<p>Test</p>"})
+
+        self.assertEqual(self._get_history_ids("h01", None, None, 2, end_id="h04"), [["h02", "h03"], ["h04"]])
+        self.assertEqual(self._get_history_ids(None, None, "item3", 2), [["h03"]])
+        self.assertEqual(self._get_history_ids("h03", None, None, 0), [["h04", "h05"]])
+
+    def test_continue_after_cursor_not_found(self):
+        self._insert_history(5)
+        collection = self.app.data.get_mongo_collection("archive_history")
+        find = collection.find
+        cursors = []
+
+        def find_until_closed(*args, **kwargs):
+            cursor = find(*args, **kwargs)
+            cursors.append(args[0])
+
+            if len(cursors) > 1:
+                return cursor
+
+            # The first cursor is closed by the server after returning 3 items
+            def iter_until_closed():
+                for _ in range(3):
+                    yield next(cursor)
+
+                raise CursorNotFound("cursor id not found")
+
+            closed_cursor = mock.MagicMock()
+            closed_cursor.__iter__.return_value = iter_until_closed()
+            return closed_cursor
+
+        with mock.patch.object(collection, "find", side_effect=find_until_closed):
+            with mock.patch.object(self.app.data, "get_mongo_collection", return_value=collection):
+                chunks = self._get_history_ids(None, None, None, 2)
+
+        # The partial chunk is returned, then a new cursor continues after its last item
+        self.assertEqual(chunks, [["h01", "h02"], ["h03"], ["h04", "h05"]])
+        self.assertEqual(cursors[1], {"_id": {"$gt": "h03"}})
+
+    def test_recompute_stats_from_full_history(self):
+        task = {"desk": "desk1", "stage": "stage1", "user": "user1"}
+        self.app.data.get_mongo_collection("archive_history").insert_many(
+            [
+                {
+                    "_id": history_id,
+                    "item_id": item_id,
+                    "user_id": "user1",
+                    "operation": operation,
+                    "version": version,
+                    "_created": utcnow(),
+                    "update": update,
+                }
+                for history_id, item_id, operation, version, update in [
+                    ("h01", "item1", "create", 1, {"task": task, "type": "text", "state": "draft"}),
+                    ("h02", "item2", "create", 1, {"task": task, "type": "text", "state": "draft"}),
+                    ("h03", "item1", "update", 2, {"body_html": "<p>one</p><p>two</p>"}),
+                ]
+            ]
+        )
+
+        # The existing statistics of item1 were generated by a faulty plugin
+        entry = {"history_id": "h99", "operation": "spike", "operation_created": utcnow(), "task": task}
+        self._insert_stats("item1", _etag="etag1", stats={"timeline": [entry]})
+
+        self.assertEqual(
+            [history["_id"] for history in self.service.get_history_items_by_item_ids(["item1"])], ["h01", "h03"]
+        )
+
+        items_processed, failed_ids, num_history_items = GenArchiveStatistics().recompute_stats(["item1", "item2"], 1)
+
+        self.assertEqual((items_processed, failed_ids, num_history_items), (2, [], 3))
+
+        item1 = self.collection.find_one({"_id": "item1"})
+        self.assertEqual([entry["operation"] for entry in item1["stats"]["timeline"]], ["create", "update"])
+        self.assertNotEqual(item1["_etag"], "etag1")
+
+        item2 = self.collection.find_one({"_id": "item2"})
+        self.assertEqual([entry["operation"] for entry in item2["stats"]["timeline"]], ["create"])
+
+        # The last run is not updated when recomputing statistics
+        self.assertEqual(self.service.get_last_run(), {})
@@ -0,0 +1,18 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+"""Development tools to benchmark the generation of statistics
+
+This package is not imported by ``analytics.stats``, so the ``analytics:benchmark_archive_statistics`` command
+is only available when ``analytics.stats.benchmark`` is added to the INSTALLED_APPS of a development instance.
+"""
+
+from .generator import HistoryGenerator  # noqa
+from .runner import BenchmarkArchiveStatistics, run_benchmark  # noqa
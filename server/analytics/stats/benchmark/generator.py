@@ -0,0 +1,310 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from analytics.stats.common import OPERATION
+
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import heapq
+import random
+import struct
+
+DEFAULT_START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+WORDS = [
+    "council",
+    "budget",
+    "storm",
+    "election",
+    "market",
+    "match",
+    "report",
+    "police",
+    "school",
+    "health",
+    "minister",
+    "record",
+]
+
+
+class HistoryGenerator:
+    """Generates a seeded, reproducible stream of archive_history documents
+
+    The history of ``concurrency`` items is interleaved, with each item following a realistic workflow:
+    create, save, lock/unlock, move between desks, add/change/remove featuremedia, publish, correct,
+    spike, rewrite (creating a new item) and duplicate (copying the history of the item to a new item).
+
+    Documents are generated in ``_id`` order, the same order they are read from archive_history.
+
+    Example:
+    ::
+
+        for history in HistoryGenerator(10000, seed=42):
+            ...
+
+    :param int num_entries: Number of archive_history documents to generate
+    :param int seed: Seed for the random generator (the same seed generates the same documents)
+    :param int concurrency: Number of items being worked on at the same time
+    :param int num_desks: Number of desks (each with 2 stages)
+    :param int num_users: Number of users
+    :param datetime start: Date of the first history document
+    """
+
+    def __init__(self, num_entries, seed=0, concurrency=200, num_desks=10, num_users=50, start=None):
+        self.num_entries = int(num_entries)
+        self.seed = seed
+        self.concurrency = max(int(concurrency), 1)
+        self.num_desks = max(int(num_desks), 1)
+        self.num_users = max(int(num_users), 1)
+        self.start = start or DEFAULT_START
+
+    def __iter__(self):
+        self.rng = random.Random(self.seed)
+        self.desks = [
+            {"desk": self._random_id(), "stages": [self._random_id(), self._random_id()]} for _ in range(self.num_desks)
+        ]
+        self.users = [self._random_id() for _ in range(self.num_users)]
+        self.timestamp = self.start.timestamp()
+        self.counter = 0
+        self.num_generated = 0
+        self.pending = []
+        self.sequence = 0
+        self.num_items = 0
+
+        for _ in range(self.concurrency):
+            self._schedule(self._new_item(), self.rng.uniform(0, 600))
+
+        while self.num_generated < self.num_entries:
+            item_time, _, item = heapq.heappop(self.pending)
+            self.timestamp = max(self.timestamp, item_time)
+
+            for history in self._next_operation(item):
+                if self.num_generated >= self.num_entries:
+                    return
+
+                self.num_generated += 1
+                yield history
+
+            if item["done"]:
+                # Replace the finished item, so ``concurrency`` items are always being worked on
+                self._schedule(self._new_item(), self.rng.expovariate(1 / 60))
+            else:
+                self._schedule(item, self.rng.expovariate(1 / 120))
+
+    def _random_id(self):
+        return "{:024x}".format(self.rng.getrandbits(96))
+
+    def _object_id(self):
+        # ObjectId using the generated timestamp, so the ids are ordered by the date they were created
+        self.counter += 1
+        return ObjectId(struct.pack(">IQ", int(self.timestamp), self.counter))
+
+    def _schedule(self, item, delay):
+        self.sequence += 1
+        heapq.heappush(self.pending, (self.timestamp + delay, self.sequence, item))
+
+    def _new_item(self, **kwargs):
+        self.num_items += 1
+        desk = self.rng.choice(self.desks)
+        item = {
+            "_id": "urn:newsml:localhost:benchmark-{}-{}".format(self.seed, self.num_items),
+            "type": "picture" if self.rng.random() < 0.1 else "text",
+            "version": 0,
+            "desk": desk["desk"],
+            "stage": desk["stages"][0],
+            "user": self.rng.choice(self.users),
+            "state": None,
+            "featuremedia": None,
+            "paragraphs": 0,
+            "history": [],
+            "done": False,
+        }
+        item.update(kwargs)
+        return item
+
+    def _history(self, item, operation, update, **kwargs):
+        created = datetime.fromtimestamp(self.timestamp, timezone.utc)
+        self.timestamp += self.rng.uniform(0.001, 0.5)
+
+        if operation not in [OPERATION.ITEM_LOCK, OPERATION.ITEM_UNLOCK]:
+            item["version"] += 1
+
+        history = {
+            "_id": self._object_id(),
+            "item_id": item["_id"],
+            "user_id": item["user"],
+            "operation": operation,
+            "update": update,
+            "version": item["version"],
+            "_created": created,
+            "_updated": created,
+        }
+        history.update(kwargs)
+        item["history"].append(history)
+        return history
+
+    def _task(self, item):
+        return {"desk": item["desk"], "stage": item["stage"], "user": item["user"]}
+
+    def _body_html(self, item):
+        item["paragraphs"] += self.rng.randint(1, 3)
+        return "".join(
+            "<p>{}</p>".format(" ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(5, 20))))
+            for _ in range(item["paragraphs"])
+        )
+
+    def _featuremedia(self):
+        media_id = self._random_id()
+        return {
+            "_id": media_id,
+            "type": "picture",
+            "poi": {"x": round(self.rng.random(), 2), "y": round(self.rng.random(), 2)},
+            "renditions": {
+                "original": {"width": 1920, "height": 1080, "media": media_id},
+                "16-9": {
+                    "width": 1280,
+                    "height": 720,
+                    "media": media_id,
+                    "CropLeft": self.rng.randint(0, 100),
+                    "CropTop": 0,
+                    "CropRight": 1280,
+                    "CropBottom": 720,
+                },
+            },
+        }
+
+    def _next_operation(self, item):
+        if not item["history"]:
+            item["state"] = "in_progress"
+            update = {
+                "task": self._task(item),
+                "type": item["type"],
+                "headline": " ".join(self.rng.choice(WORDS) for _ in range(5)),
+                "slugline": self.rng.choice(WORDS),
+                "urgency": self.rng.randint(1, 5),
+                "state": item["state"],
+            }
+
+            if item.get("rewrite_of"):
+                update["rewrite_of"] = item["rewrite_of"]
+
+            if item["type"] == "picture":
+                update.update(self._featuremedia())
+                update.pop("_id")
+            else:
+                update["body_html"] = self._body_html(item)
+
+            return [self._history(item, OPERATION.CREATE, update)]
+
+        choice = self.rng.random()
+        published = item["state"] == "published"
+
+        if not published and choice < 0.3:
+            # Lock, save and unlock the item
+            item["user"] = self.rng.choice(self.users)
+            return [
+                self._history(
+                    item,
+                    OPERATION.ITEM_LOCK,
+                    {
+                        "lock_user": item["user"],
+                        "lock_session": self._random_id(),
+                        "lock_action": "edit",
+                        "lock_time": datetime.fromtimestamp(self.timestamp, timezone.utc),
+                    },
+                ),
+                self._history(item, OPERATION.UPDATE, self._update(item)),
+                self._history(
+                    item,
+                    OPERATION.ITEM_UNLOCK,
+                    {"lock_user": None, "lock_session": None, "lock_action": None, "lock_time": None},
+                ),
+            ]
+        elif not published and choice < 0.45:
+            desk = self.rng.choice(self.desks)
+            item["desk"] = desk["desk"]
+            item["stage"] = self.rng.choice(desk["stages"])
+            return [self._history(item, OPERATION.MOVE, {"task": {"desk": item["desk"], "stage": item["stage"]}})]
+        elif not published and choice < 0.55 and item["type"] == "text":
+            return [self._history(item, OPERATION.UPDATE, self._update_featuremedia(item))]
+        elif not published and choice < 0.6:
+            return self._duplicate(item)
+        elif not published and choice < 0.9:
+            item["state"] = "published"
+            return [
+                self._history(
+                    item, OPERATION.PUBLISH, {"state": item["state"], "pubstatus": "usable", "task": self._task(item)}
+                )
+            ]
+        elif not published:
+            item["state"] = "spiked"
+            item["done"] = True
+            return [self._history(item, OPERATION.SPIKE, {"state": item["state"]})]
+        elif choice < 0.3:
+            update = self._update(item)
+            update["state"] = "corrected"
+            return [self._history(item, OPERATION.CORRECT, update)]
+        elif choice < 0.6 and item["type"] == "text":
+            return self._rewrite(item)
+
+        item["done"] = True
+        return []
+
+    def _update(self, item):
+        if item["type"] == "picture":
+            return {"poi": {"x": round(self.rng.random(), 2), "y": round(self.rng.random(), 2)}}
+
+        return {"body_html": self._body_html(item), "headline": " ".join(self.rng.choice(WORDS) for _ in range(5))}
+
+    def _update_featuremedia(self, item):
+        choice = self.rng.random()
+
+        if item["featuremedia"] is None or choice < 0.4:
+            item["featuremedia"] = self._featuremedia()
+        elif choice < 0.8:
+            item["featuremedia"] = dict(item["featuremedia"])
+            item["featuremedia"]["poi"] = {"x": round(self.rng.random(), 2), "y": round(self.rng.random(), 2)}
+        else:
+            item["featuremedia"] = None
+
+        return {"associations": {"featuremedia": item["featuremedia"]}}
+
+    def _rewrite(self, item):
+        item["done"] = True
+        rewrite = self._new_item(type="text", rewrite_of=item["_id"], desk=item["desk"], stage=item["stage"])
+        history = [
+            self._history(item, OPERATION.REWRITE, {"rewritten_by": rewrite["_id"]}),
+        ]
+        history.extend(self._next_operation(rewrite))
+        self._schedule(rewrite, self.rng.expovariate(1 / 120))
+        return history
+
+    def _duplicate(self, item):
+        duplicate = self._new_item(type=item["type"], desk=item["desk"], stage=item["stage"], user=item["user"])
+        history = [self._history(item, OPERATION.DUPLICATE, {"duplicate_id": duplicate["_id"]})]
+
+        # The history of the original item is copied to the duplicate
+        for original in item["history"][:-1]:
+            copy = dict(original)
+            copy.update({"_id": self._object_id(), "item_id": duplicate["_id"], "original_item_id": item["_id"]})
+            history.append(copy)
+
+        duplicate["version"] = item["version"]
+        duplicate["paragraphs"] = item["paragraphs"]
+        duplicate["state"] = "in_progress"
+        history.append(
+            self._history(
+                duplicate,
+                OPERATION.DUPLICATED_FROM,
+                {"task": self._task(duplicate), "duplicate_id": item["_id"]},
+            )
+        )
+        self._schedule(duplicate, self.rng.expovariate(1 / 120))
+        return history
@@ -0,0 +1,151 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import Command, command, Option
+
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+from analytics.stats.benchmark.generator import HistoryGenerator
+from analytics.stats.metrics import metrics
+from analytics.stats.offline import offline_statistics
+from analytics.stats.par_count import par_count_cache
+
+import resource
+import time
+
+# Stages of the statistics generation that are not nested within other stages
+# (as well as the start and finish hooks of the plugins)
+TOP_LEVEL_STAGES = [
+    "fetch_history",
+    "gen_history_timelines",
+    "build_timelines",
+    "rewrites",
+    "complete_timelines",
+    "write",
+]
+
+
+def get_peak_rss():
+    """Get the peak resident set size (in MB) of this process and its (terminated) worker processes"""
+
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024
+
+
+def run_benchmark(num_entries, chunk_size=1000, seed=0, workers=1, concurrency=200):
+    """Generate statistics for ``num_entries`` synthetic archive_history documents, using in-memory services
+
+    :param int num_entries: Number of archive_history documents to generate statistics for
+    :param int chunk_size: Number of archive_history documents to process per chunk
+    :param int seed: Seed used to generate the archive_history documents
+    :param int workers: Number of processes used to generate the item timelines
+    :param int concurrency: Number of items being worked on at the same time
+    :return dict: The results of the benchmark
+    """
+
+    metrics.reset()
+    par_count_cache.clear()
+    history = HistoryGenerator(num_entries, seed=seed, concurrency=concurrency)
+
+    with offline_statistics(history) as service:
+        started = time.perf_counter()
+        items_processed, failed_ids, num_history_items = GenArchiveStatistics().generate_stats(
+            None, None, chunk_size, workers
+        )
+        duration = time.perf_counter() - started
+        num_docs = len(service.docs)
+
+    timings = dict(metrics.timings)
+    timings["other"] = duration - sum(
+        seconds
+        for stage, seconds in timings.items()
+        if stage in TOP_LEVEL_STAGES or stage.endswith(":start") or stage.endswith(":finish")
+    )
+
+    return {
+        "num_entries": num_history_items,
+        "chunk_size": chunk_size,
+        "workers": workers,
+        "duration": duration,
+        "entries_per_second": num_history_items / duration if duration else 0,
+        "items_per_second": items_processed / duration if duration else 0,
+        "num_items": num_docs,
+        "num_failed": len(failed_ids),
+        "peak_rss": get_peak_rss(),
+        "timings": timings,
+        "counters": dict(metrics.counters),
+        "par_count_cache": par_count_cache.info(),
+    }
+
+
+class BenchmarkArchiveStatistics(Command):
+    """Measure the throughput of generating statistics from synthetic archive_history documents
+
+    The archive_history documents are generated using a seeded ``HistoryGenerator``,
+    and the statistics are stored using in-memory services (no Mongo or Elasticsearch requests are made).
+
+    Options
+    ::
+
+        -n, --num-entries (defaults to 10000):
+        Comma separated list of the number of archive_history documents to benchmark
+        -c, --chunk-size (defaults to 1000):
+        Comma separated list of chunk sizes to benchmark
+        -s, --seed (defaults to 0):
+        Seed used to generate the archive_history documents
+        -w, --workers (defaults to 1):
+        Number of processes used to generate the item timelines
+        -C, --concurrency (defaults to 200):
+        Number of items being worked on at the same time
+
+    The peak RSS is the peak of this process, so run a single dataset size per command to measure its memory usage.
+
+    Example:
+    ::
+
+        $ python manage.py analytics:benchmark_archive_statistics
+        $ python manage.py analytics:benchmark_archive_statistics -n 10000,100000,1000000 -c 500,1000,5000
+        $ python manage.py analytics:benchmark_archive_statistics -num-entries 10000000 -chunk-size 5000 -w 8
+
+    """
+
+    option_list = [
+        Option("--num-entries", "-n", dest="num_entries", default="10000"),
+        Option("--chunk-size", "-c", dest="chunk_size", default="1000"),
+        Option("--seed", "-s", dest="seed", default=0),
+        Option("--workers", "-w", dest="workers", default=1),
+        Option("--concurrency", "-C", dest="concurrency", default=200),
+    ]
+
+    def run(self, num_entries="10000", chunk_size="1000", seed=0, workers=1, concurrency=200):
+        for num in str(num_entries).split(","):
+            for size in str(chunk_size).split(","):
+                self.print_results(
+                    run_benchmark(
+                        int(num), int(size), seed=int(seed), workers=int(workers), concurrency=int(concurrency)
+                    )
+                )
+
+    def print_results(self, results):
+        print(
+            "entries={num_entries} chunk_size={chunk_size} workers={workers}: "
+            "{entries_per_second:.0f} entries/sec, {items_per_second:.0f} items/sec, "
+            "{num_items} items, {num_failed} failed, peak RSS {peak_rss:.0f} MB, "
+            "duration {duration:.1f} seconds".format(**results)
+        )
+        print("    paragraph count cache: {}".format(results["par_count_cache"]))
+        print("    counters: {}".format(results["counters"]))
+
+        # Stages are nested (i.e. the plugin hooks are part of build_timelines)
+        for stage, duration in sorted(results["timings"].items(), key=lambda stage: -stage[1]):
+            print("    {}: {:.2f} seconds ({:.0%})".format(stage, duration, duration / results["duration"]))
+
+
+command("analytics:benchmark_archive_statistics", BenchmarkArchiveStatistics())
@@ -0,0 +1,243 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import get_resource_service
+from superdesk.logging import logger
+from superdesk.utc import utcnow
+
+from flask import current_app as app
+from eve.utils import config, document_etag
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class StatisticsBulkWriter:
+    """Collects creates and updates for a statistics resource and writes them in bulk
+
+    Pending writes are sent to Mongo using a single ``bulk_write`` request,
+    and the resulting documents are then indexed in Elasticsearch using a single ``_bulk`` request.
+
+    Any item that fails to be written to either Mongo or Elasticsearch is added to ``failed_ids``.
+
+    Updates can provide the ``_etag`` of the document they were generated from. If the document was
+    modified by another process in the meantime, the update is not applied and the item is added to
+    ``conflict_ids`` instead (or ``failed_ids`` if ``conflict_ids`` is not provided).
+
+    Example:
+    ::
+
+        with StatisticsBulkWriter(failed_ids=failed_ids) as writer:
+            writer.create({"_id": "item1", "stats_type": "archive"})
+            writer.update("item2", {"num_desk_transitions": 2})
+
+    :param str resource: Name of the resource to write to
+    :param int flush_size: Number of pending writes before automatically flushing,
+        defaults to ANALYTICS_STATS_BULK_FLUSH_SIZE config (500)
+    :param refresh: Elasticsearch refresh behaviour (True, False or 'wait_for'),
+        defaults to ANALYTICS_STATS_BULK_REFRESH config (True)
+    :param list failed_ids: List to add the ids of items that failed to be written
+    :param list conflict_ids: List to add the ids of items that were modified by another process
+    """
+
+    def __init__(
+        self,
+        resource="archive_statistics",
+        flush_size=None,
+        refresh=None,
+        failed_ids=None,
+        conflict_ids=None,
+    ):
+        self.resource = resource
+        self.flush_size = int(flush_size or app.config.get("ANALYTICS_STATS_BULK_FLUSH_SIZE") or 500)
+        self.refresh = app.config.get("ANALYTICS_STATS_BULK_REFRESH", True) if refresh is None else refresh
+        self.failed_ids = failed_ids if failed_ids is not None else []
+        self.conflict_ids = conflict_ids if conflict_ids is not None else self.failed_ids
+
+        # Dictionaries keyed by item id, so multiple writes to the same item are merged
+        self._creates = {}
+        self._updates = {}
+        self._etags = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def __len__(self):
+        return len(self._creates) + len(self._updates)
+
+    def create(self, doc):
+        """Add a new document to be created
+
+        If a document with the same id was created by another process in the meantime,
+        the item is added to ``conflict_ids``
+
+        :param dict doc: The document to create (must contain an ``_id``)
+        """
+        item_id = doc[config.ID_FIELD]
+
+        self._updates.pop(item_id, None)
+        self._etags.pop(item_id, None)
+        self._creates[item_id] = doc
+        self._flush_if_full()
+
+    def update(self, item_id, updates, etag=None):
+        """Add updates for an existing document
+
+        :param str item_id: The id of the document to update
+        :param dict updates: The fields to update
+        :param str etag: The ``_etag`` of the document the updates were generated from
+        """
+        if item_id in self._creates:
+            self._creates[item_id].update(updates)
+        else:
+            self._updates.setdefault(item_id, {}).update(updates)
+
+            if etag and item_id not in self._etags:
+                self._etags[item_id] = etag
+
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Write all pending creates and updates to Mongo and Elasticsearch
+
+        :return list: The ids of the items successfully written
+        """
+        if not len(self):
+            return []
+
+        creates = self._creates
+        updates = self._updates
+        etags = self._etags
+        self._creates = {}
+        self._updates = {}
+        self._etags = {}
+
+        item_ids, new_etags = self._write_to_mongo(creates, updates, etags)
+        return self._write_to_elastic(item_ids, new_etags)
+
+    def _get_schema_defaults(self):
+        schema = app.config["DOMAIN"][self.resource]["schema"]
+        return {field: field_schema["default"] for field, field_schema in schema.items() if "default" in field_schema}
+
+    def _write_to_mongo(self, creates, updates, etags):
+        now = utcnow()
+        defaults = self._get_schema_defaults()
+        requests = []
+        new_etags = {}
+
+        for item_id, doc in creates.items():
+            doc = {key: value for key, value in doc.items() if key != config.ID_FIELD}
+
+            for field, value in defaults.items():
+                doc.setdefault(field, value)
+
+            created = doc.pop(config.DATE_CREATED, None) or now
+            doc[config.LAST_UPDATED] = now
+            doc[config.ETAG] = new_etags[item_id] = document_etag(doc)
+
+            # Only insert the document if it wasn't created by another process in the meantime
+            requests.append(
+                UpdateOne(
+                    {config.ID_FIELD: item_id, config.ETAG: {"$exists": False}},
+                    {"$set": doc, "$setOnInsert": {config.DATE_CREATED: created}},
+                    upsert=True,
+                )
+            )
+
+        for item_id, doc in updates.items():
+            doc = {key: value for key, value in doc.items() if key != config.ID_FIELD}
+            doc[config.LAST_UPDATED] = now
+            doc[config.ETAG] = new_etags[item_id] = document_etag(doc)
+
+            lookup = {config.ID_FIELD: item_id}
+            if etags.get(item_id):
+                lookup[config.ETAG] = etags[item_id]
+
+            requests.append(UpdateOne(lookup, {"$set": doc}))
+
+        item_ids = list(creates.keys()) + list(updates.keys())
+        failed = set()
+        conflicts = set()
+
+        try:
+            app.data.get_mongo_collection(self.resource).bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors") or []:
+                item_id = item_ids[error["index"]]
+
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    conflicts.add(item_id)
+                    continue
+
+                failed.add(item_id)
+                logger.error("Failed to write stats for item {}. error={}".format(item_id, error.get("errmsg")))
+        except Exception:
+            logger.exception("Failed to write stats for items {}".format(", ".join(item_ids)))
+            failed.update(item_ids)
+
+        self.failed_ids.extend([item_id for item_id in item_ids if item_id in failed])
+        self.conflict_ids.extend([item_id for item_id in item_ids if item_id in conflicts])
+        return [item_id for item_id in item_ids if item_id not in failed and item_id not in conflicts], new_etags
+
+    def _write_to_elastic(self, item_ids, etags):
+        if not item_ids:
+            return []
+
+        # Index the full documents from Mongo, so Elasticsearch has the same data as the database
+        docs = get_resource_service(self.resource).get_items_by_ids(item_ids, chunk_size=self.flush_size)
+
+        missing_ids = [item_id for item_id in item_ids if item_id not in docs]
+        if missing_ids:
+            logger.error("Failed to find stats for items {}".format(", ".join(missing_ids)))
+
+        # If the document has a different etag, then the update was not applied
+        # as the document was modified by another process
+        conflicts = [
+            item_id for item_id, doc in docs.items() if doc.get(config.ETAG) and doc[config.ETAG] != etags.get(item_id)
+        ]
+        for item_id in conflicts:
+            docs.pop(item_id)
+
+        failed = set(missing_ids)
+
+        if docs:
+            try:
+                _, errors = app.data.elastic.bulk_insert(
+                    self.resource,
+                    list(docs.values()),
+                    refresh=self.refresh,
+                    raise_on_error=False,
+                    chunk_size=self.flush_size,
+                )
+            except Exception:
+                logger.exception("Failed to index stats for items {}".format(", ".join(docs.keys())))
+                errors = []
+                failed.update(docs.keys())
+
+            for error in errors or []:
+                result = next(iter(error.values()), {})
+                failed.add(str(result.get(config.ID_FIELD)))
+                logger.error(
+                    "Failed to index stats for item {}. error={}".format(
+                        result.get(config.ID_FIELD), result.get("error")
+                    )
+                )
+
+        self.failed_ids.extend([item_id for item_id in item_ids if item_id in failed])
+        self.conflict_ids.extend(conflicts)
+        return [item_id for item_id in item_ids if item_id not in failed and item_id not in conflicts]
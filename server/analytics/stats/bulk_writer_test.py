@@ -0,0 +1,111 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from analytics.tests import TestCase
+from analytics.stats.bulk_writer import StatisticsBulkWriter
+
+from unittest import mock
+
+
+class StatisticsBulkWriterTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.collection = self.app.data.get_mongo_collection("archive_statistics")
+
+        # The statistics are stored in a separate database
+        self.collection.delete_many({})
+
+        self.failed_ids = []
+        self.conflict_ids = []
+
+        patcher = mock.patch.object(self.app.data.elastic, "bulk_insert", return_value=(0, []))
+        self.bulk_insert = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.ctx.pop()
+        super().tearDown()
+
+    def _writer(self, **kwargs):
+        return StatisticsBulkWriter(failed_ids=self.failed_ids, conflict_ids=self.conflict_ids, **kwargs)
+
+    def _indexed_ids(self):
+        return sorted(doc["_id"] for call in self.bulk_insert.call_args_list for doc in call[0][1])
+
+    def test_writes_in_bulk(self):
+        self.collection.insert_one({"_id": "item2", "stats_type": "archive", "_etag": "etag2"})
+
+        with mock.patch.object(self.collection, "bulk_write", wraps=self.collection.bulk_write) as bulk_write:
+            with mock.patch.object(self.app.data, "get_mongo_collection", return_value=self.collection):
+                with self._writer() as writer:
+                    writer.create({"_id": "item1", "stats_type": "archive"})
+                    writer.update("item1", {"num_desk_transitions": 1})
+                    writer.update("item2", {"num_desk_transitions": 2}, etag="etag2")
+
+        bulk_write.assert_called_once()
+        self.assertEqual(len(bulk_write.call_args[0][0]), 2)
+        self.assertEqual(self._indexed_ids(), ["item1", "item2"])
+
+        item1 = self.collection.find_one({"_id": "item1"})
+        self.assertEqual(item1["num_desk_transitions"], 1)
+        self.assertIsNotNone(item1["_etag"])
+        self.assertNotEqual(self.collection.find_one({"_id": "item2"})["_etag"], "etag2")
+        self.assertEqual(self.failed_ids, [])
+        self.assertEqual(self.conflict_ids, [])
+
+    def test_flushes_when_full(self):
+        writer = self._writer(flush_size=2)
+        writer.create({"_id": "item1", "stats_type": "archive"})
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+        writer.create({"_id": "item2", "stats_type": "archive"})
+        self.assertEqual(self.collection.count_documents({}), 2)
+        self.assertEqual(len(writer), 0)
+
+    def test_duplicate_create_is_a_conflict(self):
+        self.collection.insert_one({"_id": "item1", "stats_type": "archive", "_etag": "etag1", "version": 1})
+
+        with self._writer() as writer:
+            writer.create({"_id": "item1", "stats_type": "archive", "version": 2})
+            writer.create({"_id": "item2", "stats_type": "archive", "version": 1})
+
+        self.assertEqual(self.conflict_ids, ["item1"])
+        self.assertEqual(self.failed_ids, [])
+        self.assertEqual(self._indexed_ids(), ["item2"])
+        self.assertEqual(self.collection.find_one({"_id": "item1"})["version"], 1)
+
+    def test_etag_mismatch_is_a_conflict(self):
+        self.collection.insert_many(
+            [
+                {"_id": "item1", "stats_type": "archive", "_etag": "etag1", "version": 1},
+                {"_id": "item2", "stats_type": "archive", "_etag": "etag2", "version": 1},
+            ]
+        )
+
+        with self._writer() as writer:
+            # item1 was modified by another process since its statistics were loaded
+            writer.update("item1", {"version": 2}, etag="stale")
+            writer.update("item2", {"version": 2}, etag="etag2")
+
+        self.assertEqual(self.conflict_ids, ["item1"])
+        self.assertEqual(self.failed_ids, [])
+        self.assertEqual(self._indexed_ids(), ["item2"])
+        self.assertEqual(self.collection.find_one({"_id": "item1"})["version"], 1)
+        self.assertEqual(self.collection.find_one({"_id": "item2"})["version"], 2)
+
+    def test_conflicts_are_failures_without_conflict_ids(self):
+        self.collection.insert_one({"_id": "item1", "stats_type": "archive", "_etag": "etag1"})
+
+        with StatisticsBulkWriter(failed_ids=self.failed_ids) as writer:
+            writer.update("item1", {"version": 2}, etag="stale")
+
+        self.assertEqual(self.failed_ids, ["item1"])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.logging import logger
+
+from bson import BSON
+from flask import current_app as app
+
+# Limits of the adaptive chunk size
+MIN_CHUNK_SIZE = 50
+MAX_CHUNK_SIZE = 20000
+
+# Maximum factor the chunk size is grown or shrunk by after each chunk
+MAX_GROWTH = 2.0
+MAX_SHRINK = 0.25
+
+
+def get_chunk_size(chunk_size):
+    """Get the current number of items per chunk (0 for all items in one chunk)
+
+    :param chunk_size: Number of items per chunk, or an ``AdaptiveChunkSize``
+    """
+
+    size = int(chunk_size) if chunk_size else 0
+    return size if size > 0 else 0
+
+
+def get_payload_size(history_items):
+    """Get the size (in bytes) of the archive_history items, as stored in Mongo"""
+
+    size = 0
+
+    for history_item in history_items:
+        try:
+            size += len(BSON.encode(history_item))
+        except Exception:
+            size += len(str(history_item))
+
+    return size
+
+
+class AdaptiveChunkSize:
+    """Number of archive_history items per chunk, adjusted after each chunk
+
+    The chunk size is adjusted so that a chunk is processed in ``target_duration`` seconds (from the measured
+    throughput), and the archive_history items of a chunk use at most ``max_bytes`` (from the measured payload size).
+    It changes by at most ``MAX_GROWTH`` or ``MAX_SHRINK`` after each chunk,
+    and stays between ``MIN_CHUNK_SIZE`` and ``MAX_CHUNK_SIZE``.
+
+    Can be used wherever a chunk size is (``int(chunk_size)`` returns the current size).
+
+    :param int initial_size: Number of items in the first chunk
+    :param float target_duration: Seconds to process each chunk,
+        defaults to ANALYTICS_STATS_CHUNK_TARGET_DURATION config (30)
+    :param int max_bytes: Maximum size of the archive_history items of a chunk,
+        defaults to ANALYTICS_STATS_CHUNK_MAX_BYTES config (64MB)
+    """
+
+    def __init__(self, initial_size=1000, target_duration=None, max_bytes=None):
+        self.target_duration = float(target_duration or app.config.get("ANALYTICS_STATS_CHUNK_TARGET_DURATION") or 30)
+        self.max_bytes = int(max_bytes or app.config.get("ANALYTICS_STATS_CHUNK_MAX_BYTES") or 64 * 1024 * 1024)
+        self.size = self._limit(int(initial_size or 1000))
+
+    def __int__(self):
+        return self.size
+
+    def __repr__(self):
+        return "adaptive({})".format(self.size)
+
+    def _limit(self, size):
+        return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, int(size)))
+
+    def update(self, history_items, duration):
+        """Adjust the chunk size from the measurements of the last chunk
+
+        :param list history_items: The archive_history items of the last chunk
+        :param float duration: Seconds taken to fetch and process the last chunk
+        :return int: The new chunk size
+        """
+
+        num_items = len(history_items)
+
+        if num_items < 1:
+            return self.size
+
+        payload_size = get_payload_size(history_items)
+        item_bytes = max(payload_size / num_items, 1)
+        targets = {"memory": self.max_bytes / item_bytes}
+
+        if duration > 0:
+            targets["duration"] = num_items / duration * self.target_duration
+
+        reason, target = min(targets.items(), key=lambda limit: limit[1])
+        size = self._limit(max(self.size * MAX_SHRINK, min(self.size * MAX_GROWTH, target)))
+
+        # The last chunk is usually smaller than the chunk size, so only grow the size from full chunks
+        if num_items < self.size and size > self.size:
+            size = self.size
+
+        logger.info(
+            "Adaptive chunk size {} -> {} ({} target {:.0f}). {} items in {:.1f} seconds ({:.0f} items/sec), "
+            "{:.1f} KB per item".format(
+                self.size,
+                size,
+                reason,
+                target,
+                num_items,
+                duration,
+                num_items / duration if duration > 0 else 0,
+                item_bytes / 1024,
+            )
+        )
+
+        self.size = size
+        return size
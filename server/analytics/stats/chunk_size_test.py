@@ -0,0 +1,44 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.chunk_size import AdaptiveChunkSize, get_chunk_size, get_payload_size, MAX_CHUNK_SIZE
+
+
+class AdaptiveChunkSizeTestCase(TestCase):
+    def _history_items(self, num_items, body_size=10):
+        return [{"item_id": str(i), "update": {"body_html": "x" * body_size}} for i in range(num_items)]
+
+    def test_get_chunk_size(self):
+        self.assertEqual(get_chunk_size(None), 0)
+        self.assertEqual(get_chunk_size(500), 500)
+        self.assertEqual(get_chunk_size(AdaptiveChunkSize(500, target_duration=10, max_bytes=1000000)), 500)
+
+    def test_grows_by_throughput(self):
+        chunk_size = AdaptiveChunkSize(1000, target_duration=10, max_bytes=1000000000)
+
+        # 1000 items per second, so 10000 items would take 10 seconds
+        # but the size is at most doubled after each chunk
+        self.assertEqual(chunk_size.update(self._history_items(1000), 1.0), 2000)
+        self.assertEqual(chunk_size.update(self._history_items(2000), 2.0), 4000)
+        self.assertEqual(chunk_size.update(self._history_items(4000), 4.0), 8000)
+        self.assertEqual(chunk_size.update(self._history_items(8000), 8.0), 10000)
+
+        # Partial chunks do not grow the size
+        self.assertEqual(chunk_size.update(self._history_items(10), 0.001), 10000)
+        self.assertLessEqual(int(chunk_size), MAX_CHUNK_SIZE)
+
+    def test_shrinks_by_payload_size(self):
+        history_items = self._history_items(1000, body_size=10000)
+        max_bytes = get_payload_size(history_items) // 2
+        chunk_size = AdaptiveChunkSize(1000, target_duration=10, max_bytes=max_bytes)
+
+        self.assertAlmostEqual(chunk_size.update(history_items, 1.0), 500, delta=1)
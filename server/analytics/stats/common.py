@@ -10,14 +10,33 @@
 
 from typing import NamedTuple
 
+from superdesk.metadata.item import (
+    ITEM_STATE,
+    ITEM_TYPE,
+    FORMAT,
+    SCHEDULE_SETTINGS,
+    PUBLISH_SCHEDULE,
+    EMBARGO,
+    BYLINE,
+)
+
 
 class StatTypes(NamedTuple):
     TIMELINE: str
     DESK_TRANSITIONS: str
     FEATUREMEDIA_UPDATES: str
+    LOCK_SESSIONS: str
+
+
+STAT_TYPE: StatTypes = StatTypes("timeline", "desk_transitions", "featuremedia_updates", "lock_sessions")
+
 
+class LeaseStatuses(NamedTuple):
+    PENDING: str
+    PROCESSING: str
 
-STAT_TYPE: StatTypes = StatTypes("timeline", "desk_transitions", "featuremedia_updates")
+
+LEASE_STATUS: LeaseStatuses = LeaseStatuses("pending", "processing")
 
 
 class Operations(NamedTuple):
@@ -157,3 +176,70 @@ PUBLISH_OPERATIONS = [
     OPERATION.KILL,
     OPERATION.TAKEDOWN,
 ]
+
+# Item attributes copied from archive_history updates to the statistics document
+METADATA_FIELDS = [
+    "original_creator",
+    "version_creator" "versioncreated",
+    "firstpublished",
+    "firstcreated",
+    "source",
+    "original_source",
+    "ingest_provider",
+    "anpa_category",
+    "subject",
+    "genre",
+    "company_codes",
+    ITEM_TYPE,
+    "abstract",
+    "headline",
+    "slugline",
+    "anpa_take_key",
+    "keywords",
+    "word_count",
+    "priority",
+    "urgency",
+    ITEM_STATE,
+    "pubstatus",
+    "flags",
+    "sms_message",
+    FORMAT,
+    "auto_publish",
+    "assignment_id",
+    "rewrite_of",
+    "rewritten_by",
+    "original_id",
+    SCHEDULE_SETTINGS,
+    "task",
+    PUBLISH_SCHEDULE,
+    EMBARGO,
+    "unique_id",
+    "unique_name",
+    "ingest_id",
+    "family_id",
+    "usageterms",
+    "copyrightnotice",
+    "copyrightholder",
+    "profile",
+    BYLINE,
+    "ednote",
+    "dateline",
+    "expiry",
+    "place",
+    "template",
+]
+
+# Attributes of the archive_history ``update`` dictionary used when generating statistics
+# (on top of the METADATA_FIELDS above). Use the ANALYTICS_STATS_HISTORY_UPDATE_FIELDS config
+# to include additional attributes for custom statistics plugins
+HISTORY_UPDATE_FIELDS = [
+    "operation",
+    "body_html",
+    "associations",
+    "renditions",
+    "poi",
+    "lock_user",
+    "lock_session",
+    "lock_action",
+    "lock_time",
+]
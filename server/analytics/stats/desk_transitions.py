@@ -14,8 +14,7 @@ from analytics.stats.common import (
     ENTER_DESK_OPERATIONS,
     EXIT_DESK_OPERATIONS,
 )
-
-from copy import deepcopy
+from analytics.stats.plugins import StatsPlugin, stats_plugins
 
 
 def init(stats):
@@ -23,6 +22,11 @@ def init(stats):
     stats[STAT_TYPE.DESK_TRANSITIONS] = []
 
 
+def resume(stats):
+    # Continue from the desk stats of the previous run
+    stats[STAT_TYPE.DESK_TRANSITIONS] = list(stats.get(STAT_TYPE.DESK_TRANSITIONS) or [])
+
+
 def store_update_fields(entry, new_update):
     pass
 
@@ -35,7 +39,7 @@ def process(entry, new_timeline, updates, update, stats):
     operation_created = entry.get("operation_created")
 
     if operation in ENTER_DESK_OPERATIONS:
-        updates["_current_task"] = deepcopy(task)
+        updates["_current_task"] = dict(task)
 
         if operation == OPERATION.CREATE and updates.get("rewrite_of"):
             updates["_current_task"]["entered_operation"] = OPERATION.REWRITE
@@ -72,3 +76,25 @@ def complete(stats, updates):
         updates["num_desk_transitions"] = 0
     else:
         updates["num_desk_transitions"] = num_desk_transitions
+
+
+class DeskTransitions(StatsPlugin):
+    """Generates the ``desk_transitions`` statistics (before any other plugin)"""
+
+    name = "desk_transitions"
+    order = 0
+
+    def init_timeline(self, event):
+        init(event.stats)
+
+    def resume_timeline(self, event):
+        resume(event.stats)
+
+    def process(self, event):
+        process(event.entry, event.new_timeline, event.updates, event.update, event.stats)
+
+    def complete(self, event):
+        complete(event.stats, event.updates)
+
+
+stats_plugins.register(DeskTransitions())
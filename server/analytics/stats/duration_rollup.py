@@ -0,0 +1,319 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import command, get_resource_service
+from superdesk.resource import Resource
+from superdesk.utc import utc_to_local
+
+from analytics.stats.common import STAT_TYPE
+from analytics.stats.plugins import stats_plugins
+from analytics.stats.rollup import RollupService, RollupPlugin, RebuildRollup
+
+from flask import current_app as app
+from math import floor, log2
+
+DURATION_ROLLUP = "archive_statistics_durations"
+
+# The attributes of a duration rollup, in the order of the keys returned by ``get_duration_key``
+DURATION_FIELDS = ["day", "desk"]
+
+# Number of histogram buckets per doubling of the duration
+BUCKETS_PER_DOUBLING = 4
+
+# Number of histogram buckets, the last bucket includes all durations over ~274 days
+NUM_BUCKETS = 100
+
+
+def get_bucket_index(duration):
+    """Get the histogram bucket of a duration (in seconds)
+
+    Bucket 0 has the durations under 1 second, then the buckets are log-scaled with ``BUCKETS_PER_DOUBLING``
+    buckets for each doubling of the duration (bucket ``i`` has the durations from ``2 ** ((i - 1) / 4)``
+    up to ``2 ** (i / 4)``)
+    """
+
+    if duration < 1:
+        return 0
+
+    return min(int(floor(log2(duration) * BUCKETS_PER_DOUBLING)) + 1, NUM_BUCKETS - 1)
+
+
+def get_bucket_bounds(index):
+    """Get the (lower, upper) duration of a histogram bucket (upper is None for the last bucket)"""
+
+    if index == 0:
+        return 0, 1
+
+    return (
+        2 ** ((index - 1) / BUCKETS_PER_DOUBLING),
+        2 ** (index / BUCKETS_PER_DOUBLING) if index < NUM_BUCKETS - 1 else None,
+    )
+
+
+def estimate_percentile(histogram, percentile, min_duration=None, max_duration=None):
+    """Estimate a percentile from the histogram buckets of durations
+
+    The value is interpolated within the bucket of the percentile (geometrically, as the buckets are log-scaled),
+    and limited to the min and max durations when they are provided
+
+    :param dict histogram: The number of durations, keyed by their bucket index
+    :param float percentile: The percentile to estimate (i.e. 50 for the median)
+    :param float min_duration: The smallest duration
+    :param float max_duration: The largest duration
+    :return float: The estimated duration (None if the histogram is empty)
+    """
+
+    buckets = sorted((int(index), count) for index, count in (histogram or {}).items() if count and count > 0)
+    total = sum(count for _, count in buckets)
+
+    if total < 1:
+        return None
+
+    rank = total * percentile / 100
+    cumulative = 0
+
+    for index, count in buckets:
+        if cumulative + count >= rank:
+            break
+
+        cumulative += count
+
+    lower, upper = get_bucket_bounds(index)
+
+    if min_duration is not None:
+        lower = max(lower, min_duration)
+
+    if max_duration is not None:
+        upper = max_duration if upper is None else min(upper, max_duration)
+
+    if upper is None or upper <= lower:
+        return lower
+
+    fraction = min(max((rank - cumulative) / count, 0), 1)
+
+    if lower <= 0:
+        return lower + (upper - lower) * fraction
+
+    return lower * (upper / lower) ** fraction
+
+
+def get_duration_key(transition):
+    """Get the (day, desk) key of a desk transition (None if it has no desk, entered date or duration)
+
+    The day is the date the desk was entered, in the DEFAULT_TIMEZONE
+    """
+
+    entered = transition.get("entered")
+
+    if not entered or not transition.get("desk") or transition.get("duration") is None:
+        return None
+
+    return (
+        utc_to_local(app.config["DEFAULT_TIMEZONE"], entered).strftime("%Y-%m-%d"),
+        str(transition["desk"]),
+    )
+
+
+def get_duration_id(key):
+    return "{}:{}".format(*key)
+
+
+def get_duration_totals(transitions):
+    """Get the count, sum, min, max and histogram of the durations of desk transitions, keyed by ``get_duration_key``"""
+
+    totals = {}
+
+    for transition in transitions or []:
+        key = get_duration_key(transition)
+
+        if key is None:
+            continue
+
+        duration = max(transition["duration"], 0)
+        index = str(get_bucket_index(duration))
+        value = totals.setdefault(key, {"count": 0, "sum": 0, "min": None, "max": None, "histogram": {}})
+
+        value["count"] += 1
+        value["sum"] += duration
+        value["min"] = duration if value["min"] is None else min(value["min"], duration)
+        value["max"] = duration if value["max"] is None else max(value["max"], duration)
+        value["histogram"][index] = value["histogram"].get(index, 0) + 1
+
+    return totals
+
+
+def add_duration_totals(totals, other, sign=1):
+    """Add (or subtract, with ``sign=-1``) the ``other`` duration totals to ``totals``
+
+    The min and max are only merged when adding, as they can't be recalculated when removing durations
+    """
+
+    for key, value in other.items():
+        total = totals.setdefault(key, {"count": 0, "sum": 0, "min": None, "max": None, "histogram": {}})
+
+        total["count"] += sign * value["count"]
+        total["sum"] += sign * value["sum"]
+
+        for index, count in value["histogram"].items():
+            total["histogram"][index] = total["histogram"].get(index, 0) + sign * count
+
+        if sign > 0:
+            for stat, func in [("min", min), ("max", max)]:
+                if value.get(stat) is not None:
+                    total[stat] = value[stat] if total[stat] is None else func(total[stat], value[stat])
+
+    return totals
+
+
+class DurationRollupResource(Resource):
+    """Count, sum, min, max and histogram of the desk transition durations per day and desk
+
+    Used by the Production Time report instead of aggregating the nested ``stats.desk_transitions``
+    of every statistics document
+    """
+
+    endpoint_name = resource_title = url = DURATION_ROLLUP
+    item_methods = ["GET"]
+    resource_methods = ["GET"]
+    internal_resource = True
+    datasource = {
+        "source": DURATION_ROLLUP,
+        "search_backend": "elastic",
+    }
+
+    mongo_prefix = "STATISTICS_MONGO"
+    elastic_prefix = "STATISTICS_ELASTIC"
+
+    schema = {
+        "day": {"type": "string", "mapping": {"type": "date", "format": "yyyy-MM-dd"}},
+        "desk": Resource.rel("desks", nullable=True),
+        "count": {"type": "integer"},
+        "sum": {"type": "number", "mapping": {"type": "double"}},
+        "min": {"type": "number", "nullable": True, "mapping": {"type": "double"}},
+        "max": {"type": "number", "nullable": True, "mapping": {"type": "double"}},
+        # Number of durations in each bucket (see ``get_bucket_index``)
+        "histogram": {
+            "type": "dict",
+            "schema": {str(index): {"type": "integer"} for index in range(NUM_BUCKETS)},
+        },
+        # Incremented on every write, so an older revision never replaces a newer one in Elasticsearch
+        "revision": {"type": "integer"},
+    }
+
+
+class DurationRollupService(RollupService):
+    key_fields = DURATION_FIELDS
+    projection = {
+        "stats.desk_transitions.desk": 1,
+        "stats.desk_transitions.entered": 1,
+        "stats.desk_transitions.duration": 1,
+    }
+    reset_update = {"$set": {"count": 0, "sum": 0, "histogram": {}}, "$unset": {"min": 1, "max": 1}}
+
+    def get_rollup_id(self, key):
+        return get_duration_id(key)
+
+    def add_item_stats(self, totals, stats):
+        add_duration_totals(totals, get_duration_totals(stats.get(STAT_TYPE.DESK_TRANSITIONS)))
+
+    def get_rebuild_updates(self, value):
+        return {
+            "count": value["count"],
+            "sum": value["sum"],
+            "min": value["min"],
+            "max": value["max"],
+            "histogram": {index: count for index, count in value["histogram"].items() if count},
+        }
+
+    def update_totals(self, totals):
+        """Add to the duration totals, creating any that don't exist yet
+
+        The min and max are only lowered/raised, so they may include durations that have since been removed
+        (until the rollup is rebuilt)
+
+        :param dict totals: The duration totals to add (counts are removed if negative), keyed by
+            ``get_duration_key``
+        """
+
+        updates = {}
+
+        for key, value in totals.items():
+            update = {
+                "$inc": {
+                    "count": value["count"],
+                    "sum": value["sum"],
+                    **{"histogram.{}".format(index): count for index, count in value["histogram"].items() if count},
+                }
+            }
+
+            if value.get("min") is not None:
+                update["$min"] = {"min": value["min"]}
+
+            if value.get("max") is not None:
+                update["$max"] = {"max": value["max"]}
+
+            updates[key] = update
+
+        self.write(updates)
+
+
+class DurationRollup(RollupPlugin):
+    """Maintains the daily desk transition durations (``archive_statistics_durations``) while generating statistics
+
+    Only enabled if ANALYTICS_STATS_DURATION_ROLLUP config is True. The totals of each item are the difference
+    between its new desk transitions and the desk transitions it had before.
+    """
+
+    name = "duration_rollup"
+    config_name = "ANALYTICS_STATS_DURATION_ROLLUP"
+
+    def get_item_totals(self, event):
+        totals = get_duration_totals(event.stats.get(STAT_TYPE.DESK_TRANSITIONS))
+        previous_stats = event.orig.get("previous_stats") or {}
+
+        return add_duration_totals(totals, get_duration_totals(previous_stats.get(STAT_TYPE.DESK_TRANSITIONS)), -1)
+
+    def add_totals(self, totals, other):
+        add_duration_totals(totals, other)
+
+    def is_empty(self, value):
+        return not value["count"] and not value["sum"] and not any(value["histogram"].values())
+
+    def update(self, totals):
+        get_resource_service("archive_statistics").update_duration_totals(totals)
+
+
+class RebuildDurationRollup(RebuildRollup):
+    """Generate the daily desk transition durations from all archive statistics
+
+    Used to populate the ``archive_statistics_durations`` collection after enabling ANALYTICS_STATS_DURATION_ROLLUP
+    (from then on the durations are updated while generating statistics).
+    Runs with the ``gen_archive_statistics`` lock, so the statistics are not generated at the same time.
+
+    Options
+    ::
+
+        -c, --chunk-size (defaults to 1000):
+        Number of statistics documents loaded per request, and duration totals written per request
+
+    Example:
+    ::
+
+        $ python manage.py analytics:rebuild_duration_rollup
+        $ python manage.py analytics:rebuild_duration_rollup -chunk-size 5000
+    """
+
+    resource = DURATION_ROLLUP
+
+
+duration_rollup = DurationRollup()
+stats_plugins.register(duration_rollup)
+
+command("analytics:rebuild_duration_rollup", RebuildDurationRollup())
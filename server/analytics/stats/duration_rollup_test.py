@@ -0,0 +1,98 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.duration_rollup import (
+    DurationRollup,
+    estimate_percentile,
+    get_bucket_bounds,
+    get_bucket_index,
+    get_duration_totals,
+    NUM_BUCKETS,
+)
+from analytics.stats.plugins import CompletedItem
+
+from datetime import datetime
+import pytz
+
+
+class DurationRollupTestCase(TestCase):
+    def setUp(self):
+        self.app.config["DEFAULT_TIMEZONE"] = "Australia/Sydney"
+        self.entered = datetime(2019, 3, 1, 20, 0, tzinfo=pytz.utc)
+
+    def _transition(self, duration, desk="desk1", entered=None):
+        return {"desk": desk, "entered": entered or self.entered, "duration": duration}
+
+    def test_bucket_index(self):
+        self.assertEqual(get_bucket_index(0), 0)
+        self.assertEqual(get_bucket_index(0.5), 0)
+        self.assertEqual(get_bucket_index(1), 1)
+        self.assertEqual(get_bucket_index(2), 5)
+        self.assertEqual(get_bucket_index(60), 24)
+        self.assertEqual(get_bucket_index(10**12), NUM_BUCKETS - 1)
+
+        for duration in [1, 3, 60, 3600, 86400]:
+            lower, upper = get_bucket_bounds(get_bucket_index(duration))
+            self.assertLessEqual(lower, duration)
+            self.assertLess(duration, upper)
+
+    def test_estimate_percentile(self):
+        durations = list(range(1, 101))
+        totals = get_duration_totals([self._transition(duration) for duration in durations])
+        value = totals[("2019-03-02", "desk1")]
+
+        self.assertEqual(value["count"], 100)
+        self.assertEqual(value["sum"], sum(durations))
+        self.assertEqual((value["min"], value["max"]), (1, 100))
+
+        # Estimates are within the width of a bucket (2 ** 0.25)
+        median = estimate_percentile(value["histogram"], 50, value["min"], value["max"])
+        p90 = estimate_percentile(value["histogram"], 90, value["min"], value["max"])
+        self.assertAlmostEqual(median / 50, 1, delta=0.19)
+        self.assertAlmostEqual(p90 / 90, 1, delta=0.19)
+
+        self.assertAlmostEqual(estimate_percentile(value["histogram"], 100, value["min"], value["max"]), 100)
+        self.assertIsNone(estimate_percentile({}, 50))
+
+    def test_totals_difference_of_desk_transitions(self):
+        self.app.config["ANALYTICS_STATS_DURATION_ROLLUP"] = True
+        plugin = DurationRollup()
+
+        previous = [self._transition(10), self._transition(20, desk="desk2")]
+        new = [self._transition(10), self._transition(30)]
+
+        plugin.start()
+        plugin.complete(
+            CompletedItem(
+                None,
+                stats={"desk_transitions": new},
+                orig={"_id": "item1", "previous_stats": {"desk_transitions": previous}},
+                updates={},
+            )
+        )
+        plugin.complete(
+            CompletedItem(None, stats={"desk_transitions": [self._transition(5)]}, orig={"_id": "item2"}, updates={})
+        )
+
+        totals = plugin.pop_totals(["item2"])
+
+        self.assertEqual(set(totals.keys()), {("2019-03-02", "desk1"), ("2019-03-02", "desk2")})
+        self.assertEqual(totals[("2019-03-02", "desk1")]["count"], 1)
+        self.assertEqual(totals[("2019-03-02", "desk1")]["sum"], 30)
+        self.assertEqual(totals[("2019-03-02", "desk1")]["max"], 30)
+        self.assertEqual(
+            {index: count for index, count in totals[("2019-03-02", "desk1")]["histogram"].items() if count},
+            {str(get_bucket_index(30)): 1},
+        )
+        self.assertEqual(totals[("2019-03-02", "desk2")]["count"], -1)
+        self.assertEqual(totals[("2019-03-02", "desk2")]["sum"], -20)
+        self.assertEqual(plugin.pop_totals(), {})
@@ -13,36 +13,51 @@ from superdesk.metadata.item import ASSOCIATIONS, CONTENT_TYPE
 from superdesk.logging import logger
 
 from analytics.stats.common import STAT_TYPE, OPERATION, FEATUREMEDIA_OPERATIONS
-from analytics.stats.gen_archive_statistics import connect_stats_signals
+from analytics.stats.plugins import StatsPlugin, stats_plugins
 
 from copy import deepcopy
 from flask import current_app as app
 from eve.utils import config
 
 
-class FeaturemediaUpdates:
-    def __init__(self, sender=None):
-        self.on_start()
+class FeaturemediaUpdates(StatsPlugin):
+    name = "featuremedia_updates"
 
-    def on_start(self, sender=None):
-        self.rewrite_ids = set()
+    # Only the featuremedia operations store their ``associations`` in the timeline
+    operations = {"generate": FEATUREMEDIA_OPERATIONS}
 
-    def store_update_fields(self, sender, entry, update):
-        if entry.get("operation") not in FEATUREMEDIA_OPERATIONS:
-            return
+    def __init__(self):
+        self.start()
+
+    def start(self, batch=None):
+        self.rewrite_ids = set()
+        self.family_root_ids = set()
 
+    def generate(self, event):
         # Store the featuremedia updates for use during future iterations
-        update.update({ASSOCIATIONS: (entry.get("update") or {}).get(ASSOCIATIONS) or None})
+        event.update.update({ASSOCIATIONS: (event.entry.get("update") or {}).get(ASSOCIATIONS) or None})
 
-    def init(self, sender, stats):
+    def init_timeline(self, event):
         # Clear the featuremedia stats as we'll recalculate them here
-        stats[STAT_TYPE.FEATUREMEDIA_UPDATES] = []
+        event.stats[STAT_TYPE.FEATUREMEDIA_UPDATES] = []
 
-    def process(self, sender, entry, new_timeline, updates, update, stats):
+    def resume_timeline(self, event):
+        # Continue from the featuremedia stats of the previous run
+        event.stats[STAT_TYPE.FEATUREMEDIA_UPDATES] = list(event.stats.get(STAT_TYPE.FEATUREMEDIA_UPDATES) or [])
+
+    def process(self, event):
         # Generating stats with PUBLISH_ASSOCIATED_ITEMS=True is currently not supported
         if app.config.get("PUBLISH_ASSOCIATED_ITEMS", False):
             return
 
+        entry, new_timeline, updates, update, stats = (
+            event.entry,
+            event.new_timeline,
+            event.updates,
+            event.update,
+            event.stats,
+        )
+
         operation = entry.get("operation")
 
         updates.setdefault("_featuremedia", None)
@@ -153,7 +168,7 @@ class FeaturemediaUpdates:
                 )
 
     def _add_media_operation(self, entry, operation, new_timeline, updates, stats, name, media=None):
-        media_operation = deepcopy(entry)
+        media_operation = entry.copy()
         media_operation["_auto_generated"] = True
         media_operation["operation"] = name
 
@@ -203,7 +218,8 @@ class FeaturemediaUpdates:
 
         return False
 
-    def complete(self, sender, stats, orig, updates):
+    def complete(self, event):
+        stats, orig, updates = event.stats, event.orig, event.updates
         num_featuremedia_updates = len(stats.get(STAT_TYPE.FEATUREMEDIA_UPDATES) or [])
         if num_featuremedia_updates < 1:
             stats[STAT_TYPE.FEATUREMEDIA_UPDATES] = None
@@ -212,17 +228,100 @@ class FeaturemediaUpdates:
             updates["num_featuremedia_updates"] = num_featuremedia_updates
 
         if updates.get("rewrite_of"):
-            self.rewrite_ids.add(updates.get("rewrite_of"))
-            self.rewrite_ids.add(orig["_id"])
+            if updates.get("family_root_id"):
+                self.family_root_ids.add(updates["family_root_id"])
+            else:
+                # The family root is not known, so the chain of rewrites is loaded in ``finish``
+                self.rewrite_ids.add(updates.get("rewrite_of"))
+                self.rewrite_ids.add(orig["_id"])
 
     def _get_featuremedia(self, entry):
         return None if entry is None else ((entry.get("update") or {}).get("associations") or {}).get("featuremedia")
 
-    def finish(self, sender):
+    def _get_featuremedia_updates(self, doc):
+        updates = (doc.get("stats") or {}).get("featuremedia_updates") or []
+
+        if len(updates) < 1:
+            # This would indicate that there are no featuremedia updates recorded for this single item
+            # find the previous featuremedia operation before the publish operation
+            # and use that as the basis for the featuremedia updates
+            last_entry = next(
+                (
+                    entry
+                    for entry in reversed((doc.get("stats") or {}).get("timeline") or [])
+                    if entry.get("operation") in FEATUREMEDIA_OPERATIONS
+                ),
+                None,
+            )
+
+            if last_entry is not None:
+                updates = [last_entry]
+
+        return updates
+
+    def finish(self, batch):
         service = get_resource_service("archive_statistics")
+        parent_docs = {}
+
+        if self.family_root_ids:
+            parent_docs.update(self._get_family_updates(service))
+
+        if self.rewrite_ids:
+            for parent_id, updates in self._get_family_updates_from_rewrites(service).items():
+                # Families loaded using their ``family_root_id`` already contain all their items
+                parent_docs.setdefault(parent_id, updates)
+
+        if parent_docs:
+            self._store_family_updates(service, parent_docs)
+
+    def _get_family_updates(self, service):
+        """Get the featuremedia updates of all items in the families of this chunk
+
+        The families are read from Mongo (not Elasticsearch), so they include the items written by previous chunks
+        even if they are not searchable yet (i.e. if ANALYTICS_STATS_BULK_REFRESH config is False)
+        """
+
+        docs = service.get_items_by_family_root_ids(self.family_root_ids)
+        families = {doc_id: doc["family_root_id"] for doc_id, doc in docs.items()}
+
+        # Items generated before ``family_root_id`` was stored (such as the family root itself) are loaded
+        # by following the chain of rewrites, from the oldest item of the family that has a ``family_root_id``
+        pending_ids = {root_id: root_id for root_id in self.family_root_ids if root_id not in docs}
+        pending_ids.update(
+            {
+                doc["rewrite_of"]: doc["family_root_id"]
+                for doc in docs.values()
+                if doc.get("rewrite_of") and doc["rewrite_of"] not in docs
+            }
+        )
+
+        while pending_ids:
+            ancestors = service.get_items_by_ids(list(pending_ids.keys()))
+            docs.update(ancestors)
+            families.update({doc_id: pending_ids[doc_id] for doc_id in ancestors.keys()})
+
+            pending_ids = {
+                doc["rewrite_of"]: families[doc_id]
+                for doc_id, doc in ancestors.items()
+                if doc.get("rewrite_of") and doc["rewrite_of"] not in docs and doc_id != families[doc_id]
+            }
+
+        parent_docs = {}
+        for doc_id, doc in docs.items():
+            updates = self._get_featuremedia_updates(doc)
 
-        query = {"query": {"bool": {"must": {"terms": {"_id": list(self.rewrite_ids)}}}}}
-        docs = {doc["_id"]: doc for doc in service.search(query)}
+            if len(updates) > 0:
+                parent_docs.setdefault(families[doc_id], []).extend(updates)
+
+        return parent_docs
+
+    def _get_family_updates_from_rewrites(self, service):
+        """Get the featuremedia updates of the rewrites in this chunk, following the chain of rewrites
+
+        Used for items generated before ``family_root_id`` was stored
+        """
+
+        docs = service.get_items_by_ids(self.rewrite_ids)
 
         def get_parent_id(doc):
             if not doc.get("rewrite_of"):
@@ -252,23 +351,7 @@ class FeaturemediaUpdates:
                 # So we ignore this entry
                 continue
 
-            updates = (doc.get("stats") or {}).get("featuremedia_updates") or []
-
-            if len(updates) < 1:
-                # This would indicate that there are no featuremedia updates recorded for this single item
-                # find the previous featuremedia operation before the publish operation
-                # and use that as the basis for the featuremedia updates
-                last_entry = next(
-                    (
-                        entry
-                        for entry in reversed((doc.get("stats") or {}).get("timeline") or [])
-                        if entry.get("operation") in FEATUREMEDIA_OPERATIONS
-                    ),
-                    None,
-                )
-
-                if last_entry is not None:
-                    updates = [last_entry]
+            updates = self._get_featuremedia_updates(doc)
 
             if len(updates) > 0:
                 if parent_id not in parent_docs:
@@ -276,83 +359,88 @@ class FeaturemediaUpdates:
                 else:
                     parent_docs[parent_id] += updates
 
-        for doc_id, stats in parent_docs.items():
-            # get the archive_family stats item (if it exists)
-            merged_id = "{}_family".format(doc_id)
-            original = service.find_one(req=None, _id=merged_id)
-            is_new = False
-
-            if not original:
-                # If the archive_family stats item doesn't exist
-                # then get the stats for the archive item itself
-                is_new = True
-                original = service.find_one(req=None, _id=doc_id) or {}
-
-            sorted_entries = sorted(stats, key=lambda k: (k["operation_created"], k["history_id"]))
-
-            last_stat = sorted_entries[0]
-            merged_stats = [sorted_entries[0]] if self._get_featuremedia(last_stat) else []
-
-            for entry in sorted_entries[1:]:
-                current_media = self._get_featuremedia(last_stat)
-                next_media = self._get_featuremedia(entry)
-
-                if current_media and not next_media:
-                    # previous entry has featuremedia
-                    # current entry does not
-                    entry["operation"] = OPERATION.REMOVE_FEATUREMEDIA
-                    merged_stats.append(entry)
-                elif next_media and not current_media:
-                    # previous entry does not have featuremedia
-                    # current entry does
-                    entry["operation"] = OPERATION.ADD_FEATUREMEDIA
-                    merged_stats.append(entry)
-                elif current_media.get("_id") != next_media.get("_id"):
-                    # previous entry has different featuremedia id to the current entry
-                    entry["operation"] = OPERATION.UPDATE_FEATUREMEDIA_IMAGE
-                    merged_stats.append(entry)
-                elif self._renditions_changed(current_media, next_media):
-                    # previous entry has different poi
-                    entry["operation"] = OPERATION.UPDATE_FEATUREMEDIA_POI
-                    merged_stats.append(entry)
-
-                last_stat = entry
-
-            updates = deepcopy(original)
-            updates["stats_type"] = "archive_family"
-
-            num_featuremedia_updates = len(merged_stats)
-            if num_featuremedia_updates < 1:
-                merged_stats = None
-                updates["num_featuremedia_updates"] = 0
-            else:
-                updates["num_featuremedia_updates"] = num_featuremedia_updates
+        return parent_docs
+
+    def _store_family_updates(self, service, parent_docs):
+        """Merge and store the featuremedia updates of each family in its archive_family stats item"""
+
+        # Load the archive_family stats items (and the stats of the archive items for new families) in one request
+        doc_ids = list(parent_docs.keys()) + ["{}_family".format(doc_id) for doc_id in parent_docs.keys()]
+        existing_docs = service.get_items_by_ids(doc_ids)
+
+        with service.get_writer([]) as writer:
+            for doc_id, stats in parent_docs.items():
+                # get the archive_family stats item (if it exists)
+                merged_id = "{}_family".format(doc_id)
+                original = existing_docs.get(merged_id)
+                is_new = False
+
+                if not original:
+                    # If the archive_family stats item doesn't exist
+                    # then get the stats for the archive item itself
+                    is_new = True
+                    original = existing_docs.get(doc_id) or {}
+
+                sorted_entries = sorted(stats, key=lambda k: (k["operation_created"], k["history_id"]))
+
+                last_stat = sorted_entries[0]
+                merged_stats = [sorted_entries[0]] if self._get_featuremedia(last_stat) else []
+
+                for entry in sorted_entries[1:]:
+                    current_media = self._get_featuremedia(last_stat)
+                    next_media = self._get_featuremedia(entry)
+
+                    if current_media and not next_media:
+                        # previous entry has featuremedia
+                        # current entry does not
+                        entry["operation"] = OPERATION.REMOVE_FEATUREMEDIA
+                        merged_stats.append(entry)
+                    elif next_media and not current_media:
+                        # previous entry does not have featuremedia
+                        # current entry does
+                        entry["operation"] = OPERATION.ADD_FEATUREMEDIA
+                        merged_stats.append(entry)
+                    elif current_media.get("_id") != next_media.get("_id"):
+                        # previous entry has different featuremedia id to the current entry
+                        entry["operation"] = OPERATION.UPDATE_FEATUREMEDIA_IMAGE
+                        merged_stats.append(entry)
+                    elif self._renditions_changed(current_media, next_media):
+                        # previous entry has different poi
+                        entry["operation"] = OPERATION.UPDATE_FEATUREMEDIA_POI
+                        merged_stats.append(entry)
+
+                    last_stat = entry
+
+                updates = deepcopy(original)
+                updates["stats_type"] = "archive_family"
+
+                num_featuremedia_updates = len(merged_stats)
+                if num_featuremedia_updates < 1:
+                    merged_stats = None
+                    updates["num_featuremedia_updates"] = 0
+                else:
+                    updates["num_featuremedia_updates"] = num_featuremedia_updates
 
-            if "stats" not in updates:
-                updates["stats"] = {}
+                if "stats" not in updates:
+                    updates["stats"] = {}
 
-            updates["stats"]["featuremedia_updates"] = merged_stats
+                updates["stats"]["featuremedia_updates"] = merged_stats
 
-            if is_new:
-                updates["_id"] = merged_id
-                service.post([updates])
-            else:
-                service.patch(
-                    merged_id,
-                    {
-                        "stats": updates["stats"],
-                        "num_featuremedia_updates": updates["num_featuremedia_updates"],
-                    },
-                )
+                if is_new:
+                    for field in [config.ETAG, config.DATE_CREATED, config.LAST_UPDATED]:
+                        updates.pop(field, None)
 
+                    updates["_id"] = merged_id
+                    writer.create(updates)
+                else:
+                    writer.update(
+                        merged_id,
+                        {
+                            "stats": updates["stats"],
+                            "num_featuremedia_updates": updates["num_featuremedia_updates"],
+                        },
+                    )
 
-featuremedia_updates = FeaturemediaUpdates()
 
-connect_stats_signals(
-    on_start=featuremedia_updates.on_start,
-    on_generate=featuremedia_updates.store_update_fields,
-    on_init_timeline=featuremedia_updates.init,
-    on_process=featuremedia_updates.process,
-    on_complete=featuremedia_updates.complete,
-    on_finish=featuremedia_updates.finish,
-)
+featuremedia_updates = FeaturemediaUpdates()
+stats_plugins.register(featuremedia_updates)
@@ -13,34 +13,59 @@ from superdesk.logging import logger
 from superdesk.utc import utcnow
 from superdesk.metadata.item import (
     ITEM_STATE,
-    ITEM_TYPE,
-    FORMAT,
-    SCHEDULE_SETTINGS,
     CONTENT_STATE,
     PUBLISH_SCHEDULE,
     EMBARGO,
-    BYLINE,
 )
-from superdesk.text_utils import get_par_count
 from superdesk.celery_task_utils import get_lock_id
 from superdesk.lock import lock, unlock
-from superdesk.signals import signals
 
-from analytics.stats.common import STAT_TYPE, OPERATION
-from analytics.stats import desk_transitions
+from analytics.stats.common import STAT_TYPE, OPERATION, METADATA_FIELDS
+
+# Registers the desk_transitions and lock_sessions plugins
+from analytics.stats import desk_transitions  # noqa
+from analytics.stats import lock_sessions  # noqa
+from analytics.stats.plugins import (
+    gen_stats_signals,  # noqa
+    stats_plugins,
+    CallbackStatsPlugin,
+    StatsBatch,
+    EntryUpdate,
+    TimelineStats,
+    ProcessedEntry,
+    CompletedItem,
+)
+from analytics.stats.timeline import Task, TimelineEntry, serialise_entries
+from analytics.stats.par_count import par_count_cache
+from analytics.stats.metrics import metrics
+from analytics.stats.chunk_size import AdaptiveChunkSize, get_chunk_size
+from analytics.stats.offline import offline_statistics, read_history_file, write_stats_file
 
 from eve.utils import config
 from copy import deepcopy
 from datetime import timedelta
-
-gen_stats_signals = {
-    "start": signals.signal("gen_archive_statistics:start"),
-    "generate": signals.signal("gen_archive_statistics:generate"),
-    "init_timeline": signals.signal("gen_archive_statistics:init_timeline"),
-    "process": signals.signal("gen_archive_statistics:process"),
-    "complete": signals.signal("gen_archive_statistics:complete"),
-    "finish": signals.signal("gen_archive_statistics:finish"),
-}
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app as app
+import json
+import multiprocessing
+import zlib
+import socket
+import time
+import os
+
+# Number of times to regenerate the stats for an item, if it was modified by another process
+MAX_CONFLICT_RETRIES = 3
+
+# Temporary attributes that are not stored in the ``timeline_state`` of an item
+TIMELINE_STATE_EXCLUDE_FIELDS = [
+    config.ID_FIELD,
+    config.ETAG,
+    config.DATE_CREATED,
+    config.LAST_UPDATED,
+    "_new_timeline",
+    # Rebuilt from the ``history_id`` of the stored timeline entries (see ``append_timeline``)
+    "_processed_ids",
+]
 
 
 def connect_stats_signals(
@@ -50,8 +75,11 @@ def connect_stats_signals(
     on_process=None,
     on_complete=None,
     on_finish=None,
+    on_resume_timeline=None,
 ):
-    """Connect functions to the gen_stats_signals
+    """Register callbacks with the same arguments as the gen_stats_signals, as a plugin in ``stats_plugins``
+
+    Deprecated, use a ``StatsPlugin`` instead (see ``analytics.stats.plugins``)
 
     :param on_start: Callback for start signal
     :param on_generate: Callback for generate signal
@@ -59,24 +87,23 @@ def connect_stats_signals(
     :param on_process: Callback for process signal
     :param on_complete: Callback for complete signal
     :param on_finish: Callback for finish signal
+    :param on_resume_timeline: Callback for resume_timeline signal
+    :return CallbackStatsPlugin: The registered plugin
     """
-    if on_start:
-        gen_stats_signals["start"].connect(on_start)
-
-    if on_generate:
-        gen_stats_signals["generate"].connect(on_generate)
-
-    if on_init_timeline:
-        gen_stats_signals["init_timeline"].connect(on_init_timeline)
-
-    if on_process:
-        gen_stats_signals["process"].connect(on_process)
 
-    if on_complete:
-        gen_stats_signals["complete"].connect(on_complete)
-
-    if on_finish:
-        gen_stats_signals["finish"].connect(on_finish)
+    plugin = CallbackStatsPlugin(
+        {
+            "start": on_start,
+            "generate": on_generate,
+            "init_timeline": on_init_timeline,
+            "resume_timeline": on_resume_timeline,
+            "process": on_process,
+            "complete": on_complete,
+            "finish": on_finish,
+        }
+    )
+    stats_plugins.register(plugin)
+    return plugin
 
 
 class GenArchiveStatistics(Command):
@@ -94,6 +121,37 @@ class GenArchiveStatistics(Command):
         Generate statistics for a single archive item only
         -c, --chunk-size (defaults to 1000):
         Number of archive history items to process per iteration
+        -a, --adaptive-chunks (defaults to ANALYTICS_STATS_ADAPTIVE_CHUNKS config, False):
+        Adjust the number of archive history items per iteration after each iteration (starting from --chunk-size),
+        targeting ANALYTICS_STATS_CHUNK_TARGET_DURATION seconds and ANALYTICS_STATS_CHUNK_MAX_BYTES per iteration
+        -w, --workers (defaults to 1):
+        Number of processes used to generate the item timelines.
+        Items are partitioned by their id, and the statistics are written by the main process.
+        The celery tasks started to process leases always use 1 process
+        -l, --lease-size (defaults to ANALYTICS_STATS_LEASE_SIZE config, 0):
+        Number of archive history items per lease. If greater than 0, the pending archive history
+        items are split into leases, which are processed by multiple celery workers at the same time
+        -L, --lease-workers (defaults to ANALYTICS_STATS_LEASE_WORKERS config, 4):
+        Number of celery tasks to start to process the leases (in addition to this process)
+        -p, --progress:
+        Print the progress of the statistics generation (where the next run will resume from)
+        -f, --from-file (defaults to None):
+        Generate statistics from a JSON lines archive_history dump instead of the archive_history collection.
+        Mongo and Elasticsearch are not used, and the last run is not updated.
+        The statistics of all items are kept in memory until they are written to ``--to-file``
+        -t, --to-file (defaults to None):
+        JSON lines file to write the statistics generated from ``--from-file`` to (i.e. for ``mongoimport``).
+        The activity and duration rollups are not written, so rebuild them after importing the statistics
+        -r, --recompute-file (defaults to None):
+        Regenerate the statistics of the items listed in this file (one item id per line)
+        -q, --recompute-query (defaults to None):
+        Regenerate the statistics of the items matching this Elasticsearch query over archive_statistics (JSON)
+
+    When recomputing statistics, the full history of the items is loaded in bulk (``--chunk-size`` items per
+    iteration), and their statistics are generated from scratch. The last run is not updated.
+
+    The id of the last processed archive_history item is stored after each chunk.
+    So if a run is interrupted (i.e. the celery time limit is reached), the next run resumes from the next chunk.
 
     If the config option ANALYTICS_ENABLE_ARCHIVE_STATS is true, this command will run in
     celery on a schedule every hour (minute=0).
@@ -108,19 +166,59 @@ class GenArchiveStatistics(Command):
         $ python manage.py analytics:gen_archive_statistics -item-id 'id-of-item-to-gen-stats-for'
         $ python manage.py analytics:gen_archive_statistics -c 500
         $ python manage.py analytics:gen_archive_statistics -chunk-size 500
-
-    There are 4 signals that are sent when generating statistics.
-    This allows custom statistics to be generated and stored in the item.
+        $ python manage.py analytics:gen_archive_statistics -a
+        $ python manage.py analytics:gen_archive_statistics -adaptive-chunks -chunk-size 500
+        $ python manage.py analytics:gen_archive_statistics -w 8
+        $ python manage.py analytics:gen_archive_statistics -workers 8
+        $ python manage.py analytics:gen_archive_statistics -l 10000 -L 8
+        $ python manage.py analytics:gen_archive_statistics -lease-size 10000 -lease-workers 8
+        $ python manage.py analytics:gen_archive_statistics -p
+        $ python manage.py analytics:gen_archive_statistics -progress
+        $ python manage.py analytics:gen_archive_statistics -f history.jsonl -t stats.jsonl
+        $ python manage.py analytics:gen_archive_statistics -from-file history.jsonl -to-file stats.jsonl
+        $ python manage.py analytics:gen_archive_statistics -r item_ids.txt -w 8
+        $ python manage.py analytics:gen_archive_statistics -recompute-file item_ids.txt -chunk-size 500
+        $ python manage.py analytics:gen_archive_statistics -q '{"terms": {"urgency": [1, 2]}}'
+        $ python manage.py analytics:gen_archive_statistics -recompute-query '{"exists": {"field": "rewrite_of"}}'
+
+    Custom statistics are generated by plugins registered in ``stats_plugins`` (see ``analytics.stats.plugins``).
+    The hooks of each plugin are called in the order of the plugins (``desk_transitions`` is always first),
+    and the ``generate`` and ``process`` hooks are only called for the operations the plugin declares.
     There is a dictionary in the schema for custom stats to be stored under the 'extra' attribute.
 
     Example:
     ::
 
-        from analytics.stats.gen_archive_statistics import connect_stats_signals
+        from analytics.stats.plugins import StatsPlugin, stats_plugins
+
+        class CustomStats(StatsPlugin):
+            operations = {"process": [OPERATION.PUBLISH]}
+
+            def process(self, event):
+                event.updates["extra"]["custom"] = ...
+
+        stats_plugins.register(CustomStats())
 
-        connect_stats_signals(on_generate, on_init_timeline, on_process, on_complete)
-        # or by key values
-        connect_stats_signals(on_process=on_process_stats)
+    Callbacks registered using ``connect_stats_signals`` (or connected to ``gen_stats_signals``)
+    are still supported, and are called after the plugins.
+
+    The temporary attributes of the item (i.e. ``_last_task``, ``_current_task``, ``_featuremedia``) are stored
+    in the ``timeline_state`` of the statistics document. When new history entries for an item are newer than
+    the entries already processed, only the new entries are processed (starting from the stored state).
+    Instead of the init_timeline hook, the resume_timeline hook is called, so that any statistics can be
+    prepared for new entries to be appended. If the history entries arrive out of order,
+    the full timeline is generated again. Set ANALYTICS_STATS_INCREMENTAL_TIMELINE config to False
+    to always generate the full timeline (i.e. if a custom plugin does not support the resume_timeline hook).
+
+    The time spent in each stage (including each hook of each plugin) and the number of items processed are
+    collected in ``analytics.stats.metrics``. If ANALYTICS_STATS_METRICS_FILE config is defined,
+    the metrics are written to this file in the Prometheus text format after each chunk
+    (i.e. for the node_exporter textfile collector), along with the backlog lag
+    (the age of the oldest archive_history entry that is yet to be processed).
+
+    When using more than 1 worker, the generate, init_timeline, resume_timeline and process hooks are called from
+    the worker processes. Any state stored by these hooks is not shared with the main process,
+    so aggregated data should be collected in the complete hook (which is called from the main process).
 
     """
 
@@ -128,9 +226,38 @@ class GenArchiveStatistics(Command):
         Option("--max-days", "-d", dest="max_days", default=3),
         Option("--item-id", "-i", dest="item_id", default=None),
         Option("--chunk-size", "-c", dest="chunk_size", default=1000),
+        Option("--adaptive-chunks", "-a", dest="adaptive_chunks", action="store_true", default=None),
+        Option("--workers", "-w", dest="workers", default=1),
+        Option("--lease-size", "-l", dest="lease_size", default=None),
+        Option("--lease-workers", "-L", dest="lease_workers", default=None),
+        Option("--progress", "-p", dest="progress", action="store_true", default=False),
+        Option("--from-file", "-f", dest="from_file", default=None),
+        Option("--to-file", "-t", dest="to_file", default=None),
+        Option("--recompute-file", "-r", dest="recompute_file", default=None),
+        Option("--recompute-query", "-q", dest="recompute_query", default=None),
     ]
 
-    def run(self, max_days=3, item_id=None, chunk_size=1000):
+    def run(
+        self,
+        max_days=3,
+        item_id=None,
+        chunk_size=1000,
+        workers=1,
+        lease_size=None,
+        lease_workers=None,
+        progress=False,
+        from_file=None,
+        to_file=None,
+        adaptive_chunks=None,
+        recompute_file=None,
+        recompute_query=None,
+    ):
+        if progress:
+            self.print_progress()
+            return
+
+        # The metrics (and the stage timings logged at the end) are for this run only
+        metrics.reset()
         now_utc = utcnow()
 
         # If we're generating stats for a single item, then
@@ -149,14 +276,38 @@ class GenArchiveStatistics(Command):
             chunk_size = int(chunk_size)
         except (ValueError, TypeError):
             chunk_size = 1000
-        chunk_size = None if chunk_size <= 0 else chunk_size
+        chunk_size = self.get_chunk_size(None if chunk_size <= 0 else chunk_size, adaptive_chunks)
+
+        try:
+            workers = max(int(workers), 1)
+        except (ValueError, TypeError):
+            workers = 1
+
+        try:
+            lease_size = int(lease_size if lease_size is not None else app.config.get("ANALYTICS_STATS_LEASE_SIZE", 0))
+        except (ValueError, TypeError):
+            lease_size = 0
 
         logger.info(
-            "Starting to generate archive statistics: {}. gte={}. item_id={}. chunk_size={}".format(
-                now_utc, gte, item_id, chunk_size
+            "Starting to generate archive statistics: {}. gte={}. item_id={}. chunk_size={}. workers={}".format(
+                now_utc, gte, item_id, chunk_size, workers
             )
         )
 
+        if from_file or to_file:
+            self.generate_stats_from_file(from_file, to_file, chunk_size, workers)
+            return
+
+        if recompute_file or recompute_query:
+            self.run_recompute(recompute_file, recompute_query, chunk_size, workers)
+            return
+
+        # Distribute the processing of archive history using leases
+        # (generating stats for a single item is always done in this process)
+        if item_id is None and lease_size > 0:
+            self.run_leases(gte, chunk_size, workers, lease_size, lease_workers)
+            return
+
         lock_name = get_lock_id("analytics", "gen_archive_statistics")
         if not lock(lock_name, expire=610):
             logger.info("Generate archive statistics task is already running.")
@@ -167,7 +318,7 @@ class GenArchiveStatistics(Command):
         num_history_items = 0
 
         try:
-            items_processed, failed_ids, num_history_items = self.generate_stats(item_id, gte, chunk_size)
+            items_processed, failed_ids, num_history_items = self.generate_stats(item_id, gte, chunk_size, workers)
         except Exception:
             logger.exception("Failed to generate archive stats")
         finally:
@@ -182,8 +333,220 @@ class GenArchiveStatistics(Command):
                 items_processed, num_history_items, int(duration)
             )
         )
+        logger.info("Paragraph count cache (main process): {}".format(par_count_cache.info()))
+        logger.info(
+            "Archive statistics stage timings: {}".format(
+                ", ".join(
+                    "{}={:.2f}s".format(stage, seconds)
+                    for stage, seconds in sorted(metrics.timings.items(), key=lambda stage: -stage[1])
+                )
+            )
+        )
+
+    def print_progress(self):
+        """Print the progress of the statistics generation, and where the next run will resume from"""
+
+        progress = get_resource_service("archive_statistics").get_progress()
+        run = progress["progress"]
+
+        print("Last processed history item: {}".format(progress["last_id"]))
+
+        if run:
+            print(
+                "Last run: started={}, updated={}, completed={}".format(
+                    run.get("started"), run.get("updated"), run.get("completed") or "incomplete"
+                )
+            )
+            print(
+                "    chunks={}, history items={}, items={}, failed={}".format(
+                    run.get("num_chunks"), run.get("num_history_items"), run.get("num_items"), run.get("num_failed")
+                )
+            )
+
+        print(
+            "Pending history items: {} (oldest created {})".format(progress["num_pending"], progress["oldest_pending"])
+        )
+
+        for lease in progress["leases"]:
+            print(
+                "Lease {}: status={}, last_id={}, end_id={}, owner={}, expires={}, attempts={}".format(
+                    lease["id"],
+                    lease["status"],
+                    lease["last_id"],
+                    lease["end_id"],
+                    lease["owner"],
+                    lease["expires"],
+                    lease["attempts"],
+                )
+            )
 
-    def generate_stats(self, item_id, gte, chunk_size):
+    def generate_stats_from_file(self, from_file, to_file, chunk_size, workers=1):
+        """Generate statistics from a JSON lines archive_history dump, writing them to a JSON lines file
+
+        The history file is streamed, and the statistics of all items are kept in memory until they are written.
+        They can't be written per chunk, as later history entries, rewrites and featuremedia families update the
+        statistics of the items from previous chunks, so the memory used is proportional to the size of ``to_file``
+        """
+
+        if not from_file or not to_file:
+            logger.error("Both --from-file and --to-file are required to generate statistics from a file")
+            return
+
+        started = utcnow()
+
+        with open(from_file, "r") as history_file, offline_statistics(read_history_file(history_file)) as service:
+            items_processed, failed_ids, num_history_items = self.generate_stats(None, None, chunk_size, workers)
+
+            with open(to_file, "w") as stats_file:
+                num_docs = write_stats_file(service.docs.values(), stats_file)
+
+        if len(failed_ids) > 0:
+            logger.warning("Failed to generate stats for items {}".format(", ".join(failed_ids)))
+
+        # The rollups are only kept in memory, they're generated from the imported statistics instead
+        for config_name, rebuild_command in [
+            ("ANALYTICS_STATS_ACTIVITY_ROLLUP", "analytics:rebuild_activity_rollup"),
+            ("ANALYTICS_STATS_DURATION_ROLLUP", "analytics:rebuild_duration_rollup"),
+        ]:
+            if app.config.get(config_name, False):
+                logger.warning("Run {} after importing the statistics from {}".format(rebuild_command, to_file))
+
+        logger.info(
+            "Finished generating stats from {} ({} history entries). Wrote {} documents to {}. "
+            "Duration: {} seconds".format(
+                from_file, num_history_items, num_docs, to_file, int((utcnow() - started).total_seconds())
+            )
+        )
+
+    def run_recompute(self, recompute_file, recompute_query, chunk_size, workers=1):
+        """Regenerate the statistics of the items listed in ``recompute_file`` or matching ``recompute_query``"""
+
+        started = utcnow()
+
+        if recompute_file:
+            with open(recompute_file, "r") as ids_file:
+                item_ids = [line.strip() for line in ids_file if line.strip()]
+        else:
+            try:
+                query = json.loads(recompute_query)
+            except ValueError:
+                logger.error("Invalid Elasticsearch query {}".format(recompute_query))
+                return
+
+            item_ids = get_resource_service("archive_statistics").get_item_ids_by_query(query.get("query") or query)
+
+        items_processed, failed_ids, num_history_items = self.recompute_stats(item_ids, chunk_size, workers)
+
+        if len(failed_ids) > 0:
+            logger.warning("Failed to generate stats for items {}".format(", ".join(failed_ids)))
+
+        logger.info(
+            "Finished recomputing stats for {} items ({} history entries). Duration: {} seconds".format(
+                items_processed, num_history_items, int((utcnow() - started).total_seconds())
+            )
+        )
+
+    def recompute_stats(self, item_ids, chunk_size=1000, workers=1):
+        """Generate the statistics of ``item_ids`` from scratch, from the full history of each item
+
+        The history of ``chunk_size`` items is loaded per iteration.
+        The last run is not updated, so this can run at the same time as the regular statistics generation
+
+        :param item_ids: Iterable of item ids
+        :return tuple: The number of items processed, the ids of the failed items and the number of history items
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        items_processed = 0
+        failed_ids = []
+        num_history_items = 0
+
+        pool = self.get_timeline_pool(workers)
+
+        try:
+            for chunk_ids in _get_chunks(item_ids, get_chunk_size(chunk_size) or 1000):
+                chunk_started = time.perf_counter()
+
+                with metrics.timer("fetch_history"):
+                    history_items = statistics_service.get_history_items_by_item_ids(chunk_ids)
+
+                if not history_items:
+                    continue
+
+                num_history_items += len(history_items)
+                num_items = self.process_history_items(history_items, failed_ids, pool, recompute=True)
+                items_processed += num_items
+
+                logger.info(
+                    "Recomputed {}/{} history/item records ({}/{} total) in {} seconds".format(
+                        len(history_items),
+                        num_items,
+                        num_history_items,
+                        items_processed,
+                        int(time.perf_counter() - chunk_started),
+                    )
+                )
+                self.write_metrics()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        return items_processed, failed_ids, num_history_items
+
+    def get_chunk_size(self, chunk_size, adaptive=None):
+        """Get the chunk size to use, an ``AdaptiveChunkSize`` if adaptive chunks are enabled
+
+        :param int chunk_size: The (initial) number of archive history items per chunk
+        :param bool adaptive: Use adaptive chunks, defaults to ANALYTICS_STATS_ADAPTIVE_CHUNKS config (False)
+        """
+
+        if adaptive is None:
+            adaptive = app.config.get("ANALYTICS_STATS_ADAPTIVE_CHUNKS", False)
+
+        if not adaptive or isinstance(chunk_size, AdaptiveChunkSize):
+            return chunk_size
+
+        return AdaptiveChunkSize(chunk_size)
+
+    def update_chunk_size(self, chunk_size, history_items, duration):
+        """Adjust an ``AdaptiveChunkSize`` from the archive history items of the last chunk"""
+
+        if isinstance(chunk_size, AdaptiveChunkSize):
+            chunk_size.update(history_items, duration)
+
+    def generate_stats(self, item_id, gte, chunk_size, workers=1):
+        pool = self.get_timeline_pool(workers)
+
+        try:
+            return self._generate_stats(item_id, gte, chunk_size, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def get_timeline_pool(self, workers):
+        """Create the process pool used to generate timelines (if more than 1 worker is requested)
+
+        Daemonic processes (such as celery worker processes) are not allowed to have children,
+        so the timelines are generated in the current process instead
+        """
+
+        if workers > 1 and multiprocessing.current_process().daemon:
+            logger.warning("Cannot start {} timeline workers from a daemonic process, using 1 worker".format(workers))
+            workers = 1
+
+        self.num_workers = workers
+
+        if workers <= 1:
+            return None
+
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_timeline_worker,
+            initargs=(app._get_current_object(),),
+        )
+
+    def _generate_stats(self, item_id, gte, chunk_size, pool=None):
         items_processed = 0
         failed_ids = []
         num_history_items = 0
@@ -198,58 +561,382 @@ class GenArchiveStatistics(Command):
         if last_history.get("guid"):
             logger.info("Found previous run, continuing from history item {}".format(last_history["guid"]))
 
+        progress = {
+            "started": utcnow(),
+            "updated": None,
+            "completed": None,
+            "start_id": last_entry_id,
+            "num_chunks": 0,
+            "num_history_items": 0,
+            "num_items": 0,
+            "num_failed": 0,
+        }
+
         iterated_started = utcnow()
-        for history_items in statistics_service.get_history_items(last_entry_id, gte, item_id, chunk_size):
+        for history_items in metrics.iter_timer(
+            statistics_service.get_history_items(last_entry_id, gte, item_id, chunk_size), "fetch_history"
+        ):
             if len(history_items) < 1:
                 logger.info("No more history records to process")
                 break
 
-            gen_stats_signals["start"].send(self)
-
             num_history_items += len(history_items)
             last_entry_id = history_items[-1].get(config.ID_FIELD)
 
-            items = self.gen_history_timelines(history_items)
-            items_processed += len(items)
-            self.process_timelines(items, failed_ids)
+            num_items = self.process_history_items(history_items, failed_ids, pool)
+            items_processed += num_items
 
             time_diff = (utcnow() - iterated_started).total_seconds()
             logger.info(
                 "Processed {}/{} history/item records ({}/{} total) in {} seconds".format(
                     len(history_items),
-                    len(items),
+                    num_items,
                     num_history_items,
                     items_processed,
                     int(time_diff),
                 )
             )
+            self.update_chunk_size(chunk_size, history_items, time_diff)
+
+            # Don't store the last processed id if we're generating stats for a single item
+            if not item_id:
+                # Store the id of the last processed archive_history item after each chunk
+                # So if this run is interrupted, the next run continues from the next chunk
+                progress.update(
+                    {
+                        "updated": utcnow(),
+                        "num_chunks": progress["num_chunks"] + 1,
+                        "num_history_items": num_history_items,
+                        "num_items": items_processed,
+                        "num_failed": len(failed_ids),
+                    }
+                )
+                statistics_service.set_last_run_id(last_entry_id, last_history, progress)
 
-            gen_stats_signals["finish"].send(self)
+            self.write_metrics()
             iterated_started = utcnow()
 
         # Don't store the last processed id if we're generating stats for a single item
         if not item_id:
             # Create/Update the system record from this run
             # Storing the id of the last processed archive_history item
-            statistics_service.set_last_run_id(last_entry_id, last_history)
+            progress["completed"] = utcnow()
+            statistics_service.set_last_run_id(last_entry_id, last_history, progress)
 
+        self.write_metrics()
         return items_processed, failed_ids, num_history_items
 
-    def gen_history_timelines(self, history_items):
-        items = {}
+    def write_metrics(self):
+        """Write the metrics of the statistics generation to the ANALYTICS_STATS_METRICS_FILE (if defined)
+
+        Includes the backlog lag, the age of the oldest archive_history entry that is yet to be processed
+        """
+
+        if not app.config.get("ANALYTICS_STATS_METRICS_FILE"):
+            return
+
+        try:
+            metrics.set_gauge("backlog_lag_seconds", get_resource_service("archive_statistics").get_backlog_lag())
+        except Exception:
+            logger.exception("Failed to get the archive statistics backlog lag")
+
+        metrics.set_gauge("last_updated_timestamp_seconds", time.time())
+        metrics.write_file()
+
+    def process_history_items(self, history_items, failed_ids, pool=None, recompute=False):
+        """Generate and store the statistics for a chunk of archive history items
+
+        If the statistics for an item were modified by another process while they were being generated,
+        then the statistics for that item are generated again (up to ``MAX_CONFLICT_RETRIES`` times)
+
+        :param bool recompute: Generate the statistics from scratch (see ``gen_history_timelines``)
+
+        :return int: The number of items processed
+        """
+
+        # The ``failed_ids`` of the batch are only the items of this chunk (``failed_ids`` is for the whole run)
+        batch = StatsBatch(self, history_items, failed_ids=[])
+        stats_plugins.dispatch("start", batch)
+
+        with metrics.timer("gen_history_timelines"):
+            items = self.gen_history_timelines(history_items, recompute)
+
+        num_items = len(items)
+        batch.items = {}
+
+        for _ in range(MAX_CONFLICT_RETRIES + 1):
+            conflict_ids = []
+            self.process_timelines(items, batch.failed_ids, pool, conflict_ids)
+
+            # The items regenerated after a conflict replace their previous attempt
+            batch.items.update(items)
+
+            if not conflict_ids:
+                break
+
+            logger.info("Stats modified by another process, regenerating items {}".format(", ".join(conflict_ids)))
+            metrics.incr("conflicts", len(conflict_ids))
+
+            with metrics.timer("gen_history_timelines"):
+                items = self.gen_history_timelines(
+                    [history_item for history_item in history_items if history_item.get("item_id") in conflict_ids],
+                    recompute,
+                )
+        else:
+            logger.warning("Failed to resolve conflicts for items {}".format(", ".join(conflict_ids)))
+            batch.failed_ids.extend(conflict_ids)
+
+        failed_ids.extend(batch.failed_ids)
+        stats_plugins.dispatch("finish", batch)
+
+        # Changes the watermark of the statistics, so the cached reports are generated again
+        get_resource_service("archive_statistics").bump_generation()
+
+        metrics.incr("chunks")
+        metrics.incr("history_items", len(history_items))
+        metrics.incr("items", num_items)
+        metrics.incr("failed_items", len(batch.failed_ids))
+
+        return num_items
+
+    def run_leases(self, gte, chunk_size, workers, lease_size, lease_workers=None):
+        """Split the pending archive history into leases, and process them using multiple celery workers"""
+
+        try:
+            lease_workers = int(
+                lease_workers if lease_workers is not None else app.config.get("ANALYTICS_STATS_LEASE_WORKERS", 4)
+            )
+        except (ValueError, TypeError):
+            lease_workers = 0
 
         statistics_service = get_resource_service("archive_statistics")
+        lock_name = get_lock_id("analytics", "gen_archive_statistics")
+
+        # Only one process is allowed to create leases at a time
+        if lock(lock_name, expire=610):
+            try:
+                num_requeued = statistics_service.requeue_expired_leases()
+                if num_requeued:
+                    logger.warning("Re-queued {} expired archive statistics leases".format(num_requeued))
+
+                num_leases = self.create_leases(gte, lease_size)
+                logger.info("Created {} archive statistics leases".format(num_leases))
+            except Exception:
+                logger.exception("Failed to create archive statistics leases")
+            finally:
+                unlock(lock_name)
+        else:
+            logger.info("Archive statistics leases are already being created.")
+
+        for _ in range(lease_workers):
+            self.start_lease_worker(chunk_size)
+
+        self.run_lease_worker(chunk_size, workers)
+
+    def get_lease_durations(self):
+        """Get the lease expiry and the maximum duration of a lease worker (in seconds)
+
+        :return tuple: ANALYTICS_STATS_LEASE_EXPIRY (defaults to 300) and
+            ANALYTICS_STATS_LEASE_MAX_DURATION (defaults to 500) config
+        """
+
+        expiry = int(app.config.get("ANALYTICS_STATS_LEASE_EXPIRY") or 300)
+        max_duration = int(app.config.get("ANALYTICS_STATS_LEASE_MAX_DURATION") or 500)
+
+        return expiry, max_duration
+
+    def start_lease_worker(self, chunk_size):
+        """Queue a celery task to process leases, using the same ``chunk_size`` as this run
+
+        Leases are claimed for up to the maximum duration, and the last lease claimed can take another expiry
+        to process before it is re-queued, so the task time limit is sized from both.
+
+        The task arguments are serialised as JSON, so an adaptive chunk size is passed as its current size
+        and the ``adaptive`` flag, and rebuilt by the task
+        """
+
+        from analytics.stats import gen_archive_stats_lease
+
+        expiry, max_duration = self.get_lease_durations()
+
+        gen_archive_stats_lease.apply_async(
+            kwargs={
+                "chunk_size": get_chunk_size(chunk_size),
+                "adaptive": isinstance(chunk_size, AdaptiveChunkSize),
+            },
+            soft_time_limit=max_duration + expiry,
+            time_limit=max_duration + expiry + 60,
+        )
+
+    def create_leases(self, gte, lease_size):
+        """Split the archive history items after the last run into leases of ``lease_size`` items
+
+        The last run is updated after each lease is created, so the archive history items
+        are only ever assigned to a single lease
+
+        :return int: The number of leases created
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        history_service = get_resource_service("archive_history")
+
+        last_run = statistics_service.get_last_run()
+        start_id = last_run.get("guid") or None
+        num_leases = 0
+
+        while True:
+            lookup = {}
+            if start_id:
+                lookup[config.ID_FIELD] = {"$gt": start_id}
+            if gte:
+                lookup["_created"] = {"$gte": gte}
+
+            cursor = history_service.get_from_mongo(req=None, lookup=lookup, projection={config.ID_FIELD: 1})
+            history_items = list(cursor.sort(config.ID_FIELD, 1).skip(lease_size - 1).limit(1))
+
+            if not len(history_items):
+                # Less than ``lease_size`` items remaining, use the last item for the final lease
+                cursor = history_service.get_from_mongo(req=None, lookup=lookup, projection={config.ID_FIELD: 1})
+                history_items = list(cursor.sort(config.ID_FIELD, -1).limit(1))
+
+                if not len(history_items):
+                    break
+
+            end_id = str(history_items[0][config.ID_FIELD])
+            statistics_service.create_lease(start_id, end_id, gte)
+            statistics_service.set_last_run_id(end_id, last_run)
+
+            start_id = end_id
+            num_leases += 1
+
+        return num_leases
+
+    def run_lease_worker(self, chunk_size=1000, workers=1, adaptive=None):
+        """Claim and process leases until there are none remaining
+
+        Processing stops after ANALYTICS_STATS_LEASE_MAX_DURATION seconds (defaults to 500), so this can
+        finish before the celery time limit, in which case another celery task is started to continue processing
+
+        :param int chunk_size: The number of archive history items to process at a time
+        :param int workers: The number of processes used to generate the timelines
+        :param bool adaptive: Adapt the chunk size to the processing time (defaults to ANALYTICS_STATS_ADAPTIVE_CHUNKS)
+        :return bool: True if there are leases remaining to be processed
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        owner = "{}:{}".format(socket.gethostname(), os.getpid())
+        expiry, max_duration = self.get_lease_durations()
+        started = utcnow()
+        metrics.reset()
+        chunk_size = self.get_chunk_size(chunk_size, adaptive)
+
+        pool = self.get_timeline_pool(workers)
+
+        try:
+            while (utcnow() - started).total_seconds() < max_duration:
+                lease = statistics_service.claim_lease(owner, expiry)
+
+                if not lease:
+                    return False
+
+                try:
+                    self.process_lease(lease, chunk_size, expiry, pool)
+                except Exception:
+                    logger.exception("Failed to process archive statistics lease {}".format(lease[config.ID_FIELD]))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if not statistics_service.get_leases():
+            return False
+
+        self.start_lease_worker(chunk_size)
+        return True
+
+    def process_lease(self, lease, chunk_size, expiry, pool=None):
+        """Generate the statistics for the archive history items of a lease
+
+        The lease is updated after each chunk, storing the id of the last processed archive history item
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        failed_ids = []
+        num_history_items = 0
+        items_processed = 0
+        started = utcnow()
+        chunk_started = time.perf_counter()
+
+        logger.info(
+            "Processing archive statistics lease {}. start={}, end={}, attempt={}".format(
+                lease[config.ID_FIELD], lease.get("guid"), lease["end_id"], lease["attempts"]
+            )
+        )
+
+        for history_items in metrics.iter_timer(
+            statistics_service.get_history_items(
+                lease.get("guid"), lease.get("gte"), None, chunk_size, end_id=lease["end_id"]
+            ),
+            "fetch_history",
+        ):
+            num_history_items += len(history_items)
+            items_processed += self.process_history_items(history_items, failed_ids, pool)
+
+            if not statistics_service.update_lease(lease, history_items[-1][config.ID_FIELD], expiry):
+                logger.warning("Archive statistics lease {} claimed by another worker".format(lease[config.ID_FIELD]))
+                return
+
+            self.write_metrics()
+            self.update_chunk_size(chunk_size, history_items, time.perf_counter() - chunk_started)
+            chunk_started = time.perf_counter()
+
+        statistics_service.complete_lease(lease)
+
+        if len(failed_ids) > 0:
+            logger.warning("Failed to generate stats for items {}".format(", ".join(failed_ids)))
+
+        logger.info(
+            "Finished archive statistics lease {}. {} items ({} history entries) in {} seconds".format(
+                lease[config.ID_FIELD], items_processed, num_history_items, int((utcnow() - started).total_seconds())
+            )
+        )
+
+    def gen_history_timelines(self, history_items, recompute=False):
+        """Generate the timeline entries of the items referenced by ``history_items``
+
+        :param list history_items: The archive_history items
+        :param bool recompute: Ignore the existing statistics of the items, generating them from ``history_items``
+            (which must contain the full history of the items)
+        """
+
+        items = {}
+
+        # Load the existing statistics for all items in this chunk in bulk
+        # instead of a ``find_one`` request for each item
+        with metrics.timer("get_existing_stats"):
+            existing_items = self.get_existing_stats(history_items)
 
         def add_item(entry_id):
             if items.get(entry_id):
                 return
 
-            item = statistics_service.find_one(req=None, _id=str(entry_id)) or {}
+            item = existing_items.get(str(entry_id)) or {}
+
+            # The statistics before this run (i.e. for plugins that store the difference made by the new timeline)
+            previous_stats = dict(item.get("stats") or {})
+
+            if recompute and item:
+                # Only keep the identity of the existing statistics, so they are updated rather than created
+                item = {config.ID_FIELD: item[config.ID_FIELD], config.ETAG: item.get(config.ETAG)}
 
             if not item.get("stats"):
                 item["stats"] = {}
 
-            items[entry_id] = {"item": item, "_id": entry_id, "updates": {"stats": {}}}
+            items[entry_id] = {
+                "item": item,
+                "_id": entry_id,
+                "updates": {"stats": {}},
+                "previous_stats": previous_stats,
+            }
 
             items[entry_id]["updates"].update(item)
 
@@ -283,22 +970,29 @@ class GenArchiveStatistics(Command):
 
         return items
 
+    def get_existing_stats(self, history_items):
+        """Get the existing statistics documents for the items referenced by ``history_items``"""
+
+        return get_resource_service("archive_statistics").get_items_by_ids(
+            [history_item.get("item_id") for history_item in history_items]
+        )
+
     def gen_archive_stats_from_history(self, item, history):
         self.set_operation(history)
 
         task = history["update"].get("task") or {}
-        entry = {
-            "history_id": history.get(config.ID_FIELD),
-            "operation": history.get("operation"),
-            "operation_created": history.get("_created"),
-            "task": {
-                "user": history.get("user_id"),
-                "desk": task.get("desk"),
-                "stage": task.get("stage"),
-            },
-            "update": history["update"],
-            "version": history["version"],
-        }
+        entry = TimelineEntry(
+            history_id=history.get(config.ID_FIELD),
+            operation=history.get("operation"),
+            operation_created=history.get("_created"),
+            task=Task(
+                user=history.get("user_id"),
+                desk=task.get("desk"),
+                stage=task.get("stage"),
+            ),
+            update=history["update"],
+            version=history["version"],
+        )
 
         if history.get("original_item_id"):
             entry["original_item_id"] = history["original_item_id"]
@@ -308,19 +1002,16 @@ class GenArchiveStatistics(Command):
         else:
             # Remove the new task details from the MOVE_FROM operation
             # Task will later be calculated from the previous history item
-            task = entry.pop("task", {"user": history.get("user_id"), "desk": None, "stage": None})
+            task = entry.pop("task", Task(user=history.get("user_id")))
 
-            entry["task"] = {
-                "user": history.get("user_id"),
-                "desk": None,
-                "stage": None,
-            }
+            entry["task"] = Task(user=history.get("user_id"))
             entry["operation"] = OPERATION.MOVE_FROM
             item["updates"]["stats"][STAT_TYPE.TIMELINE].append(entry)
 
             # Copy the original history entry for the MOVE_TO entry
             # Assign the new task details to this entry
-            entry = deepcopy(entry)
+            # (the ``update`` is shared, as it is not modified when generating the timeline)
+            entry = entry.copy()
             entry["operation"] = OPERATION.MOVE_TO
             entry["task"] = task
             entry["_auto_generated"] = True
@@ -336,56 +1027,6 @@ class GenArchiveStatistics(Command):
                 history["operation"] = OPERATION.PUBLISH_EMBARGO
 
     def set_metadata_updates(self, item, history):
-        fields = [
-            "original_creator",
-            "version_creator" "versioncreated",
-            "firstpublished",
-            "firstcreated",
-            "source",
-            "original_source",
-            "ingest_provider",
-            "anpa_category",
-            "subject",
-            "genre",
-            "company_codes",
-            ITEM_TYPE,
-            "abstract",
-            "headline",
-            "slugline",
-            "anpa_take_key",
-            "keywords",
-            "word_count",
-            "priority",
-            "urgency",
-            ITEM_STATE,
-            "pubstatus",
-            "flags",
-            "sms_message",
-            FORMAT,
-            "auto_publish",
-            "assignment_id",
-            "rewrite_of",
-            "rewritten_by",
-            "original_id",
-            SCHEDULE_SETTINGS,
-            "task",
-            PUBLISH_SCHEDULE,
-            EMBARGO,
-            "unique_id",
-            "unique_name",
-            "ingest_id",
-            "family_id",
-            "usageterms",
-            "copyrightnotice",
-            "copyrightholder",
-            "profile",
-            BYLINE,
-            "ednote",
-            "dateline",
-            "expiry",
-            "place",
-            "template",
-        ]
 
         # Calculate and store item attributes that the history service removes
         user_id = history["task"]["user"]
@@ -400,61 +1041,188 @@ class GenArchiveStatistics(Command):
             item["updates"]["original_creator"] = user_id
             item["updates"]["firstcreated"] = created
 
-        for field in fields:
+        for field in METADATA_FIELDS:
             if field in history["update"]:
                 item["updates"][field] = history["update"][field]
 
-    def process_timelines(self, items, failed_ids):
-        statistics_service = get_resource_service("archive_statistics")
-        items_to_create = []
-        rewrites = []
+    def build_timelines(self, items, failed_ids):
+        """Build the timeline for each item, removing any item that failed"""
 
-        for item_id, item in items.items():
+        for item_id in list(items.keys()):
             try:
-                self.gen_stats_from_timeline(item)
+                self.build_timeline(items[item_id])
             except Exception:
                 logger.exception("Failed to generate stats for item {}".format(item_id))
                 failed_ids.append(item_id)
-                continue
+                items.pop(item_id)
+
+    def build_timelines_in_pool(self, items, failed_ids, pool):
+        """Build the item timelines using the process pool
+
+        Items are partitioned using a hash of their id, one partition per worker.
+        """
 
-            if item["updates"].get("rewrite_of") and (item["updates"].get("time_to_first_publish") or 0) > 0:
-                rewrites.append(item_id)
+        num_partitions = self.num_workers
+        partitions = [{} for _ in range(num_partitions)]
 
-            if not item["item"].get(config.ID_FIELD):
-                item["updates"][config.ID_FIELD] = item_id
-                item["updates"]["stats_type"] = "archive"
-                items_to_create.append(item["updates"])
+        for item_id, item in items.items():
+            partitions[zlib.crc32(str(item_id).encode()) % num_partitions][item_id] = item
+
+        items.clear()
+        for partition_items, partition_failed_ids, partition_metrics in pool.map(
+            _build_partition_timelines, [partition for partition in partitions if partition]
+        ):
+            items.update(partition_items)
+            failed_ids.extend(partition_failed_ids)
+            metrics.merge(partition_metrics)
+
+    def process_timelines(self, items, failed_ids, pool=None, conflict_ids=None):
+        with metrics.timer("build_timelines"):
+            if pool is None:
+                self.build_timelines(items, failed_ids)
             else:
+                self.build_timelines_in_pool(items, failed_ids, pool)
+
+        # Load the originals of the rewrites in this chunk in bulk (used for the family and rewrite stats)
+        with metrics.timer("rewrites"):
+            originals = self.get_rewrite_originals(items)
+            self.set_family_roots(items, originals)
+
+        with metrics.timer("complete_timelines"):
+            for item_id in list(items.keys()):
                 try:
-                    statistics_service.patch(item_id, item["updates"])
+                    self.complete_timeline(items[item_id])
                 except Exception:
-                    logger.exception(
-                        "Failed to update stats for item {}. updates={}".format(item_id, item.get("updates"))
-                    )
+                    logger.exception("Failed to generate stats for item {}".format(item_id))
                     failed_ids.append(item_id)
+                    items.pop(item_id)
 
-        if len(items_to_create) > 0:
-            try:
-                statistics_service.post(items_to_create)
-            except Exception:
-                item_ids = [item.get(config.ID_FIELD) for item in items_to_create]
-                logger.exception("Failed to create stat entries for items {}".format(", ".join(item_ids)))
-                failed_ids.extend(failed_ids)
+        with metrics.timer("rewrites"):
+            original_updates = self.get_rewrite_original_updates(items, originals)
 
-        for item_id in rewrites:
-            item = items[item_id]
+        # Creates and updates are collected and sent to Mongo & Elastic in bulk
+        with metrics.timer("write"), self.get_stats_writer(failed_ids, conflict_ids) as writer:
+            for item_id, item in items.items():
+                if not item["item"].get(config.ID_FIELD):
+                    item["updates"][config.ID_FIELD] = item_id
+                    item["updates"]["stats_type"] = "archive"
+                    writer.create(item["updates"])
+                else:
+                    writer.update(item_id, item["updates"], etag=item["item"].get(config.ETAG))
 
-            updated_at = item["updates"].get("firstpublished")
-            if not updated_at:
-                logger.warning("Failed {}, updated_at not defined".format(item_id))
+            for original_id, updates in original_updates.items():
+                writer.update(original_id, updates)
+
+    def get_rewrite_originals(self, items):
+        """Load the statistics of the originals of the rewrites in ``items`` (that are not in ``items``)
+
+        Originals generated before ``family_root_id`` was stored are followed up the chain of rewrites,
+        loading one level of the chain per request.
+
+        :param dict items: The items of this chunk
+        :return dict: The statistics of the originals, keyed by their id
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        originals = {}
+        pending_ids = {
+            item["updates"]["rewrite_of"]
+            for item in items.values()
+            if item["updates"].get("rewrite_of") and item["updates"]["rewrite_of"] not in items
+        }
+
+        while pending_ids:
+            docs = statistics_service.get_items_by_ids(list(pending_ids))
+            originals.update(docs)
+
+            pending_ids = {
+                doc["rewrite_of"]
+                for doc in docs.values()
+                if doc.get("rewrite_of")
+                and not doc.get("family_root_id")
+                and doc["rewrite_of"] not in originals
+                and doc["rewrite_of"] not in items
+            }
+
+        return originals
+
+    def set_family_roots(self, items, originals):
+        """Set the ``family_root_id`` and ``family_depth`` of the items, from the chain of rewrites
+
+        :param dict items: The items of this chunk
+        :param dict originals: The statistics of the originals (from ``get_rewrite_originals``)
+        """
+
+        roots = {}
+
+        for item_id in items.keys():
+            path = []
+            current_id = item_id
+
+            while current_id not in roots:
+                if current_id in items:
+                    doc = items[current_id]["updates"]
+                else:
+                    doc = originals.get(str(current_id))
+
+                    if doc and doc.get("family_root_id"):
+                        # Originals not in this chunk already have their family root
+                        roots[current_id] = (doc["family_root_id"], doc.get("family_depth") or 0)
+                        break
+
+                if not doc or current_id in path:
+                    # The chain of rewrites is incomplete, or has a cycle
+                    break
+
+                if not doc.get("rewrite_of"):
+                    roots[current_id] = (current_id, 0)
+                    break
+
+                path.append(current_id)
+                current_id = doc["rewrite_of"]
+
+            root = roots.get(current_id)
+            for path_id in reversed(path):
+                root = None if root is None else (root[0], root[1] + 1)
+                roots[path_id] = root
+
+            if roots.get(item_id):
+                items[item_id]["updates"]["family_root_id"], items[item_id]["updates"]["family_depth"] = roots[item_id]
+
+    def get_rewrite_original_updates(self, items, originals):
+        """Calculate ``time_to_next_update_publish`` for the originals of the published rewrites in ``items``
+
+        Originals that are in ``items`` are updated in place.
+
+        :param dict items: The items of this chunk, with their completed ``updates``
+        :param dict originals: The statistics of the originals not in ``items`` (from ``get_rewrite_originals``)
+        :return dict: Updates for the originals that are not in ``items``, keyed by their id
+        """
+
+        rewrites = {}
+        for item_id, item in items.items():
+            updates = item["updates"]
+
+            if not updates.get("rewrite_of") or (updates.get("time_to_first_publish") or 0) <= 0:
                 continue
 
-            original_id = item["updates"].get("rewrite_of")
-            if not original_id:
-                logger.warning("Failed {}, original_id not defined".format(item_id))
+            if not updates.get("firstpublished"):
+                logger.warning("Failed {}, updated_at not defined".format(item_id))
                 continue
 
-            original = statistics_service.find_one(req=None, _id=original_id)
+            rewrites[item_id] = updates
+
+        original_updates = {}
+
+        for item_id, updates in rewrites.items():
+            original_id = updates["rewrite_of"]
+
+            # Use originals from this chunk directly, as they have not been written yet
+            if original_id in items:
+                original = items[original_id]["updates"]
+            else:
+                original = originals.get(str(original_id))
+
             if not original:
                 logger.warning("Failed {}, original not found".format(item_id))
                 continue
@@ -464,10 +1232,19 @@ class GenArchiveStatistics(Command):
                 logger.warning("Failed {}, published_at not defined".format(original_id))
                 continue
 
-            statistics_service.patch(
-                original_id,
-                {"time_to_next_update_publish": (updated_at - published_at).total_seconds()},
-            )
+            time_to_next_update_publish = (updates["firstpublished"] - published_at).total_seconds()
+
+            if original_id in items:
+                original["time_to_next_update_publish"] = time_to_next_update_publish
+            else:
+                original_updates[original_id] = {"time_to_next_update_publish": time_to_next_update_publish}
+
+        return original_updates
+
+    def get_stats_writer(self, failed_ids, conflict_ids=None):
+        """Get the writer used to store the generated statistics (see ``StatisticsBulkWriter``)"""
+
+        return get_resource_service("archive_statistics").get_writer(failed_ids, conflict_ids)
 
     def _store_update_fields(self, entry):
         update = {}
@@ -476,8 +1253,9 @@ class GenArchiveStatistics(Command):
             # If the entry belongs to a lock, store the lock information
             update = entry.get("update") or {}
 
-        desk_transitions.store_update_fields(entry, update)
-        gen_stats_signals["generate"].send(self, entry=entry, update=update)
+        operation = entry.get("operation")
+        if stats_plugins.has_handlers("generate", operation):
+            stats_plugins.dispatch("generate", EntryUpdate(self, entry=entry, update=update), operation)
 
         if update:
             entry["update"] = update
@@ -485,6 +1263,17 @@ class GenArchiveStatistics(Command):
             entry.pop("update", None)
 
     def gen_stats_from_timeline(self, item):
+        self.build_timeline(item)
+        self.complete_timeline(item)
+
+    def build_timeline(self, item):
+        """Generate the new timeline for the item
+
+        The new timeline is stored in ``updates._new_timeline``, to be used by ``complete_timeline``.
+        If the item has a ``timeline_state`` from a previous run, and the new history entries are
+        newer than the processed entries, then only the new entries are processed
+        """
+
         item.setdefault("updates", {})
         updates = item["updates"]
 
@@ -494,18 +1283,19 @@ class GenArchiveStatistics(Command):
         if len(stats.get(STAT_TYPE.TIMELINE) or []) < 1:
             return
 
+        if self.can_append_timeline(item):
+            self.append_timeline(item)
+            return
+
         new_timeline = []
-        desk_transitions.init(stats)
-        gen_stats_signals["init_timeline"].send(self, stats=stats)
+        stats_plugins.dispatch("init_timeline", TimelineStats(self, stats=stats))
 
-        try:
-            entries = sorted(
-                stats[STAT_TYPE.TIMELINE],
-                key=lambda k: (k["operation_created"], k["history_id"]),
-            )
-        except Exception as e:
-            logger.exception("Failed to sort timeline {}".format(stats[STAT_TYPE.TIMELINE]))
-            raise e
+        entries = self._sort_timeline_entries(
+            [
+                TimelineEntry.from_dict(entry) if isinstance(entry, dict) else entry
+                for entry in stats[STAT_TYPE.TIMELINE]
+            ]
+        )
 
         # If the first history item has original_item_id attribute,
         # then this item is a duplicate of another item
@@ -516,48 +1306,146 @@ class GenArchiveStatistics(Command):
         updates["par_count"] = 0
 
         for entry in entries:
-            entry.setdefault("update", {})
-            self.set_metadata_updates(item, entry)
-            self.set_timeline_entry_task_details(entry, updates)
+            self.process_timeline_entry(item, entry, new_timeline)
 
-            if self.skip_timeline_entry(entry, updates):
-                continue
+        updates["_new_timeline"] = new_timeline
 
-            # Remove the update attribute before adding to the timeline
-            update = entry.get("update") or {}
-            self._store_update_fields(entry)
-
-            # Update the paragraph count from this history entry
-            self.update_par_count_from_timeline_entry(entry, updates, update)
-
-            new_timeline.append(entry)
-
-            # Use a copy of entry after adding to the timeline
-            # So that any changes from here do not modify the existing timeline entry
-            entry = deepcopy(entry)
-
-            operation = entry.get("operation")
-            operation_created = entry.get("operation_created")
-
-            if operation == OPERATION.PUBLISH:
-                updates["_published"] = True
-                if not updates.get("firstpublished"):
-                    updates["firstpublished"] = operation_created
-            elif operation in [OPERATION.CREATE, OPERATION.FETCH] and not updates.get("firstcreated"):
-                updates["firstcreated"] = operation_created
-
-            desk_transitions.process(entry, new_timeline, updates, update, stats)
-            gen_stats_signals["process"].send(
-                self,
-                entry=entry,
-                new_timeline=new_timeline,
-                updates=updates,
-                update=update,
-                stats=stats,
+    def can_append_timeline(self, item):
+        """Returns True if the new timeline entries can be appended to the existing timeline of the item
+
+        The existing timeline must have been generated with a ``timeline_state``,
+        and all new entries must be newer than the last processed entry
+        """
+
+        if not app.config.get("ANALYTICS_STATS_INCREMENTAL_TIMELINE", True):
+            return False
+
+        state = (item.get("item") or {}).get("timeline_state") or {}
+        last_entry = state.get("last_entry")
+
+        if not last_entry:
+            return False
+
+        last_key = self._get_timeline_entry_key(last_entry)
+
+        for entry in item["updates"]["stats"][STAT_TYPE.TIMELINE]:
+            if not entry.get("_processed") and self._get_timeline_entry_key(entry) < last_key:
+                logger.info(
+                    "History entry {} for item {} is out of order, generating the full timeline".format(
+                        entry.get("history_id"), item.get(config.ID_FIELD)
+                    )
+                )
+                return False
+
+        return True
+
+    def append_timeline(self, item):
+        """Process only the new timeline entries, starting from the stored ``timeline_state``"""
+
+        updates = item["updates"]
+        stats = updates["stats"]
+
+        new_timeline = []
+        entries = []
+        for entry in stats[STAT_TYPE.TIMELINE]:
+            if entry.get("_processed"):
+                new_timeline.append(entry)
+            else:
+                entries.append(entry)
+
+        if not entries:
+            updates["_new_timeline"] = new_timeline
+            return
+
+        # Restore the temporary attributes from the previous run
+        for key, value in deepcopy(item["item"]["timeline_state"]).items():
+            updates["_{}".format(key)] = value
+
+        # The ids of the history entries already in the timeline, so duplicate history entries are skipped
+        updates["_processed_ids"] = {entry["history_id"] for entry in new_timeline if entry.get("history_id")}
+        updates["par_count"] = updates.get("par_count") or 0
+
+        stats_plugins.dispatch("resume_timeline", TimelineStats(self, stats=stats))
+
+        for entry in self._sort_timeline_entries(entries):
+            self.process_timeline_entry(item, entry, new_timeline)
+
+        updates["_new_timeline"] = new_timeline
+
+    def _sort_timeline_entries(self, entries):
+        try:
+            return sorted(entries, key=lambda k: (k["operation_created"], k["history_id"]))
+        except Exception as e:
+            logger.exception("Failed to sort timeline {}".format(entries))
+            raise e
+
+    def _get_timeline_entry_key(self, entry):
+        return entry["operation_created"], str(entry["history_id"])
+
+    def process_timeline_entry(self, item, entry, new_timeline):
+        """Process a single timeline entry, adding it to the ``new_timeline``"""
+
+        updates = item["updates"]
+        stats = updates["stats"]
+
+        entry.setdefault("update", {})
+        self.set_metadata_updates(item, entry)
+        self.set_timeline_entry_task_details(entry, updates)
+
+        # Store the last processed entry, used to detect out of order history entries in future runs
+        updates["_last_entry"] = {
+            "operation_created": entry["operation_created"],
+            "history_id": entry["history_id"],
+        }
+
+        if self.skip_timeline_entry(entry, updates):
+            return
+
+        # Remove the update attribute before adding to the timeline
+        update = entry.get("update") or {}
+        self._store_update_fields(entry)
+
+        # Update the paragraph count from this history entry
+        self.update_par_count_from_timeline_entry(entry, updates, update)
+
+        new_timeline.append(entry)
+
+        # Use a copy of entry after adding to the timeline
+        # So that any changes from here do not modify the existing timeline entry
+        # (a shallow copy is enough, as attributes of the entry are replaced rather than modified)
+        entry = entry.copy()
+
+        operation = entry.get("operation")
+        operation_created = entry.get("operation_created")
+
+        if operation == OPERATION.PUBLISH:
+            updates["_published"] = True
+            if not updates.get("firstpublished"):
+                updates["firstpublished"] = operation_created
+        elif operation in [OPERATION.CREATE, OPERATION.FETCH] and not updates.get("firstcreated"):
+            updates["firstcreated"] = operation_created
+
+        if stats_plugins.has_handlers("process", operation):
+            stats_plugins.dispatch(
+                "process",
+                ProcessedEntry(
+                    self, entry=entry, new_timeline=new_timeline, updates=updates, update=update, stats=stats
+                ),
+                operation,
             )
 
-        desk_transitions.complete(stats, updates)
-        gen_stats_signals["complete"].send(self, stats=stats, orig=item, updates=updates)
+    def complete_timeline(self, item):
+        """Complete the statistics for the item from the timeline generated in ``build_timeline``"""
+
+        updates = item["updates"]
+        stats = updates["stats"]
+
+        if "_new_timeline" not in updates:
+            return
+
+        new_timeline = updates["_new_timeline"]
+
+        stats_plugins.dispatch("complete", CompletedItem(self, stats=stats, orig=item, updates=updates))
 
         if updates.get("firstpublished") and updates.get("firstcreated"):
             updates["time_to_first_publish"] = (updates["firstpublished"] - updates["firstcreated"]).total_seconds()
@@ -566,12 +1454,32 @@ class GenArchiveStatistics(Command):
             entry.pop("_processed", None)
             return entry
 
-        stats[STAT_TYPE.TIMELINE] = [_remove_tmp_fields(entry) for entry in new_timeline]
+        stats[STAT_TYPE.TIMELINE] = serialise_entries([_remove_tmp_fields(entry) for entry in new_timeline])
+
+        # Timeline entries may also have been added to other statistics (i.e. featuremedia_updates)
+        for key, value in stats.items():
+            if key != STAT_TYPE.TIMELINE and isinstance(value, list):
+                stats[key] = serialise_entries(value)
+
+        # Store the temporary attributes, so the next run can continue from here
+        updates["timeline_state"] = self.get_timeline_state(updates)
 
         for key in list(updates.keys()):
             if key.startswith("_"):
                 updates.pop(key)
 
+    def get_timeline_state(self, updates):
+        """Get the temporary attributes of the item (without the ``_`` prefix) to store in ``timeline_state``"""
+
+        state = {}
+        for key, value in updates.items():
+            if not key.startswith("_") or key in TIMELINE_STATE_EXCLUDE_FIELDS:
+                continue
+
+            state[key[1:]] = list(value) if isinstance(value, set) else value
+
+        return state
+
     def set_timeline_entry_task_details(self, entry, updates):
         """Calculate the desk, stage and user for this entry"""
 
@@ -594,7 +1502,7 @@ class GenArchiveStatistics(Command):
 
         # Store temporary attribute for storing ids of history records
         # that have already been processed (no duplicate history records in stats)
-        updates.setdefault("_processed_ids", [])
+        updates.setdefault("_processed_ids", set())
 
         # Skip history records that belong to the parent item
         # (history records are copied for duplicate items)
@@ -609,21 +1517,58 @@ class GenArchiveStatistics(Command):
             if entry["history_id"] in updates["_processed_ids"]:
                 return True
 
-            updates["_processed_ids"].append(entry["history_id"])
+            updates["_processed_ids"].add(entry["history_id"])
 
         return False
 
     def update_par_count_from_timeline_entry(self, entry, updates, update):
-        """Generate and store the paragraph count from body_html"""
+        """Generate and store the paragraph count from body_html
+
+        The html is only parsed if it is different to the previous body of the item,
+        and is not in the ``par_count_cache``
+        """
 
         if len(update.get("body_html") or "") > 0:
-            entry["par_count"] = get_par_count(update["body_html"])
-            updates["par_count"] = entry["par_count"]
-        else:
-            entry["par_count"] = updates["par_count"]
+            body_hash = par_count_cache.get_hash(update["body_html"])
+
+            # Store temporary attribute for the hash of the last body, so unchanged bodies are not parsed again
+            if body_hash == updates.get("_body_hash"):
+                par_count_cache.hits += 1
+            else:
+                updates["par_count"] = par_count_cache.get_par_count(update["body_html"], body_hash)
+                updates["_body_hash"] = body_hash
+
+        entry["par_count"] = updates["par_count"]
 
         if "original_par_count" not in updates and entry["par_count"] > 0:
             updates["original_par_count"] = entry["par_count"]
 
 
+def _get_chunks(values, chunk_size):
+    chunk = []
+
+    for value in values:
+        chunk.append(value)
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _init_timeline_worker(flask_app):
+    # Plugins require an application context (i.e. to access app.config)
+    flask_app.app_context().push()
+
+
+def _build_partition_timelines(items):
+    # Only return the metrics of this partition, so they are not counted twice in the main process
+    metrics.reset()
+    failed_ids = []
+    GenArchiveStatistics().build_timelines(items, failed_ids)
+    return items, failed_ids, metrics.snapshot()
+
+
 command("analytics:gen_archive_statistics", GenArchiveStatistics())
@@ -0,0 +1,499 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics import init_app
+from analytics.stats import gen_archive_stats_lease
+from analytics.stats.chunk_size import AdaptiveChunkSize
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+from analytics.stats.offline import offline_statistics
+from analytics.stats.plugins import StatsPlugin, StatsPluginRegistry
+
+from datetime import datetime, timedelta
+from unittest import mock
+import json
+import pytz
+
+
+FEATUREMEDIA = {"_id": "bike", "type": "picture", "poi": {"x": 0.5, "y": 0.5}, "renditions": {}}
+
+
+def get_history(history_id, item_id, operation, minutes, update=None, version=1, **kwargs):
+    history = {
+        "_id": history_id,
+        "item_id": item_id,
+        "user_id": "user1",
+        "operation": operation,
+        "version": version,
+        "_created": datetime(2019, 3, 1, 8, 0, tzinfo=pytz.utc) + timedelta(minutes=minutes),
+        "update": update or {},
+    }
+    history.update(kwargs)
+    return history
+
+
+class ProcessHistoryItemsTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        self.generator = GenArchiveStatistics()
+        self.batches = []
+
+        test = self
+
+        class BatchRecorder(StatsPlugin):
+            def finish(self, batch):
+                test.batches.append({"failed_ids": list(batch.failed_ids), "items": sorted(batch.items.keys())})
+
+        self.registry = StatsPluginRegistry()
+        self.registry.register(BatchRecorder())
+
+    def _gen_history_timelines(self, history_items, recompute=False):
+        return {history_item["item_id"]: {} for history_item in history_items}
+
+    def _process(self, history_items, failed_ids, process_timelines):
+        with offline_statistics([]) as service:
+            with mock.patch("analytics.stats.gen_archive_statistics.stats_plugins", self.registry):
+                with mock.patch.object(self.generator, "gen_history_timelines", self._gen_history_timelines):
+                    with mock.patch.object(self.generator, "process_timelines", process_timelines):
+                        self.generator.process_history_items(history_items, failed_ids)
+
+            return service
+
+    def test_batch_failed_ids_are_per_chunk(self):
+        def process_timelines(items, failed_ids, pool=None, conflict_ids=None):
+            if "item2" in items:
+                items.pop("item2")
+                failed_ids.append("item2")
+
+        # item1 failed in a previous chunk of this run
+        failed_ids = ["item1"]
+        self._process([{"item_id": "item1"}, {"item_id": "item2"}], failed_ids, process_timelines)
+
+        self.assertEqual(self.batches[0]["failed_ids"], ["item2"])
+        self.assertEqual(failed_ids, ["item1", "item2"])
+
+    def test_batch_items_include_conflict_retries(self):
+        conflicts = ["item2"]
+
+        def process_timelines(items, failed_ids, pool=None, conflict_ids=None):
+            # item2 was modified by another process the first time it was written
+            if "item2" in items and conflicts:
+                conflict_ids.append(conflicts.pop())
+
+        self._process([{"item_id": "item1"}, {"item_id": "item2"}], [], process_timelines)
+
+        self.assertEqual(self.batches, [{"failed_ids": [], "items": ["item1", "item2"]}])
+
+    def test_generation_is_bumped_per_chunk(self):
+        service = self._process([{"item_id": "item1"}], [], lambda *args, **kwargs: None)
+        self.assertEqual(service.get_generation(), 1)
+
+
+class IncrementalTimelineTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        task = {"desk": "desk1", "stage": "stage1", "user": "user1"}
+        moved_featuremedia = dict(FEATUREMEDIA, poi={"x": 0.7, "y": 0.5})
+
+        self.first_history = [
+            get_history("h01", "item1", "create", 0, {"task": task, "type": "text", "state": "draft"}),
+            get_history("h02", "item1", "item_lock", 1, {"lock_user": "user1", "lock_action": "edit"}),
+            get_history("h03", "item1", "update", 2, {"body_html": "<p>one</p><p>two</p>"}, 2),
+            get_history("h04", "item1", "update", 4, {"associations": {"featuremedia": FEATUREMEDIA}}, 3),
+            # History of item1 copied to its duplicate item2
+            get_history("h05", "item2", "create", 0, {"task": task, "type": "text"}, original_item_id="item1"),
+            get_history("h06", "item2", "update", 2, {"body_html": "<p>one</p>"}, 2, original_item_id="item1"),
+            get_history("h07", "item2", "duplicated_from", 6, {"task": task, "duplicate_id": "item1"}, 3),
+            get_history("h08", "item1", "publish", 8, {"state": "published"}, 4),
+        ]
+        self.second_history = [
+            # The last history entry of the previous run is received again
+            get_history("h08", "item1", "publish", 8, {"state": "published"}, 4),
+            get_history("h09", "item1", "item_unlock", 9, {"lock_user": None}),
+            get_history("h10", "item2", "update", 10, {"body_html": "<p>one</p><p>two</p><p>three</p>"}, 4),
+            get_history(
+                "h11",
+                "item1",
+                "correct",
+                11,
+                {"state": "corrected", "associations": {"featuremedia": moved_featuremedia}},
+                5,
+            ),
+            get_history("h12", "item1", "move", 12, {"task": {"desk": "desk2", "stage": "stage2", "user": "user1"}}, 6),
+            get_history("h13", "item2", "publish", 13, {"state": "published"}, 5),
+        ]
+
+    def _get_docs(self, service):
+        return {
+            item_id: {field: value for field, value in doc.items() if field not in ["_etag", "_created", "_updated"]}
+            for item_id, doc in service.docs.items()
+        }
+
+    def _generate(self, *runs):
+        with offline_statistics([]) as service:
+            for history in runs:
+                service.history = history
+                GenArchiveStatistics().generate_stats(None, None, 1000)
+
+            return self._get_docs(service)
+
+    def test_appended_timeline_equals_full_timeline(self):
+        full = self._generate(self.first_history + self.second_history)
+
+        with mock.patch.object(
+            GenArchiveStatistics, "append_timeline", autospec=True, side_effect=GenArchiveStatistics.append_timeline
+        ) as append_timeline:
+            appended = self._generate(self.first_history, self.second_history)
+
+        # Both items were appended to (rather than generated again) in the second run
+        self.assertEqual(append_timeline.call_count, 2)
+        self.assertEqual(appended, full)
+
+        item1 = full["item1"]
+        self.assertEqual(
+            [entry["operation"] for entry in item1["stats"]["timeline"]],
+            [
+                "create",
+                "item_lock",
+                "update",
+                "update",
+                "add_featuremedia",
+                "publish",
+                "item_unlock",
+                "correct",
+                "update_featuremedia_poi",
+                "move_from",
+                "move_to",
+            ],
+        )
+        self.assertEqual(
+            [entry["operation"] for entry in item1["stats"]["featuremedia_updates"]],
+            ["publish", "update_featuremedia_poi"],
+        )
+        self.assertEqual(item1["num_lock_sessions"], 1)
+        self.assertNotIn("processed_ids", item1["timeline_state"])
+
+        # Only the history of the duplicate itself is in its timeline
+        self.assertEqual(
+            [entry["history_id"] for entry in full["item2"]["stats"]["timeline"]],
+            ["h07", "h10", "h13"],
+        )
+        self.assertEqual(full["item2"]["par_count"], 3)
+
+    def test_out_of_order_history_generates_full_timeline(self):
+        late = [get_history("h14", "item1", "update", 3, {"headline": "late"}, 2)]
+
+        with mock.patch.object(
+            GenArchiveStatistics, "append_timeline", autospec=True, side_effect=GenArchiveStatistics.append_timeline
+        ) as append_timeline:
+            docs = self._generate(self.first_history, late)
+
+        self.assertEqual(append_timeline.call_count, 0)
+        self.assertEqual(
+            [entry["history_id"] for entry in docs["item1"]["stats"]["timeline"]],
+            ["h01", "h02", "h03", "h14", "h04", "h04", "h08"],
+        )
+
+
+class LeaseWorkerTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+    @mock.patch("analytics.stats.gen_archive_stats_lease")
+    def test_lease_worker_task_uses_run_options(self, lease_task):
+        self.app.config.update({"ANALYTICS_STATS_LEASE_EXPIRY": 120, "ANALYTICS_STATS_LEASE_MAX_DURATION": 900})
+
+        with self.app.app_context():
+            GenArchiveStatistics().start_lease_worker(250)
+
+        lease_task.apply_async.assert_called_once_with(
+            kwargs={"chunk_size": 250, "adaptive": False},
+            soft_time_limit=1020,
+            time_limit=1080,
+        )
+
+    @mock.patch("analytics.stats.gen_archive_stats_lease")
+    def test_lease_worker_hands_over_with_run_options(self, lease_task):
+        self.app.config["ANALYTICS_STATS_LEASE_MAX_DURATION"] = -1
+
+        with self.app.app_context():
+            with offline_statistics([]) as service:
+                with mock.patch.object(service, "get_leases", return_value=[{"_id": "lease1"}], create=True):
+                    self.assertTrue(GenArchiveStatistics().run_lease_worker(250, 1))
+
+        self.assertEqual(lease_task.apply_async.call_args[1]["kwargs"], {"chunk_size": 250, "adaptive": False})
+
+    @mock.patch("analytics.stats.gen_archive_stats_lease")
+    def test_lease_worker_with_adaptive_chunks(self, lease_task):
+        processed = []
+
+        def process_lease(lease, chunk_size, expiry, pool=None):
+            processed.append(chunk_size)
+            chunk_size.size = 400
+
+        with self.app.app_context():
+            with offline_statistics([]) as service:
+                with mock.patch.object(service, "claim_lease", side_effect=[{"_id": "lease1"}, None], create=True):
+                    with mock.patch.object(GenArchiveStatistics, "process_lease", side_effect=process_lease):
+                        self.assertFalse(GenArchiveStatistics().run_lease_worker(250, 1, True))
+
+                GenArchiveStatistics().start_lease_worker(processed[0])
+
+        # The adaptive chunk size is rebuilt by the worker, and queued using its current size
+        self.assertIsInstance(processed[0], AdaptiveChunkSize)
+        self.assertEqual(int(processed[0]), 400)
+
+        kwargs = lease_task.apply_async.call_args[1]["kwargs"]
+        self.assertEqual(kwargs, {"chunk_size": 400, "adaptive": True})
+        self.assertEqual(json.loads(json.dumps(kwargs)), kwargs)
+
+    @mock.patch.object(GenArchiveStatistics, "run_lease_worker")
+    def test_lease_worker_task(self, run_lease_worker):
+        with self.app.app_context():
+            gen_archive_stats_lease(chunk_size=400, adaptive=True, workers=4)
+
+        # Celery worker processes can't start the timeline process pool
+        run_lease_worker.assert_called_once_with(400, 1, True)
+
+    @mock.patch("analytics.stats.gen_archive_statistics.multiprocessing.current_process")
+    def test_no_timeline_pool_in_daemonic_process(self, current_process):
+        current_process.return_value.daemon = True
+        generator = GenArchiveStatistics()
+
+        with self.app.app_context():
+            self.assertIsNone(generator.get_timeline_pool(4))
+
+        self.assertEqual(generator.num_workers, 1)
+
+
+class RewritesTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        self.generator = GenArchiveStatistics()
+        self.published = datetime(2019, 3, 1, 8, 0, tzinfo=pytz.utc)
+
+    def _item(self, **updates):
+        return {"item": {}, "updates": updates}
+
+    def _doc(self, item_id, **fields):
+        return dict({"_id": item_id, "stats_type": "archive"}, **fields)
+
+    def test_get_rewrite_originals_follows_chain_in_bulk(self):
+        items = {
+            "item4": self._item(rewrite_of="item3"),
+            "item5": self._item(rewrite_of="item4"),
+        }
+
+        with offline_statistics([]) as service:
+            service.docs.update(
+                {
+                    "item1": self._doc("item1"),
+                    "item2": self._doc("item2", rewrite_of="item1"),
+                    "item3": self._doc("item3", rewrite_of="item2"),
+                }
+            )
+
+            with mock.patch.object(service, "get_items_by_ids", wraps=service.get_items_by_ids) as get_items_by_ids:
+                originals = self.generator.get_rewrite_originals(items)
+
+        # One request per level of the chain of rewrites
+        self.assertEqual(sorted(originals.keys()), ["item1", "item2", "item3"])
+        self.assertEqual(
+            [sorted(call[0][0]) for call in get_items_by_ids.call_args_list], [["item3"], ["item2"], ["item1"]]
+        )
+
+    def test_get_rewrite_originals_stops_at_family_root(self):
+        items = {"item4": self._item(rewrite_of="item3")}
+
+        with offline_statistics([]) as service:
+            service.docs.update(
+                {
+                    "item2": self._doc("item2", rewrite_of="item1", family_root_id="item1", family_depth=1),
+                    "item3": self._doc("item3", rewrite_of="item2", family_root_id="item1", family_depth=2),
+                }
+            )
+
+            originals = self.generator.get_rewrite_originals(items)
+
+        self.assertEqual(list(originals.keys()), ["item3"])
+
+    def test_get_rewrite_original_updates(self):
+        items = {
+            "item2": self._item(
+                rewrite_of="item1", time_to_first_publish=60, firstpublished=self.published + timedelta(minutes=10)
+            ),
+            "item3": self._item(
+                rewrite_of="item2", time_to_first_publish=60, firstpublished=self.published + timedelta(minutes=30)
+            ),
+            # Rewrites that have not been published are skipped
+            "item5": self._item(rewrite_of="item4", time_to_first_publish=0),
+        }
+        originals = {
+            "item1": self._doc("item1", firstpublished=self.published),
+            "item4": self._doc("item4", firstpublished=self.published),
+        }
+
+        original_updates = self.generator.get_rewrite_original_updates(items, originals)
+
+        # Originals in this chunk are updated in place, the others are returned
+        self.assertEqual(items["item2"]["updates"]["time_to_next_update_publish"], 1200)
+        self.assertEqual(original_updates, {"item1": {"time_to_next_update_publish": 600}})
+
+
+class RewriteFamilyTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        self.generator = GenArchiveStatistics()
+
+    def _item(self, **updates):
+        return {"item": {}, "updates": updates}
+
+    def _family(self, items):
+        return {
+            item_id: (item["updates"].get("family_root_id"), item["updates"].get("family_depth"))
+            for item_id, item in items.items()
+        }
+
+    def test_family_roots_of_rewrite_chain(self):
+        # item3 and item4 rewrite item2, which was generated in a previous chunk
+        items = {
+            "item3": self._item(rewrite_of="item2"),
+            "item4": self._item(rewrite_of="item3"),
+            "item5": self._item(),
+        }
+        originals = {"item2": {"_id": "item2", "rewrite_of": "item1", "family_root_id": "item1", "family_depth": 1}}
+
+        self.generator.set_family_roots(items, originals)
+
+        self.assertEqual(
+            self._family(items),
+            {"item3": ("item1", 2), "item4": ("item1", 3), "item5": ("item5", 0)},
+        )
+
+    def test_family_roots_of_originals_without_family(self):
+        # The originals were generated before ``family_root_id`` was stored
+        items = {"item3": self._item(rewrite_of="item2")}
+        originals = {
+            "item1": {"_id": "item1"},
+            "item2": {"_id": "item2", "rewrite_of": "item1"},
+        }
+
+        self.generator.set_family_roots(items, originals)
+
+        self.assertEqual(self._family(items), {"item3": ("item1", 2)})
+
+    def test_family_roots_of_incomplete_chains(self):
+        items = {
+            # The original of item2 was not found
+            "item2": self._item(rewrite_of="item1"),
+            # item4 and item5 rewrite each other
+            "item4": self._item(rewrite_of="item5"),
+            "item5": self._item(rewrite_of="item4"),
+        }
+
+        self.generator.set_family_roots(items, {})
+
+        self.assertEqual(self._family(items), {"item2": (None, None), "item4": (None, None), "item5": (None, None)})
+
+    def _family_history(self):
+        task = {"desk": "desk1", "stage": "stage1", "user": "user1"}
+        moved_featuremedia = dict(FEATUREMEDIA, poi={"x": 0.7, "y": 0.5})
+        return [
+            get_history("h01", "item1", "create", 0, {"task": task, "type": "text", "state": "draft"}),
+            get_history("h02", "item1", "update", 1, {"associations": {"featuremedia": FEATUREMEDIA}}, 2),
+            get_history("h03", "item1", "publish", 2, {"state": "published"}, 3),
+            get_history(
+                "h04",
+                "item2",
+                "create",
+                10,
+                {"task": task, "type": "text", "state": "draft", "rewrite_of": "item1"},
+            ),
+            get_history("h05", "item2", "update", 11, {"associations": {"featuremedia": FEATUREMEDIA}}, 2),
+            get_history("h06", "item2", "publish", 12, {"state": "published"}, 3),
+            get_history(
+                "h07",
+                "item2",
+                "correct",
+                13,
+                {"state": "corrected", "associations": {"featuremedia": moved_featuremedia}},
+                4,
+            ),
+            get_history("h08", "item3", "create", 20, {"task": task, "type": "text", "rewrite_of": "item2"}),
+        ]
+
+    def test_featuremedia_updates_of_family_across_chunks(self):
+        history = self._family_history()
+
+        # The items of the family are generated in different chunks, so the family is read from the statistics
+        with self.app.app_context():
+            with offline_statistics(history) as service:
+                with mock.patch.object(
+                    service, "get_items_by_family_root_ids", wraps=service.get_items_by_family_root_ids
+                ) as get_items_by_family_root_ids:
+                    self.generator.generate_stats(None, None, 3)
+
+                docs = service.docs
+
+        self.assertEqual(get_items_by_family_root_ids.call_args_list[0][0][0], {"item1"})
+        self.assertEqual(
+            {
+                item_id: (doc["family_root_id"], doc["family_depth"])
+                for item_id, doc in docs.items()
+                if doc["stats_type"] == "archive"
+            },
+            {"item1": ("item1", 0), "item2": ("item1", 1), "item3": ("item1", 2)},
+        )
+
+        family = docs["item1_family"]
+        self.assertEqual(family["stats_type"], "archive_family")
+        self.assertEqual(
+            [(entry["history_id"], entry["operation"]) for entry in family["stats"]["featuremedia_updates"]],
+            [("h03", "publish"), ("h07", "update_featuremedia_poi")],
+        )
+        self.assertEqual(family["num_featuremedia_updates"], 2)
+
+    def test_featuremedia_updates_of_family_without_family_roots(self):
+        history = self._family_history()
+
+        with self.app.app_context():
+            with offline_statistics(history[:7]) as service:
+                self.generator.generate_stats(None, None, 3)
+
+                # The statistics of item1 and item2 were generated before ``family_root_id`` was stored
+                for doc in service.docs.values():
+                    doc.pop("family_root_id", None)
+                    doc.pop("family_depth", None)
+
+                del service.docs["item1_family"]
+
+                service.history = history[7:]
+                self.generator.generate_stats(None, None, 3)
+
+                docs = service.docs
+
+        self.assertEqual((docs["item3"]["family_root_id"], docs["item3"]["family_depth"]), ("item1", 2))
+
+        # The family root and item2 are loaded by following the chain of rewrites
+        featuremedia_updates = docs["item1_family"]["stats"]["featuremedia_updates"]
+        self.assertEqual(
+            [(entry["history_id"], entry["operation"]) for entry in featuremedia_updates],
+            [("h03", "publish"), ("h07", "update_featuremedia_poi")],
+        )
@@ -0,0 +1,96 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from analytics.stats.common import STAT_TYPE, OPERATION
+from analytics.stats.plugins import StatsPlugin, stats_plugins
+
+
+def get_session_operation(entry):
+    """Get the operation stored with a lock session, for the timeline entries made while the item was locked"""
+
+    return {"operation": entry.get("operation"), "operation_created": entry.get("operation_created")}
+
+
+def init(stats):
+    # Clear the lock sessions as we'll recalculate them here
+    stats[STAT_TYPE.LOCK_SESSIONS] = []
+
+
+def resume(stats):
+    # Continue from the lock sessions of the previous run
+    stats[STAT_TYPE.LOCK_SESSIONS] = list(stats.get(STAT_TYPE.LOCK_SESSIONS) or [])
+
+
+def process(entry, updates, stats):
+    # Store temporary attribute for the sessions that are yet to be unlocked (one per user)
+    updates.setdefault("_open_lock_sessions", [])
+
+    task = entry.get("task") or {}
+    user = task.get("user")
+    operation = entry.get("operation")
+    operation_created = entry.get("operation_created")
+    open_sessions = updates["_open_lock_sessions"]
+
+    session = next((session for session in open_sessions if session.get("user") == user), None)
+
+    if operation == OPERATION.ITEM_LOCK and session is None:
+        open_sessions.append(
+            {
+                "user": user,
+                "desk": task.get("desk"),
+                "stage": task.get("stage"),
+                "started": operation_created,
+                "operations": [],
+            }
+        )
+
+    # Entries from all users are included, so the report can show what happened to the item during a session
+    for open_session in open_sessions:
+        open_session["operations"].append(get_session_operation(entry))
+
+    if operation == OPERATION.ITEM_UNLOCK and session is not None:
+        session["ended"] = operation_created
+        session["duration"] = (operation_created - session["started"]).total_seconds()
+
+        open_sessions.remove(session)
+        stats[STAT_TYPE.LOCK_SESSIONS].append(session)
+
+
+def complete(stats, updates):
+    num_lock_sessions = len(stats.get(STAT_TYPE.LOCK_SESSIONS) or [])
+    if num_lock_sessions < 1:
+        stats[STAT_TYPE.LOCK_SESSIONS] = None
+        updates["num_lock_sessions"] = 0
+    else:
+        updates["num_lock_sessions"] = num_lock_sessions
+
+
+class LockSessions(StatsPlugin):
+    """Generates the ``lock_sessions`` statistics, pairing the lock and unlock entries of each user
+
+    Used by the User Activity report, so the timeline entries don't have to be loaded and paired per request.
+    """
+
+    name = "lock_sessions"
+
+    def init_timeline(self, event):
+        init(event.stats)
+
+    def resume_timeline(self, event):
+        resume(event.stats)
+
+    def process(self, event):
+        process(event.entry, event.updates, event.stats)
+
+    def complete(self, event):
+        complete(event.stats, event.updates)
+
+
+stats_plugins.register(LockSessions())
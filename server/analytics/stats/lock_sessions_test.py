@@ -0,0 +1,90 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+from superdesk.utc import utcnow
+
+from analytics.stats.lock_sessions import LockSessions
+from analytics.stats.plugins import CompletedItem, ProcessedEntry, TimelineStats
+from analytics.stats.timeline import Task, TimelineEntry
+
+from datetime import timedelta
+
+
+class LockSessionsTestCase(TestCase):
+    def setUp(self):
+        self.now = utcnow().replace(microsecond=0)
+        self.plugin = LockSessions()
+
+    def _entry(self, operation, minutes, user="user1"):
+        return TimelineEntry(
+            operation=operation,
+            operation_created=self.now + timedelta(minutes=minutes),
+            task=Task(desk="desk1", stage="stage1", user=user),
+        )
+
+    def _process(self, entries, updates, stats):
+        for entry in entries:
+            self.plugin.process(ProcessedEntry(None, entry=entry, updates=updates, stats=stats))
+
+    def test_pairs_lock_and_unlock_per_user(self):
+        stats = {}
+        updates = {}
+        self.plugin.init_timeline(TimelineStats(None, stats=stats))
+        self._process(
+            [
+                self._entry("item_lock", 0),
+                self._entry("update", 5),
+                self._entry("item_lock", 6, user="user2"),
+                self._entry("item_unlock", 7, user="user2"),
+                self._entry("item_unlock", 10),
+                self._entry("item_unlock", 12),
+                self._entry("item_lock", 20),
+            ],
+            updates,
+            stats,
+        )
+        self.plugin.complete(CompletedItem(None, stats=stats, orig={}, updates=updates))
+
+        self.assertEqual(updates["num_lock_sessions"], 2)
+        user2, user1 = stats["lock_sessions"]
+
+        self.assertEqual(user1["user"], "user1")
+        self.assertEqual(user1["desk"], "desk1")
+        self.assertEqual(user1["started"], self.now)
+        self.assertEqual(user1["ended"], self.now + timedelta(minutes=10))
+        self.assertEqual(user1["duration"], 600)
+        self.assertEqual(
+            [operation["operation"] for operation in user1["operations"]],
+            ["item_lock", "update", "item_lock", "item_unlock", "item_unlock"],
+        )
+
+        self.assertEqual(user2["user"], "user2")
+        self.assertEqual(user2["duration"], 60)
+
+        # The last lock is still open
+        self.assertEqual([session["user"] for session in updates["_open_lock_sessions"]], ["user1"])
+
+    def test_resume_closes_open_session(self):
+        stats = {}
+        updates = {}
+        self.plugin.init_timeline(TimelineStats(None, stats=stats))
+        self._process([self._entry("item_lock", 0)], updates, stats)
+        self.plugin.complete(CompletedItem(None, stats=stats, orig={}, updates=updates))
+
+        self.assertIsNone(stats["lock_sessions"])
+        self.assertEqual(updates["num_lock_sessions"], 0)
+
+        self.plugin.resume_timeline(TimelineStats(None, stats=stats))
+        self._process([self._entry("item_unlock", 30)], updates, stats)
+        self.plugin.complete(CompletedItem(None, stats=stats, orig={}, updates=updates))
+
+        self.assertEqual(updates["num_lock_sessions"], 1)
+        self.assertEqual(stats["lock_sessions"][0]["duration"], 1800)
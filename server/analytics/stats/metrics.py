@@ -0,0 +1,188 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.logging import logger
+
+from collections import defaultdict
+from contextlib import contextmanager
+from flask import current_app as app
+import os
+import socket
+import time
+
+METRICS_PREFIX = "superdesk_analytics_stats"
+
+
+def get_process_id():
+    """Get the id of this process (``<hostname>:<pid>``), used to label the metrics it writes"""
+
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{{{}}}".format(",".join('{}="{}"'.format(name, value) for name, value in sorted(labels.items())))
+
+
+class StatsMetrics:
+    """Timers, counters and gauges for the stages of the statistics generation
+
+    Metrics are collected per process, and reset at the start of each run. The metrics from the
+    timeline worker processes are merged into the main process after each chunk (using ``snapshot`` and ``merge``).
+
+    Example:
+    ::
+
+        with metrics.timer("build_timelines"):
+            ...
+
+        for history_items in metrics.iter_timer(chunks, "fetch_history"):
+            metrics.incr("history_items", len(history_items))
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timings = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def iter_timer(self, iterable, stage):
+        """Iterate over ``iterable``, recording the time spent retrieving each value"""
+
+        iterator = iter(iterable)
+
+        while True:
+            started = time.perf_counter()
+
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+            yield value
+
+    def record(self, stage, seconds):
+        self.timings[stage] += seconds
+        self.calls[stage] += 1
+
+    def incr(self, counter, value=1):
+        self.counters[counter] += value
+
+    def set_gauge(self, gauge, value):
+        self.gauges[gauge] = value
+
+    def snapshot(self):
+        return {
+            "timings": dict(self.timings),
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
+
+    def merge(self, snapshot):
+        """Add the timings and counters from a ``snapshot`` (i.e. from a worker process)"""
+
+        for stage, seconds in snapshot["timings"].items():
+            self.timings[stage] += seconds
+
+        for stage, calls in snapshot["calls"].items():
+            self.calls[stage] += calls
+
+        for counter, value in snapshot["counters"].items():
+            self.counters[counter] += value
+
+    def to_prometheus(self, labels=None):
+        """Get the metrics in the Prometheus text exposition format
+
+        :param dict labels: Labels added to every metric
+        """
+
+        labels = labels or {}
+        lines = [
+            "# HELP {}_stage_seconds_total Time spent in each stage of the statistics generation".format(
+                METRICS_PREFIX
+            ),
+            "# TYPE {}_stage_seconds_total counter".format(METRICS_PREFIX),
+        ]
+        lines.extend(
+            "{}_stage_seconds_total{} {:.6f}".format(METRICS_PREFIX, format_labels(dict(labels, stage=stage)), seconds)
+            for stage, seconds in sorted(self.timings.items())
+        )
+
+        lines.extend(
+            [
+                "# HELP {}_stage_calls_total Number of times each stage of the statistics generation ran".format(
+                    METRICS_PREFIX
+                ),
+                "# TYPE {}_stage_calls_total counter".format(METRICS_PREFIX),
+            ]
+        )
+        lines.extend(
+            "{}_stage_calls_total{} {}".format(METRICS_PREFIX, format_labels(dict(labels, stage=stage)), calls)
+            for stage, calls in sorted(self.calls.items())
+        )
+
+        for counter, value in sorted(self.counters.items()):
+            lines.append("# TYPE {}_{}_total counter".format(METRICS_PREFIX, counter))
+            lines.append("{}_{}_total{} {}".format(METRICS_PREFIX, counter, format_labels(labels), value))
+
+        for gauge, value in sorted(self.gauges.items()):
+            lines.append("# TYPE {}_{} gauge".format(METRICS_PREFIX, gauge))
+            lines.append("{}_{}{} {}".format(METRICS_PREFIX, gauge, format_labels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path=None):
+        """Write the metrics to a Prometheus text file (i.e. for the node_exporter textfile collector)
+
+        Each process writes its own file, with the process id added to the file name
+        (i.e. ``stats.prom`` is written to ``stats_<hostname>_<pid>.prom``) and as the ``process`` label
+
+        :param str path: Path of the file, defaults to ANALYTICS_STATS_METRICS_FILE config.
+            Nothing is written if not defined
+        """
+
+        path = path or app.config.get("ANALYTICS_STATS_METRICS_FILE")
+
+        if not path:
+            return
+
+        process_id = get_process_id()
+        root, ext = os.path.splitext(path)
+        path = "{}_{}{}".format(root, process_id.replace(":", "_"), ext)
+
+        # Write to a temporary file first, so the file is never read while partially written
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+
+        try:
+            with open(tmp_path, "w") as metrics_file:
+                metrics_file.write(self.to_prometheus({"process": process_id}))
+
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Failed to write archive statistics metrics to {}".format(path))
+
+
+metrics = StatsMetrics()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.metrics import StatsMetrics, get_process_id
+
+import os
+import tempfile
+
+
+class StatsMetricsTestCase(TestCase):
+    def test_timers_and_counters(self):
+        metrics = StatsMetrics()
+
+        with metrics.timer("write"):
+            pass
+
+        self.assertEqual(list(metrics.iter_timer([[1, 2], [3]], "fetch_history")), [[1, 2], [3]])
+        metrics.incr("history_items", 3)
+
+        self.assertEqual(metrics.calls["write"], 1)
+        self.assertEqual(metrics.calls["fetch_history"], 3)
+        self.assertEqual(metrics.counters["history_items"], 3)
+
+    def test_merge(self):
+        metrics = StatsMetrics()
+        metrics.record("build_timelines", 1.5)
+
+        worker_metrics = StatsMetrics()
+        worker_metrics.record("build_timelines", 2.0)
+        worker_metrics.incr("items", 10)
+
+        metrics.merge(worker_metrics.snapshot())
+
+        self.assertEqual(metrics.timings["build_timelines"], 3.5)
+        self.assertEqual(metrics.calls["build_timelines"], 2)
+        self.assertEqual(metrics.counters["items"], 10)
+
+    def test_to_prometheus(self):
+        metrics = StatsMetrics()
+        metrics.record("write", 0.25)
+        metrics.incr("items", 5)
+        metrics.set_gauge("backlog_lag_seconds", 120)
+
+        lines = metrics.to_prometheus().splitlines()
+
+        self.assertIn('superdesk_analytics_stats_stage_seconds_total{stage="write"} 0.250000', lines)
+        self.assertIn('superdesk_analytics_stats_stage_calls_total{stage="write"} 1', lines)
+        self.assertIn("superdesk_analytics_stats_items_total 5", lines)
+        self.assertIn("superdesk_analytics_stats_backlog_lag_seconds 120", lines)
+
+    def test_write_file_per_process(self):
+        metrics = StatsMetrics()
+        metrics.incr("items", 5)
+        process_id = get_process_id()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics.write_file(os.path.join(tmp_dir, "stats.prom"))
+
+            self.assertEqual(os.listdir(tmp_dir), ["stats_{}.prom".format(process_id.replace(":", "_"))])
+
+            with open(os.path.join(tmp_dir, os.listdir(tmp_dir)[0]), "r") as metrics_file:
+                lines = metrics_file.read().splitlines()
+
+        self.assertIn('superdesk_analytics_stats_items_total{{process="{}"}} 5'.format(process_id), lines)
+
+        metrics.reset()
+        self.assertEqual(metrics.counters, {})
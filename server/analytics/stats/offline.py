@@ -0,0 +1,207 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+import superdesk
+from superdesk.utc import utcnow
+
+from analytics.stats.chunk_size import get_chunk_size
+from analytics.stats.activity_rollup import add_activity_counts
+from analytics.stats.duration_rollup import add_duration_totals
+
+from bson import json_util
+from dateutil.parser import parse as parse_date
+from eve.utils import config, document_etag
+from contextlib import contextmanager
+from copy import deepcopy
+
+
+class OfflineStatisticsService:
+    """Stand-in for the ``archive_statistics`` service, that stores the statistics in memory
+
+    Implements the methods used when generating statistics, reading archive_history documents
+    from the provided iterable instead of the ``archive_history`` collection.
+    No Mongo or Elasticsearch requests are made.
+
+    :param history: Iterable of archive_history documents (in ``_id`` order)
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.docs = {}
+        self.last_run = {}
+        self.generation = 0
+        self.activity_counts = {}
+        self.duration_totals = {}
+
+    def get_last_run(self):
+        return self.last_run
+
+    def set_last_run_id(self, entry_id, last_run=None, progress=None):
+        self.last_run.update({"guid": entry_id, "progress": progress})
+        return self.last_run
+
+    def get_generation(self):
+        return self.generation
+
+    def bump_generation(self):
+        self.generation += 1
+
+    def get_backlog_lag(self):
+        # All of the provided history is processed in a single run
+        return 0
+
+    def get_history_items(self, last_id, gte, item_id, chunk_size=0, end_id=None):
+        chunk = []
+
+        for history_item in self.history:
+            chunk.append(deepcopy(history_item))
+
+            if len(chunk) >= (get_chunk_size(chunk_size) or float("inf")):
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def get_items_by_ids(self, item_ids, chunk_size=500):
+        return {str(item_id): deepcopy(self.docs[item_id]) for item_id in set(item_ids) if item_id in self.docs}
+
+    def get_items_by_family_root_ids(self, root_ids, chunk_size=500):
+        root_ids = set(root_ids)
+
+        return {
+            str(item_id): deepcopy(doc)
+            for item_id, doc in self.docs.items()
+            if doc.get("family_root_id") in root_ids and doc.get("stats_type") == "archive"
+        }
+
+    def find_one(self, req, **lookup):
+        doc = self.docs.get(lookup.get(config.ID_FIELD))
+        return deepcopy(doc) if doc else None
+
+    def post(self, docs):
+        for doc in docs:
+            self._write(doc[config.ID_FIELD], deepcopy(doc))
+
+        return [doc[config.ID_FIELD] for doc in docs]
+
+    def patch(self, item_id, updates):
+        self._write(item_id, deepcopy(updates))
+
+    def _write(self, item_id, updates):
+        doc = self.docs.setdefault(item_id, {config.ID_FIELD: item_id, config.DATE_CREATED: utcnow()})
+        doc.update(updates)
+        doc[config.LAST_UPDATED] = utcnow()
+        doc[config.ETAG] = document_etag(doc)
+
+    def get_writer(self, failed_ids, conflict_ids=None):
+        return OfflineStatisticsWriter(self)
+
+    def update_activity_counts(self, counts):
+        add_activity_counts(self.activity_counts, counts)
+
+    def update_duration_totals(self, totals):
+        add_duration_totals(self.duration_totals, totals)
+
+
+class OfflineStatisticsWriter:
+    """Stand-in for the ``StatisticsBulkWriter``, writing to an ``OfflineStatisticsService``"""
+
+    def __init__(self, service):
+        self.service = service
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def create(self, doc):
+        self.pending[doc[config.ID_FIELD]] = doc
+
+    def update(self, item_id, updates, etag=None):
+        self.pending.setdefault(item_id, {}).update(updates)
+
+    def flush(self):
+        item_ids = list(self.pending.keys())
+
+        for item_id, updates in self.pending.items():
+            self.service.patch(item_id, updates)
+
+        self.pending = {}
+        return item_ids
+
+
+@contextmanager
+def offline_statistics(history):
+    """Replace the ``archive_statistics`` service with an ``OfflineStatisticsService``
+
+    Requires the ``archive_statistics`` resource to be registered (i.e. inside a Superdesk application context).
+
+    Example:
+    ::
+
+        with offline_statistics(history) as service:
+            GenArchiveStatistics().generate_stats(None, None, 1000)
+
+    :param history: Iterable of archive_history documents
+    """
+
+    resource = superdesk.resources["archive_statistics"]
+    original_service = resource.service
+    resource.service = OfflineStatisticsService(history)
+
+    try:
+        yield resource.service
+    finally:
+        resource.service = original_service
+
+
+def read_history_file(history_file):
+    """Read archive_history documents from a JSON lines file (i.e. exported using ``mongoexport``)
+
+    Supports MongoDB Extended JSON (``{"$oid": ...}`` and ``{"$date": ...}``) as well as ISO date strings
+
+    :param history_file: File object to read from
+    """
+
+    for line in history_file:
+        if not line.strip():
+            continue
+
+        history = json_util.loads(line)
+
+        for field in [config.DATE_CREATED, config.LAST_UPDATED]:
+            if isinstance(history.get(field), str):
+                history[field] = parse_date(history[field])
+
+        yield history
+
+
+def write_stats_file(docs, stats_file):
+    """Write statistics documents to a JSON lines file, using MongoDB Extended JSON (i.e. for ``mongoimport``)
+
+    :param docs: Iterable of statistics documents
+    :param stats_file: File object to write to
+    :return int: The number of documents written
+    """
+
+    num_docs = 0
+
+    for doc in docs:
+        stats_file.write(json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS))
+        stats_file.write("\n")
+        num_docs += 1
+
+    return num_docs
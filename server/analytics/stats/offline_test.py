@@ -0,0 +1,106 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics import init_app
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+from analytics.stats.offline import read_history_file, write_stats_file
+
+from bson import ObjectId, json_util
+from datetime import datetime, timedelta
+import io
+import os
+import pytz
+import tempfile
+
+
+def get_history(item_id, operation, minutes, update=None, version=1):
+    return {
+        "_id": ObjectId(),
+        "item_id": item_id,
+        "user_id": "user1",
+        "operation": operation,
+        "version": version,
+        "_created": datetime(2019, 3, 1, 8, 0, tzinfo=pytz.utc) + timedelta(minutes=minutes),
+        "update": update or {},
+    }
+
+
+class OfflineStatisticsTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+    def test_read_history_file(self):
+        history_id = ObjectId()
+        history_file = io.StringIO(
+            "\n".join(
+                [
+                    # Exported using mongoexport (MongoDB Extended JSON)
+                    json_util.dumps(get_history("item1", "create", 0)),
+                    "",
+                    '{"_id": {"$oid": "%s"}, "item_id": "item1", "operation": "update", '
+                    '"_created": "2019-03-01T08:05:00+0000"}' % history_id,
+                ]
+            )
+        )
+
+        history = list(read_history_file(history_file))
+
+        self.assertEqual(len(history), 2)
+        self.assertIsInstance(history[0]["_id"], ObjectId)
+        self.assertEqual(history[0]["_created"].replace(tzinfo=pytz.utc), datetime(2019, 3, 1, 8, 0, tzinfo=pytz.utc))
+        self.assertEqual(history[1]["_id"], history_id)
+        self.assertEqual(history[1]["_created"], datetime(2019, 3, 1, 8, 5, tzinfo=pytz.utc))
+
+    def test_write_stats_file(self):
+        docs = [
+            {"_id": "item1", "stats_type": "archive", "_created": datetime(2019, 3, 1, 8, 0, tzinfo=pytz.utc)},
+            {"_id": "item2", "stats_type": "archive", "stats": {"timeline": []}},
+        ]
+        stats_file = io.StringIO()
+
+        self.assertEqual(write_stats_file(docs, stats_file), 2)
+
+        lines = stats_file.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json_util.loads(lines[0])["_created"].replace(tzinfo=pytz.utc), docs[0]["_created"])
+        self.assertEqual(json_util.loads(lines[1]), docs[1])
+
+    def test_generate_stats_from_file(self):
+        task = {"desk": "desk1", "stage": "stage1", "user": "user1"}
+        history = [
+            get_history("item1", "create", 0, {"task": task, "type": "text", "state": "draft"}),
+            get_history("item2", "create", 1, {"task": task, "type": "text", "state": "draft"}),
+            get_history("item1", "update", 2, {"body_html": "<p>one</p><p>two</p>"}, 2),
+            get_history("item1", "publish", 3, {"state": "published"}, 3),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            from_file = os.path.join(tmp_dir, "archive_history.json")
+            to_file = os.path.join(tmp_dir, "archive_statistics.json")
+
+            with open(from_file, "w") as history_file:
+                history_file.write("\n".join(json_util.dumps(history_item) for history_item in history))
+
+            with self.app.app_context():
+                GenArchiveStatistics().generate_stats_from_file(from_file, to_file, 2)
+
+            with open(to_file, "r") as stats_file:
+                docs = {doc["_id"]: doc for doc in (json_util.loads(line) for line in stats_file)}
+
+        self.assertEqual(sorted(docs.keys()), ["item1", "item2"])
+        self.assertEqual(docs["item1"]["stats_type"], "archive")
+        self.assertEqual(
+            [entry["operation"] for entry in docs["item1"]["stats"]["timeline"]], ["create", "update", "publish"]
+        )
+        self.assertEqual(docs["item1"]["stats"]["timeline"][-1]["par_count"], 2)
+        self.assertEqual([entry["operation"] for entry in docs["item2"]["stats"]["timeline"]], ["create"])
@@ -0,0 +1,90 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.text_utils import get_par_count
+
+from collections import OrderedDict
+from flask import current_app as app
+import hashlib
+
+
+class ParCountCache:
+    """Least recently used cache of paragraph counts, keyed by a hash of the ``body_html``
+
+    The cache is per process (each worker process has its own cache).
+
+    :param int max_size: Maximum number of paragraph counts to store,
+        defaults to ANALYTICS_STATS_PAR_COUNT_CACHE_SIZE config (10000). The cache is disabled if 0
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._counts = OrderedDict()
+
+    @staticmethod
+    def get_hash(body_html):
+        return hashlib.blake2b(body_html.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get_max_size(self):
+        if self.max_size is None:
+            self.max_size = int(app.config.get("ANALYTICS_STATS_PAR_COUNT_CACHE_SIZE", 10000))
+
+        return self.max_size
+
+    def get_par_count(self, body_html, body_hash=None):
+        """Get the paragraph count of ``body_html``, only parsing the html if it is not in the cache
+
+        :param str body_html: The html to count the paragraphs of
+        :param str body_hash: The hash of ``body_html`` (from ``get_hash``), if already calculated
+        """
+
+        max_size = self.get_max_size()
+
+        if max_size <= 0:
+            self.misses += 1
+            return get_par_count(body_html)
+
+        if body_hash is None:
+            body_hash = self.get_hash(body_html)
+
+        try:
+            par_count = self._counts[body_hash]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self._counts.move_to_end(body_hash)
+            return par_count
+
+        self.misses += 1
+        par_count = self._counts[body_hash] = get_par_count(body_html)
+
+        if len(self._counts) > max_size:
+            self._counts.popitem(last=False)
+
+        return par_count
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._counts.clear()
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._counts),
+            "max_size": self.max_size,
+        }
+
+
+par_count_cache = ParCountCache()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.par_count import ParCountCache
+
+from unittest import mock
+
+ONE = "<p>one</p>"
+TWO = "<p>one</p><p>two</p>"
+THREE = "<p>one</p><p>two</p><p>three</p>"
+
+
+class ParCountCacheTestCase(TestCase):
+    @mock.patch("analytics.stats.par_count.get_par_count", side_effect=lambda body_html: body_html.count("<p>"))
+    def test_least_recently_used_counts_are_evicted(self, get_par_count):
+        cache = ParCountCache(max_size=2)
+
+        self.assertEqual(cache.get_par_count(ONE), 1)
+        self.assertEqual(cache.get_par_count(TWO), 2)
+
+        # ONE is now more recently used than TWO
+        self.assertEqual(cache.get_par_count(ONE), 1)
+        self.assertEqual(get_par_count.call_count, 2)
+
+        # Adding THREE evicts TWO
+        self.assertEqual(cache.get_par_count(THREE, ParCountCache.get_hash(THREE)), 3)
+        self.assertEqual(cache.get_par_count(ONE), 1)
+        self.assertEqual(cache.get_par_count(TWO), 2)
+
+        self.assertEqual(get_par_count.call_count, 4)
+        self.assertEqual(cache.info(), {"hits": 2, "misses": 4, "size": 2, "max_size": 2})
+
+        cache.clear()
+        self.assertEqual(cache.info(), {"hits": 0, "misses": 0, "size": 0, "max_size": 2})
+
+    @mock.patch("analytics.stats.par_count.get_par_count", return_value=2)
+    def test_disabled_cache(self, get_par_count):
+        self.app.config["ANALYTICS_STATS_PAR_COUNT_CACHE_SIZE"] = 0
+        cache = ParCountCache()
+
+        with self.app.app_context():
+            self.assertEqual(cache.get_par_count(TWO), 2)
+            self.assertEqual(cache.get_par_count(TWO), 2)
+
+        self.assertEqual(get_par_count.call_count, 2)
+        self.assertEqual(cache.info()["size"], 0)
+
+    def test_get_hash(self):
+        self.assertEqual(ParCountCache.get_hash(TWO), ParCountCache.get_hash("<p>one</p><p>two</p>"))
+        self.assertNotEqual(ParCountCache.get_hash(TWO), ParCountCache.get_hash(THREE))
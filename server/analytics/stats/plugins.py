@@ -0,0 +1,290 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.signals import signals
+
+from analytics.stats.metrics import metrics
+
+import itertools
+import time
+
+# The hooks of a ``StatsPlugin``, in the order they are called when generating statistics
+HOOKS = ["start", "generate", "init_timeline", "resume_timeline", "process", "complete", "finish"]
+
+# Hooks that are called for each timeline entry (and can be filtered by operation)
+ENTRY_HOOKS = ["generate", "process"]
+
+# Signals sent after the plugins of each hook, for receivers connected directly to the signals
+gen_stats_signals = {hook: signals.signal("gen_archive_statistics:{}".format(hook)) for hook in HOOKS}
+
+
+class StatsEvent:
+    """Base class for the typed objects passed to the hooks of a ``StatsPlugin``
+
+    :param sender: The ``GenArchiveStatistics`` instance generating the statistics
+    """
+
+    __slots__ = ["sender"]
+
+    # Attributes passed as keyword arguments to callbacks connected to the ``gen_stats_signals``
+    signal_fields = []
+
+    def __init__(self, sender, **kwargs):
+        self.sender = sender
+
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+    def to_kwargs(self):
+        return {field: getattr(self, field) for field in self.signal_fields}
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join("{}={!r}".format(field, getattr(self, field, None)) for field in self.signal_fields),
+        )
+
+
+class StatsBatch(StatsEvent):
+    """A chunk of archive_history items, passed to the ``start`` and ``finish`` hooks
+
+    :param list history_items: The archive_history items of the chunk
+    :param dict items: The items generated from the chunk, keyed by their id (None in the ``start`` hook)
+    :param list failed_ids: The ids of the items of this chunk that failed to be generated or stored
+    """
+
+    __slots__ = ["history_items", "items", "failed_ids"]
+
+    def __init__(self, sender, history_items, items=None, failed_ids=None):
+        super().__init__(sender, history_items=history_items, items=items, failed_ids=failed_ids)
+
+
+class EntryUpdate(StatsEvent):
+    """A timeline entry, passed to the ``generate`` hook to select the ``update`` attributes to store
+
+    :param TimelineEntry entry: The timeline entry
+    :param dict update: The attributes of the entry's ``update`` to store in the timeline
+    """
+
+    __slots__ = ["entry", "update"]
+    signal_fields = ["entry", "update"]
+
+
+class TimelineStats(StatsEvent):
+    """The statistics of an item, passed to the ``init_timeline`` and ``resume_timeline`` hooks
+
+    :param dict stats: The statistics of the item
+    """
+
+    __slots__ = ["stats"]
+    signal_fields = ["stats"]
+
+
+class ProcessedEntry(StatsEvent):
+    """A timeline entry that has been added to the new timeline, passed to the ``process`` hook
+
+    :param TimelineEntry entry: A copy of the timeline entry
+    :param list new_timeline: The new timeline of the item
+    :param dict updates: The updates for the statistics of the item
+    :param dict update: The original ``update`` of the archive_history item
+    :param dict stats: The statistics of the item
+    """
+
+    __slots__ = ["entry", "new_timeline", "updates", "update", "stats"]
+    signal_fields = ["entry", "new_timeline", "updates", "update", "stats"]
+
+
+class CompletedItem(StatsEvent):
+    """An item with a completed timeline, passed to the ``complete`` hook
+
+    :param dict stats: The statistics of the item
+    :param dict orig: The item being generated (with the existing statistics under ``item``,
+        and the statistics before this run under ``previous_stats``)
+    :param dict updates: The updates for the statistics of the item
+    """
+
+    __slots__ = ["stats", "orig", "updates"]
+    signal_fields = ["stats", "orig", "updates"]
+
+
+class StatsPlugin:
+    """Base class for plugins that generate custom statistics
+
+    Only the hooks that are implemented by the plugin are called. The ``generate`` and ``process`` hooks
+    can be limited to specific operations using the ``operations`` attribute.
+
+    Example:
+    ::
+
+        from analytics.stats.plugins import StatsPlugin, stats_plugins
+
+        class WordCount(StatsPlugin):
+            name = "word_count"
+            operations = {"process": [OPERATION.UPDATE, OPERATION.CORRECT]}
+
+            def process(self, event):
+                event.updates["extra"]["word_count"] = ...
+
+        stats_plugins.register(WordCount())
+    """
+
+    #: Name used in the metrics, defaults to the class name
+    name = None
+
+    #: Plugins with a lower order are called first (plugins with the same order are called in registration order)
+    order = 100
+
+    #: Operations to call the ``generate`` and ``process`` hooks for, keyed by the hook (all operations if not set)
+    operations = {}
+
+    def get_name(self):
+        return self.name or self.__class__.__name__
+
+    def get_hooks(self):
+        """Get the hooks implemented by this plugin"""
+
+        return [hook for hook in HOOKS if getattr(type(self), hook) is not getattr(StatsPlugin, hook)]
+
+    def get_handler(self, hook):
+        return getattr(self, hook)
+
+    def start(self, batch):
+        pass
+
+    def generate(self, event):
+        pass
+
+    def init_timeline(self, event):
+        pass
+
+    def resume_timeline(self, event):
+        pass
+
+    def process(self, event):
+        pass
+
+    def complete(self, event):
+        pass
+
+    def finish(self, batch):
+        pass
+
+
+class CallbackStatsPlugin(StatsPlugin):
+    """Plugin calling callbacks with the same arguments as the ``gen_stats_signals`` (see ``connect_stats_signals``)
+
+    :param dict callbacks: The callbacks, keyed by the hook
+    """
+
+    def __init__(self, callbacks):
+        self.callbacks = {hook: callback for hook, callback in callbacks.items() if callback}
+        callback = next(iter(self.callbacks.values()), None)
+        self.name = "{}.{}".format(getattr(callback, "__module__", ""), getattr(callback, "__qualname__", ""))
+
+    def get_hooks(self):
+        return [hook for hook in HOOKS if hook in self.callbacks]
+
+    def get_handler(self, hook):
+        callback = self.callbacks[hook]
+        return lambda event: callback(event.sender, **event.to_kwargs())
+
+
+class StatsPluginRegistry:
+    """Ordered registry of the ``StatsPlugin`` instances used when generating statistics
+
+    The time spent in each hook of each plugin is recorded in the ``metrics``
+    (i.e. ``plugin:featuremedia_updates:process``).
+    """
+
+    def __init__(self):
+        self._plugins = []
+        self._handlers = {}
+        self._sequence = itertools.count()
+
+    def register(self, plugin, order=None):
+        """Register a plugin
+
+        :param StatsPlugin plugin: The plugin to register
+        :param int order: Order of the plugin, defaults to the ``order`` attribute of the plugin
+        """
+
+        self._plugins.append((plugin.order if order is None else order, next(self._sequence), plugin))
+        self._plugins.sort(key=lambda registered: registered[:2])
+        self._handlers = {}
+
+    def unregister(self, plugin):
+        self._plugins = [registered for registered in self._plugins if registered[2] is not plugin]
+        self._handlers = {}
+
+    def get_plugins(self):
+        return [plugin for _, _, plugin in self._plugins]
+
+    def get_handlers(self, hook, operation=None):
+        """Get the handlers of ``hook`` (and their metrics stage), for the timeline entry ``operation``"""
+
+        key = (hook, operation)
+
+        try:
+            return self._handlers[key]
+        except KeyError:
+            pass
+
+        handlers = []
+        for plugin in self.get_plugins():
+            if hook not in plugin.get_hooks():
+                continue
+
+            operations = (plugin.operations or {}).get(hook)
+            if hook in ENTRY_HOOKS and operations is not None and operation not in operations:
+                continue
+
+            handlers.append((plugin.get_handler(hook), "plugin:{}:{}".format(plugin.get_name(), hook)))
+
+        self._handlers[key] = handlers
+        return handlers
+
+    def has_handlers(self, hook, operation=None):
+        return len(self.get_handlers(hook, operation)) > 0 or bool(gen_stats_signals[hook].receivers)
+
+    def dispatch(self, hook, event, operation=None):
+        """Call ``hook`` of each plugin with ``event``, then send the signal of ``hook``
+
+        :param str hook: The hook to call
+        :param StatsEvent event: The typed object passed to the plugins
+        :param str operation: The operation of the timeline entry (for the ``generate`` and ``process`` hooks)
+        """
+
+        for handler, stage in self.get_handlers(hook, operation):
+            started = time.perf_counter()
+
+            try:
+                handler(event)
+            finally:
+                metrics.record(stage, time.perf_counter() - started)
+
+        signal = gen_stats_signals[hook]
+        if signal.receivers:
+            kwargs = event.to_kwargs()
+
+            for receiver in signal.receivers_for(event.sender):
+                started = time.perf_counter()
+
+                try:
+                    receiver(event.sender, **kwargs)
+                finally:
+                    metrics.record(
+                        "signal:{}:{}.{}".format(
+                            hook, getattr(receiver, "__module__", ""), getattr(receiver, "__qualname__", "")
+                        ),
+                        time.perf_counter() - started,
+                    )
+
+
+stats_plugins = StatsPluginRegistry()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.common import OPERATION
+from analytics.stats.plugins import StatsPlugin, StatsPluginRegistry, CallbackStatsPlugin, ProcessedEntry
+
+
+class StatsPluginRegistryTestCase(TestCase):
+    def _dispatch_process(self, registry, operation):
+        registry.dispatch(
+            "process",
+            ProcessedEntry(None, entry={"operation": operation}, new_timeline=[], updates={}, update={}, stats={}),
+            operation,
+        )
+
+    def test_plugin_order_and_operations(self):
+        calls = []
+
+        class PublishPlugin(StatsPlugin):
+            operations = {"process": [OPERATION.PUBLISH]}
+
+            def process(self, event):
+                calls.append(("publish", event.entry["operation"]))
+
+        class FirstPlugin(StatsPlugin):
+            order = 10
+
+            def process(self, event):
+                calls.append(("first", event.entry["operation"]))
+
+        registry = StatsPluginRegistry()
+        registry.register(PublishPlugin())
+        registry.register(FirstPlugin())
+
+        self._dispatch_process(registry, OPERATION.UPDATE)
+        self._dispatch_process(registry, OPERATION.PUBLISH)
+
+        self.assertEqual(
+            calls,
+            [
+                ("first", OPERATION.UPDATE),
+                ("first", OPERATION.PUBLISH),
+                ("publish", OPERATION.PUBLISH),
+            ],
+        )
+        self.assertEqual(registry.get_handlers("complete"), [])
+
+    def test_callback_plugin(self):
+        calls = []
+
+        def on_process(sender, entry, new_timeline, updates, update, stats):
+            calls.append(entry["operation"])
+
+        registry = StatsPluginRegistry()
+        registry.register(CallbackStatsPlugin({"process": on_process, "complete": None}))
+
+        self._dispatch_process(registry, OPERATION.UPDATE)
+
+        self.assertEqual(calls, [OPERATION.UPDATE])
+        self.assertEqual(registry.get_handlers("complete"), [])
@@ -0,0 +1,280 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import Command, get_resource_service, Option
+from superdesk.logging import logger
+from superdesk.services import BaseService
+from superdesk.utc import utcnow
+from superdesk.celery_task_utils import get_lock_id
+from superdesk.lock import lock, unlock, touch
+
+from analytics.stats.plugins import StatsPlugin
+
+from elasticsearch.helpers import bulk
+from eve.utils import config
+from flask import current_app as app
+from pymongo import UpdateOne
+from copy import deepcopy
+
+# Seconds before the ``gen_archive_statistics`` lock expires, if it is not renewed while rebuilding a rollup
+LOCK_EXPIRY = 610
+
+# Elasticsearch returns a conflict when a newer revision of a rollup document was already indexed
+VERSION_CONFLICT = 409
+
+
+class RollupService(BaseService):
+    """Base service for the rollups of the archive statistics, maintained while generating statistics
+
+    Rollup documents are keyed by a tuple of the ``key_fields``. They are updated in Mongo using update operators
+    (i.e. ``$inc``) so multiple processes can update the same document, and are then indexed in Elasticsearch
+    with their ``revision`` as an external version, so an older revision never replaces a newer one.
+    """
+
+    #: The attributes of the rollup documents that form their key
+    key_fields = []
+
+    #: The archive_statistics attributes loaded when rebuilding the rollup
+    projection = {}
+
+    #: The Mongo update for rollup documents that are no longer in any statistics, when rebuilding the rollup
+    reset_update = {}
+
+    def get_rollup_id(self, key):
+        raise NotImplementedError()
+
+    def add_item_stats(self, totals, stats):
+        """Add the rollup values of the ``stats`` of an item to ``totals`` (keyed by the rollup key)"""
+
+        raise NotImplementedError()
+
+    def get_rebuild_updates(self, value):
+        """Get the attributes of a rollup document from its ``value`` in the totals from ``add_item_stats``"""
+
+        raise NotImplementedError()
+
+    def write(self, updates):
+        """Apply the Mongo update operators (keyed by the rollup key) in bulk, and index the updated documents"""
+
+        if not updates:
+            return
+
+        now = utcnow()
+        ids = []
+        requests = []
+
+        for key, update in updates.items():
+            update.setdefault("$set", {})[config.LAST_UPDATED] = now
+            update.setdefault("$inc", {})["revision"] = 1
+            update.setdefault("$setOnInsert", {}).update(dict(zip(self.key_fields, key)))
+            update["$setOnInsert"][config.DATE_CREATED] = now
+
+            ids.append(self.get_rollup_id(key))
+            requests.append(UpdateOne({config.ID_FIELD: ids[-1]}, update, upsert=True))
+
+        collection = app.data.get_mongo_collection(self.datasource)
+
+        try:
+            collection.bulk_write(requests, ordered=False)
+        except Exception:
+            logger.exception("Failed to write {} {} documents".format(len(requests), self.datasource))
+            return
+
+        self._index(list(collection.find({config.ID_FIELD: {"$in": ids}})))
+
+    def _index(self, docs):
+        elastic = app.data.elastic
+
+        try:
+            index = elastic.get_index(self.datasource)
+            _, errors = bulk(
+                elastic.elastic(self.datasource),
+                [
+                    {
+                        "_index": index,
+                        "_id": doc[config.ID_FIELD],
+                        "_source": {field: value for field, value in doc.items() if field != config.ID_FIELD},
+                        "version": doc.get("revision") or 1,
+                        "version_type": "external",
+                    }
+                    for doc in docs
+                ],
+                refresh=app.config.get("ANALYTICS_STATS_BULK_REFRESH", True),
+                raise_on_error=False,
+            )
+        except Exception:
+            logger.exception("Failed to index {} {} documents".format(len(docs), self.datasource))
+            return
+
+        for error in errors or []:
+            result = next(iter(error.values()), {})
+
+            if result.get("status") != VERSION_CONFLICT:
+                logger.error(
+                    "Failed to index {} document {}. error={}".format(
+                        self.datasource, result.get(config.ID_FIELD), result.get("error")
+                    )
+                )
+
+    def rebuild(self, chunk_size=1000, lock_name=None):
+        """Generate the whole rollup from the archive statistics
+
+        Rollup documents that are not in any statistics anymore are updated with the ``reset_update``
+
+        :param int chunk_size: Number of statistics documents loaded per Mongo request
+        :param str lock_name: The lock to renew while loading the statistics
+        :return int: The number of rollup documents (None if the lock was lost)
+        """
+
+        totals = {}
+        num_docs = 0
+        cursor = app.data.get_mongo_collection("archive_statistics").find(
+            {"stats_type": "archive"}, self.projection, batch_size=chunk_size
+        )
+
+        for doc in cursor:
+            self.add_item_stats(totals, doc.get("stats") or {})
+            num_docs += 1
+
+            if num_docs % (chunk_size * 100) == 0:
+                logger.info("Loaded the statistics of {} items for {}".format(num_docs, self.datasource))
+
+                if lock_name and not touch(lock_name, expire=LOCK_EXPIRY):
+                    logger.warning("Lost the generate archive statistics lock, stopping")
+                    return None
+
+        collection = app.data.get_mongo_collection(self.datasource)
+        existing_ids = {doc[config.ID_FIELD] for doc in collection.find({}, {config.ID_FIELD: 1})}
+
+        updates = {}
+        for key, value in totals.items():
+            existing_ids.discard(self.get_rollup_id(key))
+            updates[key] = {"$set": self.get_rebuild_updates(value)}
+
+            if len(updates) >= chunk_size:
+                self.write(updates)
+                updates = {}
+
+        # Rollup documents that are not in any statistics anymore
+        for doc in collection.find({config.ID_FIELD: {"$in": list(existing_ids)}}):
+            updates[tuple(doc.get(field) for field in self.key_fields)] = deepcopy(self.reset_update)
+
+            if len(updates) >= chunk_size:
+                self.write(updates)
+                updates = {}
+
+        self.write(updates)
+        get_resource_service("archive_statistics").bump_generation()
+
+        return len(totals)
+
+
+class RollupPlugin(StatsPlugin):
+    """Base plugin maintaining a rollup while generating statistics
+
+    The rollup totals of each item are the difference made by its new statistics (see ``get_item_totals``),
+    so items that are generated again (i.e. recomputed, or when history entries arrive out of order)
+    are not counted twice. The totals are written in the finish hook, only for the items that were stored successfully.
+    """
+
+    #: The config enabling this rollup
+    config_name = None
+
+    def __init__(self):
+        self.start()
+
+    def is_enabled(self):
+        return app.config.get(self.config_name, False)
+
+    def start(self, batch=None):
+        self.item_totals = {}
+
+    def get_item_totals(self, event):
+        """Get the rollup totals added (or removed) by the new statistics of the ``CompletedItem``"""
+
+        raise NotImplementedError()
+
+    def add_totals(self, totals, other):
+        raise NotImplementedError()
+
+    def is_empty(self, value):
+        return not value
+
+    def update(self, totals):
+        """Write the rollup ``totals`` of the generated items"""
+
+        raise NotImplementedError()
+
+    def complete(self, event):
+        if not self.is_enabled():
+            return
+
+        # Replaces the totals from a previous attempt (i.e. if the item was modified by another process)
+        self.item_totals[event.orig["_id"]] = self.get_item_totals(event)
+
+    def pop_totals(self, failed_ids=None):
+        """Get the rollup totals of the items that were not in ``failed_ids``, then clear them"""
+
+        failed_ids = set(failed_ids or [])
+        totals = {}
+
+        for item_id, item_totals in self.item_totals.items():
+            if item_id not in failed_ids:
+                self.add_totals(totals, item_totals)
+
+        self.item_totals = {}
+        return {key: value for key, value in totals.items() if not self.is_empty(value)}
+
+    def finish(self, batch):
+        # Only the items that failed in this chunk, as an item that failed in a previous chunk
+        # may have been stored successfully in this one
+        totals = self.pop_totals(batch.failed_ids)
+
+        if totals:
+            self.update(totals)
+
+
+class RebuildRollup(Command):
+    """Base command to generate a rollup from all archive statistics (see ``RollupService.rebuild``)
+
+    Runs with the ``gen_archive_statistics`` lock, so the statistics are not generated at the same time.
+    """
+
+    #: The name of the rollup resource
+    resource = None
+
+    option_list = [Option("--chunk-size", "-c", dest="chunk_size", default=1000)]
+
+    def run(self, chunk_size=1000):
+        try:
+            chunk_size = max(int(chunk_size), 1)
+        except (ValueError, TypeError):
+            chunk_size = 1000
+
+        lock_name = get_lock_id("analytics", "gen_archive_statistics")
+        if not lock(lock_name, expire=LOCK_EXPIRY):
+            logger.info("Generate archive statistics task is running, try again when it has finished.")
+            return
+
+        started = utcnow()
+
+        try:
+            num_docs = get_resource_service(self.resource).rebuild(chunk_size, lock_name)
+        finally:
+            unlock(lock_name)
+
+        if num_docs is None:
+            return
+
+        logger.info(
+            "Finished generating {} {} documents. Duration: {} seconds".format(
+                num_docs, self.resource, int((utcnow() - started).total_seconds())
+            )
+        )
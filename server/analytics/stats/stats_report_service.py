@@ -10,6 +10,7 @@
 
 from flask import current_app as app
 from analytics.base_report import BaseReportService
+from analytics.base_report.report_cache import get_stats_watermark
 
 
 class StatsReportService(BaseReportService):
@@ -18,6 +19,9 @@ class StatsReportService(BaseReportService):
     def get_elastic_index(self, types):
         return app.config.get("STATISTICS_ELASTIC_INDEX") or app.config.get("STATISTICS_MONGO_DBNAME") or "statistics"
 
+    def get_cache_watermark(self, params, args):
+        return get_stats_watermark()
+
     def get_es_stats_type(self, query, params):
         query["must"].append({"term": {"stats_type": "archive"}})
 
@@ -162,3 +166,34 @@ class StatsReportService(BaseReportService):
                     }
                 }
             )
+
+
+class ActivityRollupReportService(BaseReportService):
+    """Base service for reports using the hourly activity counts (``archive_statistics_activity``)
+
+    Each document is the number of timeline entries in an hour for a desk, stage, user and operation,
+    so reports use plain aggregations summing the ``count`` (instead of nested aggregations over ``stats.timeline``).
+    Requires ANALYTICS_STATS_ACTIVITY_ROLLUP config to be enabled.
+    """
+
+    repos = ["archive_statistics_activity"]
+    date_filter_field = "hour"
+    histogram_source_field = "hour"
+
+    def get_elastic_index(self, types):
+        return app.config.get("STATISTICS_ELASTIC_INDEX") or app.config.get("STATISTICS_MONGO_DBNAME") or "statistics"
+
+    def get_cache_watermark(self, params, args):
+        return get_stats_watermark()
+
+    def _get_filters(self, repos, invisible_stages):
+        return None
+
+    def _es_filter_desks(self, query, desks, must, params):
+        query[must].append({"terms": {"desk": desks}})
+
+    def _es_filter_users(self, query, users, must, params):
+        query[must].append({"terms": {"user": users}})
+
+    def _es_filter_stages(self, query, stages, must, params):
+        query[must].append({"terms": {"stage": stages}})
@@ -0,0 +1,235 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk import Command, command, get_resource_service, Option
+from superdesk.logging import logger
+from superdesk.utc import utcnow
+from superdesk.celery_task_utils import get_lock_id
+from superdesk.lock import lock, unlock, touch
+
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+from analytics.stats.metrics import metrics
+
+from bson import ObjectId
+from eve.utils import config
+from flask import current_app as app
+from datetime import timedelta
+import time
+
+# Expiry of the generate statistics lock, renewed after each poll
+LOCK_EXPIRY = 610
+
+# Seconds to wait before processing a history item, as the ObjectIds of concurrently
+# inserted history items (generated by different processes) are only ordered by the second
+SETTLE_SECONDS = 2
+
+# Maximum number of seconds to wait between polls of archive_history
+MAX_POLL_INTERVAL = 1
+
+
+class StreamArchiveStatistics(Command):
+    """Continuously generate statistics for archive documents as archive_history documents are created
+
+    Polls archive_history for new documents (using the id of the last processed item),
+    and generates the statistics in micro-batches. A batch is processed when it reaches
+    ``batch-size`` items, or when the oldest item in the batch has waited ``max-latency`` seconds.
+
+    This command holds the ``analytics:gen_archive_statistics`` lock while running,
+    so the scheduled ``analytics:gen_archive_statistics`` task is skipped.
+
+    Options
+    ::
+
+        -m, --max-latency (defaults to ANALYTICS_STATS_STREAM_MAX_LATENCY config, 30):
+        Maximum number of seconds a history item waits before it is processed
+        -b, --batch-size (defaults to ANALYTICS_STATS_STREAM_BATCH_SIZE config, 1000):
+        Maximum number of archive history items to process per batch
+        -w, --workers (defaults to 1):
+        Number of processes used to generate the item timelines
+        -t, --max-duration (defaults to 0):
+        Stop after this many seconds (runs until interrupted if 0)
+
+    Example:
+    ::
+
+        $ python manage.py analytics:stream_archive_statistics
+        $ python manage.py analytics:stream_archive_statistics -m 10 -b 500
+        $ python manage.py analytics:stream_archive_statistics -max-latency 10 -batch-size 500
+        $ python manage.py analytics:stream_archive_statistics -w 4
+        $ python manage.py analytics:stream_archive_statistics -t 3600
+
+    """
+
+    option_list = [
+        Option("--max-latency", "-m", dest="max_latency", default=None),
+        Option("--batch-size", "-b", dest="batch_size", default=None),
+        Option("--workers", "-w", dest="workers", default=1),
+        Option("--max-duration", "-t", dest="max_duration", default=0),
+    ]
+
+    def run(self, max_latency=None, batch_size=None, workers=1, max_duration=0):
+        try:
+            max_latency = float(
+                max_latency if max_latency is not None else app.config.get("ANALYTICS_STATS_STREAM_MAX_LATENCY", 30)
+            )
+        except (ValueError, TypeError):
+            max_latency = 30.0
+
+        try:
+            batch_size = max(
+                int(
+                    batch_size if batch_size is not None else app.config.get("ANALYTICS_STATS_STREAM_BATCH_SIZE", 1000)
+                ),
+                1,
+            )
+        except (ValueError, TypeError):
+            batch_size = 1000
+
+        try:
+            workers = max(int(workers), 1)
+        except (ValueError, TypeError):
+            workers = 1
+
+        try:
+            max_duration = float(max_duration or 0)
+        except (ValueError, TypeError):
+            max_duration = 0
+
+        lock_name = get_lock_id("analytics", "gen_archive_statistics")
+        if not lock(lock_name, expire=LOCK_EXPIRY):
+            logger.info("Generate archive statistics task is already running.")
+            return
+
+        logger.info(
+            "Starting to stream archive statistics. max_latency={}. batch_size={}. workers={}".format(
+                max_latency, batch_size, workers
+            )
+        )
+
+        try:
+            self.stream_stats(max_latency, batch_size, workers, max_duration, lock_name)
+        except KeyboardInterrupt:
+            logger.info("Stopped streaming archive statistics")
+        except Exception:
+            logger.exception("Failed to stream archive stats")
+        finally:
+            unlock(lock_name)
+
+    def stream_stats(self, max_latency, batch_size, workers=1, max_duration=0, lock_name=None):
+        """Poll archive_history and generate the statistics in micro-batches
+
+        :param float max_latency: Maximum seconds a history item waits before it is processed
+        :param int batch_size: Maximum number of history items per batch
+        :param int workers: Number of processes used to generate the item timelines
+        :param float max_duration: Stop after this many seconds (0 to run until interrupted)
+        :param str lock_name: The lock to renew after each poll
+        """
+
+        statistics_service = get_resource_service("archive_statistics")
+        generator = GenArchiveStatistics()
+        pool = generator.get_timeline_pool(workers)
+        metrics.reset()
+
+        last_run = statistics_service.get_last_run()
+        last_entry_id = last_run.get("guid") or None
+        started = utcnow()
+
+        progress = {
+            "started": started,
+            "updated": None,
+            "completed": None,
+            "start_id": last_entry_id,
+            "num_chunks": 0,
+            "num_history_items": 0,
+            "num_items": 0,
+            "num_failed": 0,
+        }
+
+        batch = []
+        batch_started = None
+        failed_ids = []
+
+        try:
+            while not max_duration or (utcnow() - started).total_seconds() < max_duration:
+                if lock_name and not touch(lock_name, expire=LOCK_EXPIRY):
+                    logger.warning("Lost the generate archive statistics lock, stopping")
+                    break
+
+                fetch_after = batch[-1][config.ID_FIELD] if batch else last_entry_id
+                history_items = self.get_new_history_items(fetch_after, batch_size - len(batch))
+
+                if history_items and not batch:
+                    batch_started = time.monotonic()
+                batch.extend(history_items)
+
+                if batch and (len(batch) >= batch_size or time.monotonic() - batch_started >= max_latency):
+                    num_items = generator.process_history_items(batch, failed_ids, pool)
+                    last_entry_id = batch[-1][config.ID_FIELD]
+
+                    logger.info(
+                        "Processed {}/{} history/item records, oldest waited {} seconds".format(
+                            len(batch), num_items, int(time.monotonic() - batch_started)
+                        )
+                    )
+
+                    progress.update(
+                        {
+                            "updated": utcnow(),
+                            "num_chunks": progress["num_chunks"] + 1,
+                            "num_history_items": progress["num_history_items"] + len(batch),
+                            "num_items": progress["num_items"] + num_items,
+                            "num_failed": progress["num_failed"] + len(failed_ids),
+                        }
+                    )
+                    statistics_service.set_last_run_id(last_entry_id, last_run, progress)
+                    generator.write_metrics()
+
+                    if failed_ids:
+                        logger.warning("Failed to generate stats for items {}".format(", ".join(failed_ids)))
+                        failed_ids = []
+
+                    batch = []
+                    batch_started = None
+                    continue
+
+                if len(history_items) < 1:
+                    # Nothing new, wait before polling again
+                    wait = MAX_POLL_INTERVAL
+                    if batch:
+                        wait = min(wait, max(max_latency - (time.monotonic() - batch_started), 0))
+                    time.sleep(wait)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+            # Items fetched but not processed will be fetched again by the next run
+            progress["completed"] = utcnow()
+            statistics_service.set_last_run_id(last_entry_id, last_run, progress)
+
+    def get_new_history_items(self, last_id, limit):
+        """Get up to ``limit`` archive_history items created after ``last_id``
+
+        Items created in the last ``SETTLE_SECONDS`` seconds are not returned yet,
+        so items inserted concurrently with a lower id are not skipped
+        """
+
+        if limit < 1:
+            return []
+
+        end_id = str(ObjectId.from_datetime(utcnow() - timedelta(seconds=SETTLE_SECONDS)))
+        chunks = get_resource_service("archive_statistics").get_history_items(last_id, None, None, limit, end_id=end_id)
+
+        try:
+            return next(chunks, [])
+        finally:
+            chunks.close()
+
+
+command("analytics:stream_archive_statistics", StreamArchiveStatistics())
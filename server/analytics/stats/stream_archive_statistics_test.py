@@ -0,0 +1,96 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+from superdesk.utc import utcnow
+
+from analytics import init_app
+from analytics.stats.gen_archive_statistics import GenArchiveStatistics
+from analytics.stats.offline import offline_statistics
+from analytics.stats.stream_archive_statistics import StreamArchiveStatistics, SETTLE_SECONDS
+
+from bson import ObjectId
+from datetime import timedelta
+from unittest import mock
+
+
+class StreamArchiveStatisticsTestCase(TestCase):
+    def setUp(self):
+        with self.app.app_context():
+            init_app(self.app)
+
+        self.history = [{"_id": "h{}".format(index), "item_id": "item{}".format(index)} for index in range(1, 6)]
+        self.batches = []
+
+    def _get_new_history_items(self, last_id, limit):
+        history_ids = [history["_id"] for history in self.history]
+        start = history_ids.index(last_id) + 1 if last_id else 0
+        return self.history[start : start + limit]
+
+    def _process_history_items(self, history_items, failed_ids, pool=None):
+        self.batches.append([history["_id"] for history in history_items])
+        return len(history_items)
+
+    def _stream(self, max_latency, batch_size):
+        command = StreamArchiveStatistics()
+
+        with self.app.app_context():
+            with offline_statistics([]) as service:
+                with mock.patch.object(command, "get_new_history_items", side_effect=self._get_new_history_items):
+                    with mock.patch.object(
+                        GenArchiveStatistics, "process_history_items", side_effect=self._process_history_items
+                    ):
+                        with mock.patch.object(GenArchiveStatistics, "write_metrics") as write_metrics:
+                            # Stop streaming once there are no new history items
+                            with mock.patch("analytics.stats.stream_archive_statistics.time.sleep") as sleep:
+                                sleep.side_effect = KeyboardInterrupt
+                                with self.assertRaises(KeyboardInterrupt):
+                                    command.stream_stats(max_latency, batch_size)
+
+                # The metrics are written after each batch
+                self.assertEqual(write_metrics.call_count, len(self.batches))
+
+                return service.get_last_run()
+
+    def test_process_full_batches(self):
+        last_run = self._stream(max_latency=600, batch_size=2)
+
+        # The last history item waits for the batch to fill (or the max latency)
+        self.assertEqual(self.batches, [["h1", "h2"], ["h3", "h4"]])
+        self.assertEqual(last_run["guid"], "h4")
+        self.assertEqual(last_run["progress"]["num_chunks"], 2)
+        self.assertEqual(last_run["progress"]["num_history_items"], 4)
+        self.assertIsNotNone(last_run["progress"]["completed"])
+
+    def test_process_batch_after_max_latency(self):
+        last_run = self._stream(max_latency=0, batch_size=10)
+
+        self.assertEqual(self.batches, [["h1", "h2", "h3", "h4", "h5"]])
+        self.assertEqual(last_run["guid"], "h5")
+
+    def test_get_new_history_items_waits_to_settle(self):
+        def get_history_items(last_id, gte, item_id, chunk_size=0, end_id=None):
+            self.assertEqual((last_id, chunk_size), ("h1", 3))
+
+            # Only history items created at least SETTLE_SECONDS ago are returned
+            settled = utcnow() - ObjectId(end_id).generation_time
+            self.assertGreaterEqual(settled, timedelta(seconds=SETTLE_SECONDS))
+            self.assertLess(settled, timedelta(seconds=SETTLE_SECONDS + 2))
+
+            yield self.history[1:4]
+            yield self.history[4:]
+
+        with self.app.app_context():
+            with offline_statistics([]) as service:
+                with mock.patch.object(service, "get_history_items", side_effect=get_history_items):
+                    history_items = StreamArchiveStatistics().get_new_history_items("h1", 3)
+                    self.assertEqual(StreamArchiveStatistics().get_new_history_items("h1", 0), [])
+
+        self.assertEqual([history["_id"] for history in history_items], ["h2", "h3", "h4"])
@@ -0,0 +1,218 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from typing import Any, Dict, Optional
+from datetime import datetime
+
+
+class SlotsDict:
+    """Base class for the compact (``__slots__``) models used when generating statistics
+
+    Attributes can also be accessed using the ``dict`` interface (i.e. ``entry["task"]`` or ``entry.get("task")``),
+    so statistics plugins can use these models the same way as the stored documents.
+    Attributes that are not defined in ``__slots__`` are stored in an extra dictionary.
+    Unset attributes are treated as missing keys.
+    """
+
+    __slots__ = ("_extra",)
+
+    def __init__(self, values=None, **kwargs):
+        self._extra = None
+
+        for key, value in (values or {}).items():
+            self[key] = value
+
+        for key, value in kwargs.items():
+            self[key] = value
+
+    @classmethod
+    def _is_field(cls, key):
+        return key in cls.__slots__ and key != "_extra"
+
+    def __getitem__(self, key):
+        if self._is_field(key):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+
+        if self._extra is None:
+            raise KeyError(key)
+
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if self._is_field(key):
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._is_field(key):
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (SlotsDict, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, SlotsDict) else other)
+
+        return NotImplemented
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.to_dict())
+
+    def keys(self):
+        keys = [key for key in self.__slots__ if self._is_field(key) and hasattr(self, key)]
+
+        if self._extra:
+            keys.extend(self._extra.keys())
+
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+
+        del self[key]
+        return value
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def copy(self):
+        """Shallow copy of this model"""
+
+        copy = self.__class__()
+        for key in self.keys():
+            copy[key] = self[key]
+
+        return copy
+
+    def to_dict(self):
+        """Serialise to the dictionary stored in the statistics document"""
+
+        return {key: value.to_dict() if isinstance(value, SlotsDict) else value for key, value in self.items()}
+
+
+class Task(SlotsDict):
+    """The desk, stage and user of a timeline entry"""
+
+    __slots__ = ("user", "desk", "stage")
+
+    user: Optional[str]
+    desk: Optional[str]
+    stage: Optional[str]
+
+    def __init__(self, values=None, **kwargs):
+        self.user = None
+        self.desk = None
+        self.stage = None
+        super().__init__(values, **kwargs)
+
+
+class TimelineEntry(SlotsDict):
+    """An entry in the timeline of an item, generated from an archive_history document"""
+
+    __slots__ = (
+        "history_id",
+        "operation",
+        "operation_created",
+        "task",
+        "update",
+        "version",
+        "original_item_id",
+        "par_count",
+        "_processed",
+        "_auto_generated",
+    )
+
+    history_id: Any
+    operation: str
+    operation_created: datetime
+    task: Task
+    update: Dict[str, Any]
+    version: int
+    original_item_id: str
+    par_count: int
+    _processed: bool
+    _auto_generated: bool
+
+    @classmethod
+    def from_dict(cls, values):
+        """Create a timeline entry from an entry stored in the statistics document"""
+
+        entry = cls(values)
+
+        if isinstance(entry.get("task"), dict):
+            entry["task"] = Task(entry["task"])
+
+        return entry
+
+    def copy(self):
+        """Shallow copy of this entry, with a copy of its task
+
+        The ``update`` dictionary is shared with the copy, so it must be replaced rather than modified
+        """
+
+        copy = super().copy()
+
+        if isinstance(copy.get("task"), SlotsDict):
+            copy["task"] = copy["task"].copy()
+
+        return copy
+
+
+def serialise_entries(entries):
+    """Serialise a list of timeline entries to the dictionaries stored in the statistics document"""
+
+    return [entry.to_dict() if isinstance(entry, SlotsDict) else entry for entry in entries]
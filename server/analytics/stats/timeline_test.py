@@ -0,0 +1,63 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+#  Copyright 2013-2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.stats.timeline import Task, TimelineEntry, serialise_entries
+
+import pickle
+
+
+class TimelineEntryTestCase(TestCase):
+    def test_dict_interface(self):
+        entry = TimelineEntry(operation="create", task=Task(user="user1"), update={})
+
+        self.assertEqual(entry["operation"], "create")
+        self.assertEqual(entry.get("version"), None)
+        self.assertNotIn("version", entry)
+        self.assertEqual(entry.setdefault("par_count", 0), 0)
+        self.assertEqual(entry.pop("original_item_id", None), None)
+
+        entry["lock_user"] = "user1"
+        self.assertEqual(entry.pop("lock_user"), "user1")
+        self.assertNotIn("lock_user", entry)
+
+        self.assertEqual(dict(entry["task"]), {"user": "user1", "desk": None, "stage": None})
+
+    def test_copy(self):
+        entry = TimelineEntry(operation="move_from", task=Task(user="user1"), update={"headline": "Test"})
+        copy = entry.copy()
+
+        copy["operation"] = "move_to"
+        copy["task"]["desk"] = "desk1"
+
+        self.assertEqual(entry["operation"], "move_from")
+        self.assertIsNone(entry["task"]["desk"])
+        self.assertIs(entry["update"], copy["update"])
+
+    def test_serialise(self):
+        entry = TimelineEntry.from_dict(
+            {"history_id": "h1", "task": {"user": "user1", "desk": "desk1"}, "_processed": True, "extra": 1}
+        )
+
+        self.assertIsInstance(entry["task"], Task)
+        self.assertEqual(pickle.loads(pickle.dumps(entry)), entry)
+        self.assertEqual(
+            serialise_entries([entry, {"history_id": "h2"}]),
+            [
+                {
+                    "history_id": "h1",
+                    "task": {"user": "user1", "desk": "desk1", "stage": None},
+                    "_processed": True,
+                    "extra": 1,
+                },
+                {"history_id": "h2"},
+            ],
+        )
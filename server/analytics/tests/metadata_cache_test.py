@@ -0,0 +1,87 @@
+# -*- coding: utf-8; -*-
+#
+# This file is part of Superdesk.
+#
+# Copyright 2018 Sourcefabric z.u. and contributors.
+#
+# For the full copyright and license information, please see the
+# AUTHORS and LICENSE files distributed with this source code, or
+# at https://www.sourcefabric.org/superdesk/license
+
+from superdesk.tests import TestCase
+
+from analytics.metadata_cache import MetadataCache
+
+from unittest import mock
+
+
+class MetadataCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache = MetadataCache()
+        self.loader = mock.Mock(side_effect=lambda: "7.{}.0".format(self.loader.call_count))
+        self.cache.loaders = {"elastic_version": self.loader, "desks": mock.Mock(return_value=[])}
+
+    def test_values_are_cached_until_expired(self):
+        self.app.config["ANALYTICS_METADATA_CACHE_TTL"] = 60
+
+        with mock.patch("analytics.metadata_cache.time.monotonic", return_value=100):
+            self.assertEqual(self.cache.get("elastic_version"), "7.1.0")
+            self.assertEqual(self.cache.get("elastic_version"), "7.1.0")
+
+        with mock.patch("analytics.metadata_cache.time.monotonic", return_value=161):
+            self.assertEqual(self.cache.get("elastic_version"), "7.2.0")
+
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_invalidate(self):
+        self.cache.get("elastic_version")
+        self.cache.get("desks")
+
+        self.cache.invalidate("desks")
+        self.cache.get("elastic_version")
+        self.cache.get("desks")
+        self.assertEqual(self.loader.call_count, 1)
+        self.assertEqual(self.cache.loaders["desks"].call_count, 2)
+
+        self.cache.invalidate()
+        self.cache.get("elastic_version")
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_disabled(self):
+        self.app.config["ANALYTICS_METADATA_CACHE_TTL"] = 0
+
+        self.cache.get("elastic_version")
+        self.cache.get("elastic_version")
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_shared_versions(self):
+        versions = {}
+        shared = mock.Mock()
+        shared.get.side_effect = versions.get
+        shared.incr.side_effect = lambda name: versions.update({name: versions.get(name, 0) + 1})
+
+        cache = MetadataCache(shared)
+        other_process = MetadataCache(shared)
+        desks = mock.Mock(return_value=[])
+        cache.loaders = other_process.loaders = {"desks": desks}
+
+        cache.get("desks")
+        other_process.get("desks")
+        self.assertEqual(desks.call_count, 2)
+
+        # The desks were changed through the API of another process
+        other_process.invalidate("desks")
+        cache.get("desks")
+        cache.get("desks")
+        self.assertEqual(desks.call_count, 3)
+
+    def test_shared_versions_unavailable(self):
+        shared = mock.Mock()
+        shared.get.side_effect = ConnectionError("Redis is not available")
+        cache = MetadataCache(shared)
+        cache.loaders = {"elastic_version": self.loader}
+
+        # Falls back to the values cached by this process
+        cache.get("elastic_version")
+        cache.get("elastic_version")
+        self.assertEqual(self.loader.call_count, 1)
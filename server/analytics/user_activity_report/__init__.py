@@ -9,7 +9,11 @@
 # at https://www.sourcefabric.org/superdesk/license
 
 import superdesk
-from .user_acitivity_report import UserActivityReportResource, UserActivityReportService
+from .user_acitivity_report import (
+    UserActivityReportResource,
+    UserActivityReportService,
+    UserActivityLockSessionsReportService,
+)
 from analytics.common import register_report
 
 
@@ -19,7 +23,11 @@ def init_app(app):
         return
 
     endpoint_name = "user_activity_report"
-    service = UserActivityReportService(endpoint_name, backend=superdesk.get_backend())
+    # Use the lock sessions (generated with the statistics) if they are enabled
+    if app.config.get("ANALYTICS_STATS_LOCK_SESSIONS", False):
+        service = UserActivityLockSessionsReportService(endpoint_name, backend=superdesk.get_backend())
+    else:
+        service = UserActivityReportService(endpoint_name, backend=superdesk.get_backend())
     UserActivityReportResource(endpoint_name, app=app, service=service)
 
     register_report("user_activity_report", "user_activity_report")
@@ -8,12 +8,15 @@
 # AUTHORS and LICENSE files distributed with this source code, or
 # at https://www.sourcefabric.org/superdesk/license
 
+from superdesk import get_resource_service
 from superdesk.resource import Resource
 
 from analytics.stats.stats_report_service import StatsReportService
+from analytics.stats.common import STAT_TYPE
 from analytics.common import REPORT_CONFIG, CHART_TYPES, DATE_FILTERS
 
 from eve_elastic.elastic import parse_date
+from datetime import datetime
 
 
 class UserActivityReportResource(Resource):
@@ -115,3 +118,110 @@ class UserActivityReportService(StatsReportService):
             return {}
 
         return report
+
+
+def get_timestamp(date):
+    return (date if isinstance(date, datetime) else parse_date(date)).timestamp()
+
+
+class UserActivityLockSessionsReportService(UserActivityReportService):
+    """User Activity Report using the ``lock_sessions`` statistics, instead of pairing the timeline entries
+
+    Only the lock sessions (with the operations made during each session) are loaded for each item.
+    The full timeline is only loaded for the item selected in the report (``params.timeline_item``).
+    Used when ANALYTICS_STATS_LOCK_SESSIONS config is enabled.
+    """
+
+    def generate_elastic_query(self, args):
+        query = super().generate_elastic_query(args)
+        query["source"]["_source"] = ["slugline", "headline", "stats.{}".format(STAT_TYPE.LOCK_SESSIONS)]
+
+        return query
+
+    def _es_filter_user_locks(self, query, user, must, params):
+        lt, gte, time_zone = self._es_get_date_filters(params)
+
+        query[must].append(
+            {
+                "nested": {
+                    "path": "stats.lock_sessions",
+                    "query": {
+                        "bool": {
+                            "must": [
+                                {"term": {"stats.lock_sessions.user": user}},
+                                {"range": {"stats.lock_sessions.started": {"lt": lt, "time_zone": time_zone}}},
+                                {"range": {"stats.lock_sessions.ended": {"gte": gte, "time_zone": time_zone}}},
+                            ]
+                        }
+                    },
+                }
+            }
+        )
+
+    def get_item_timeline(self, item_id):
+        """Get the timeline of the item selected in the report, from the statistics in Mongo"""
+
+        doc = get_resource_service("archive_statistics").find_one(req=None, _id=item_id) or {}
+        timeline = (doc.get("stats") or {}).get(STAT_TYPE.TIMELINE) or []
+
+        for entry in timeline:
+            entry["operation_timestamp"] = get_timestamp(entry.get("operation_created"))
+
+        return timeline
+
+    def generate_report(self, docs, args):
+        report = {"items": [], "min": 0, "max": 0}
+        params = args.get("params") or {}
+        user_id = (params.get("must") or {}).get("user_locks")
+
+        for doc in docs:
+            sessions = [
+                session
+                for session in (doc.get("stats") or {}).get(STAT_TYPE.LOCK_SESSIONS) or []
+                if session.get("user") == user_id
+            ]
+
+            if len(sessions) < 1:
+                continue
+
+            activity = []
+            operations = {}
+
+            for session in sessions:
+                activity.append([get_timestamp(session["started"]), get_timestamp(session["ended"])])
+
+                # Operations made during overlapping sessions are only added once
+                for operation in session.get("operations") or []:
+                    timestamp = get_timestamp(operation.get("operation_created"))
+                    operations[(timestamp, operation.get("operation"))] = {
+                        "operation": operation.get("operation"),
+                        "operation_timestamp": timestamp,
+                    }
+
+            activity.sort()
+
+            if report["min"] == 0 or activity[0][0] < report["min"]:
+                report["min"] = activity[0][0]
+
+            if report["max"] == 0 or max(lock[1] for lock in activity) > report["max"]:
+                report["max"] = max(lock[1] for lock in activity)
+
+            if params.get("timeline_item") and params["timeline_item"] == doc.get("_id"):
+                timeline = self.get_item_timeline(doc["_id"])
+            else:
+                timeline = [operations[key] for key in sorted(operations.keys())]
+
+            report["items"].append(
+                {
+                    "_id": doc.get("_id"),
+                    "timeline": timeline,
+                    "slugline": doc.get("slugline") or "",
+                    "headline": doc.get("headline") or "",
+                    "activity": activity,
+                }
+            )
+
+        if len(report["items"]) < 1:
+            return {}
+
+        return report
@@ -265,3 +265,41 @@ Feature: Desk Transition Stats
             {"entered_operation": "deschedule", "exited_operation": "spike"}
         ]}
         """
+
+    @auth
+    Scenario: Append transition stats from new history entries
+        When we post to "/archive" with success
+        """
+        {
+            "type": "text", "headline": "show my content", "version": 0,
+            "task": {"user": "#CONTEXT_USER_ID#", "desk": "#desks._id#", "stage": "#desks.incoming_stage#"}
+        }
+        """
+        When we post to "/desks" with success
+        """
+        [{"name": "Finance", "desk_type": "production" }]
+        """
+        When we post to "/archive/#archive._id#/move"
+        """
+        [{"task": {"desk": "#desks._id#", "stage": "#desks.incoming_stage#"}}]
+        """
+        Then we get OK response
+        When we generate stats from archive history
+        When we get "/archive_statistics/#archive._id#"
+        Then we get stats
+        """
+        {"desk_transitions": [
+            {"entered_operation": "create", "exited_operation": "move_from"}
+        ]}
+        """
+        When we spike "#archive._id#"
+        Then we get OK response
+        When we generate stats from archive history
+        When we get "/archive_statistics/#archive._id#"
+        Then we get stats
+        """
+        {"desk_transitions": [
+            {"entered_operation": "create", "exited_operation": "move_from"},
+            {"entered_operation": "move_to", "exited_operation": "spike"}
+        ]}
+        """